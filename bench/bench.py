@@ -0,0 +1,538 @@
+"""
+Benchmarks for the websocket and VS client hot paths
+
+Runs under CPython (through hostcompat) and the MicroPython unix port:
+
+    python bench/bench.py --out before.json
+    micropython bench/bench.py --out before.json
+
+then, after a change,
+
+    python bench/bench.py --out after.json
+    python bench/bench.py --compare before.json after.json
+
+Each case runs a fixed number of iterations, `--repeat` times, and keeps
+the fastest run, which is the least disturbed by the rest of the machine.
+Results are written as JSON with the time per operation in microseconds.
+Each case is also run once more on its own to see how much heap one
+operation takes: on MicroPython everything it allocates (gc.mem_alloc()
+with the collector off), on CPython the peak tracemalloc sees, since the
+host frees as it goes.
+--compare prints both runs side by side and exits with status 1 if any
+case got slower by more than --threshold percent (10 by default).
+
+Sockets are replaced with in-memory sinks and sources, except for the
+handshake, which goes through a real loopback connection. So the numbers
+are the library's own cost, not the network's.
+"""
+
+import sys
+import gc
+import time
+
+_here = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, _here + '/../enes100')
+sys.path.insert(0, _here + '/../hostcompat')
+if sys.implementation.name != 'micropython':
+    import mphost
+    mphost.install()
+
+import json
+from array import array
+import socket
+import _thread
+import uwebsockets as web
+import vsprotocol as vs
+import posehistory
+import geofence
+import markers
+import looptimer
+import Enes100
+
+# Loopback port for the handshake case
+HANDSHAKE_PORT = 17755
+
+# Payload sizes for each frame length encoding
+FRAME_SIZES = (('7bit', 16), ('7bit', 125), ('16bit', 126), ('16bit', 1024),
+               ('16bit', 65535), ('64bit', 65536))
+
+ARUCO = b'{"op": "aruco", "aruco": {"visible": true, "x": 1.234, "y": 0.567, "theta": -1.571}}'
+# Same pose, but the exponent sends it down the ujson path
+ARUCO_JSON = b'{"op": "aruco", "aruco": {"visible": true, "x": 1.234, "y": 0.567, "theta": -1.571e0}}'
+# Same pose as a binary pose record
+ARUCO_BINARY = bytearray(vs.POSE_SIZE)
+vs.pack_pose(ARUCO_BINARY, True, 3, 1.234, 0.567, -1.571)
+
+# Other markers subscribed to, and the binary frame with their records after the team's own
+MARKER_IDS = tuple(range(100, 116))
+MARKERS_BINARY = bytearray(vs.POSE_SIZE * (1 + len(MARKER_IDS)))
+MARKERS_BINARY[:vs.POSE_SIZE] = ARUCO_BINARY
+for _i, _marker in enumerate(MARKER_IDS):
+    vs.pack_pose(memoryview(MARKERS_BINARY)[vs.POSE_SIZE * (_i + 1):], True, _marker,
+                 0.25 * _i, 1.0, 0.5)
+
+
+class Sink:
+    """Socket that discards everything written to it."""
+
+    def write(self, buf, n=None):
+        return len(buf) if n is None else n
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+class Capture(Sink):
+    """Socket that keeps everything written to it."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, buf, n=None):
+        if n is None:
+            n = len(buf)
+        self.data += bytes(buf[:n])
+        return n
+
+
+class Source(Sink):
+    """Socket that replays the same bytes forever. Reads must not straddle the end."""
+
+    def __init__(self, data):
+        self.data = memoryview(bytes(data))
+        self.pos = 0
+
+    def readinto(self, buf, n=None):
+        if n is None:
+            n = len(buf)
+        pos = self.pos
+        if pos == len(self.data):
+            pos = 0
+        buf[:n] = self.data[pos:pos + n]
+        self.pos = pos + n
+        return n
+
+    def read(self, n):
+        buf = bytearray(n)
+        self.readinto(buf, n)
+        return bytes(buf)
+
+
+def server_frames(opcode, payload, count=1, masked=False):
+    """count frames as the VS (or, masked, a client) would put them on the wire."""
+    out = Capture()
+    ws = web.WebsocketClient(out) if masked else web.Websocket(out)
+    for _ in range(count):
+        ws.write_frame(opcode, payload)
+    return out.data
+
+
+def fragmented_frames(count, size):
+    """One message the VS split into count frames of size bytes."""
+    ws = web.Websocket(Capture())
+    buf = bytearray(count * (size + web.MAX_HEADER_SIZE))
+    n = 0
+    for i in range(count):
+        n = ws._pack_frame(buf, n, web.OP_CONT if i else web.OP_BYTES, bytes(size), i == count - 1)
+    return buf[:n]
+
+
+def new_robot(sock, marker_ids=()):
+    """An Enes100 set up as begin() would leave it, on a fake socket."""
+    robot = Enes100.Enes100()
+    # nothing answers pings here, keepalive would take the link down mid-run
+    robot.link_timeout_ms = 0
+    robot.pose_timeout_ms = 0
+    robot._set_team('Bench', 'DATA', 3, 1116, marker_ids)
+    robot._rx = bytearray(robot._rx_size)
+    robot._scan = vs.scan_buffer()
+    robot.history = posehistory.PoseHistory()
+    robot._init_outbox()
+    robot._use_ws(web.WebsocketClient(sock))
+    return robot
+
+
+# Cases, each a function taking an iteration count. setup code runs once
+# outside the timed loop by building the closure.
+
+def case_write_frame(size):
+    ws = web.WebsocketClient(Sink())
+    payload = bytes(size)
+
+    def run(n):
+        for _ in range(n):
+            ws.write_frame(web.OP_BYTES, payload)
+    return run
+
+
+def case_send_many(count, size):
+    ws = web.WebsocketClient(Sink())
+    payloads = [bytes(size)] * count
+
+    def run(n):
+        for _ in range(n):
+            ws.send_many(payloads)
+    return run
+
+
+def case_read_frame(size, masked=False):
+    ws = web.WebsocketClient(Source(server_frames(web.OP_BYTES, bytes(size), masked=masked)))
+
+    def run(n):
+        for _ in range(n):
+            ws.read_frame(size)
+    return run
+
+
+def case_read_frame_into(size):
+    ws = web.WebsocketClient(Source(server_frames(web.OP_BYTES, bytes(size))))
+    buf = bytearray(size)
+
+    def run(n):
+        for _ in range(n):
+            ws.read_frame_into(buf)
+    return run
+
+
+def case_recv_into(data):
+    ws = web.WebsocketClient(Source(data))
+    buf = bytearray(web.RX_BUF_SIZE)
+
+    def run(n):
+        for _ in range(n):
+            ws.recv_into(buf)
+    return run
+
+
+def case_dumps(packet):
+    def run(n):
+        for _ in range(n):
+            json.dumps(packet)
+    return run
+
+
+def case_send_packet(packet):
+    robot = new_robot(Sink())
+
+    def run(n):
+        for _ in range(n):
+            robot._send_packet(packet)
+    return run
+
+
+def case_mission(message, binary=False):
+    # mission() and the sender flushing it, what a team's mission call costs
+    robot = new_robot(Sink())
+    robot._binary = binary
+
+    def run(n):
+        for _ in range(n):
+            robot.mission('MAGNETISM', message)
+            robot._flush_outbox()
+    return run
+
+
+def case_print(binary=False):
+    robot = new_robot(Sink())
+    robot._binary = binary
+    robot.print_interval_ms = 0
+
+    def run(n):
+        for _ in range(n):
+            robot.print('x = 1.23, y = 0.45')
+            robot._flush_outbox()
+    return run
+
+
+def case_geofence(regions):
+    # a full table of regions and waypoints, checked against a pose inside none of them
+    fence = geofence.Geofence()
+    for i in range(regions):
+        x = 0.25 * i
+        if i % 4 == 0:
+            fence.add_box('box%d' % i, x, 1.2, x + 0.2, 1.8)
+        elif i % 4 == 1:
+            fence.add_circle('circle%d' % i, x, 1.5, 0.2)
+        elif i % 4 == 2:
+            fence.add_heading('heading%d' % i, x, 0.1)
+        else:
+            fence.add_waypoint('waypoint%d' % i, x, 1.5, 0.1)
+
+    def run(n):
+        for _ in range(n):
+            fence.update(1.3, 0.5, -1.0)
+    return run
+
+
+def case_markers_within(count):
+    # a full table, a third of it within reach of the query
+    table = markers.MarkerTable(MARKER_IDS[:count])
+    for i in range(count):
+        table.update(MARKER_IDS[i], True, 0.25 * i, 1.0, 0.0, time.ticks_ms())
+    out = array('H', [0] * count)
+
+    def run(n):
+        for _ in range(n):
+            table.within(1.0, 1.0, 0.6, out, 60000)
+    return run
+
+
+def case_loop_tick():
+    # the bookkeeping run_loop() does around each call of the user's function
+    timer = looptimer.LoopTimer(50, True)
+    timer.start(time.ticks_us())
+
+    def run(n):
+        for _ in range(n):
+            now = time.ticks_us()
+            timer.tick(now, now)
+            timer.done(now)
+    return run
+
+
+def case_decode_json(frame):
+    # what the receive loop did before aruco frames were scanned in place:
+    # decode the whole frame with json, then look the fields up
+    robot = new_robot(Sink())
+    buf = bytearray(frame)
+    size = len(frame)
+
+    def run(n):
+        for _ in range(n):
+            data = json.loads(str(buf[:size], 'utf-8'))
+            if data.get("op") == "aruco":
+                aruco = data.get("aruco", {})
+                robot.is_visible = aruco.get("visible", False)
+                robot.x = aruco.get("x", -1.0)
+                robot.y = aruco.get("y", -1.0)
+                robot.theta = aruco.get("theta", -1.0)
+    return run
+
+
+def case_handle_frame(frame, marker_ids=()):
+    robot = new_robot(Sink(), marker_ids)
+    # a VS sending records has agreed to the binary format
+    robot._records = robot._binary = vs.is_record(frame, len(frame))
+    buf = bytearray(frame)
+    size = len(frame)
+
+    def run(n):
+        for _ in range(n):
+            robot._handle_frame(buf, size)
+    return run
+
+
+def case_receive(frame):
+    # The body of Enes100._websocket_client: read a frame, decode it
+    robot = new_robot(Source(server_frames(web.OP_TEXT, frame)))
+    ws = robot.ws
+    rx = robot._rx
+
+    def run(n):
+        for _ in range(n):
+            opcode, size = ws.recv_into(rx)
+            robot._handle_frame(rx, size)
+    return run
+
+
+class HandshakeServer:
+    """Loopback server answering n websocket upgrades, one connection at a time."""
+
+    def __init__(self, port=HANDSHAKE_PORT):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(socket.getaddrinfo('127.0.0.1', port)[0][-1])
+        self.sock.listen(1)
+        self.port = port
+        self.remaining = 0
+
+    def serve(self, n):
+        self.remaining = n
+        _thread.start_new_thread(self._serve, ())
+
+    def _serve(self):
+        while self.remaining > 0:
+            conn, _ = self.sock.accept()
+            request = b''
+            while not request.endswith(b'\r\n\r\n'):
+                data = conn.recv(256)
+                if not data:
+                    break
+                request += data
+            conn.send(b'HTTP/1.1 101 Switching Protocols\r\n'
+                      b'Upgrade: websocket\r\nConnection: Upgrade\r\n\r\n')
+            conn.close()
+            self.remaining -= 1
+
+
+def case_connect(server):
+    url = 'ws://127.0.0.1:%d' % server.port
+
+    def run(n):
+        server.serve(n)
+        for _ in range(n):
+            web.connect(url).sock.close()
+    return run
+
+
+def cases(quick):
+    scale = 10 if quick else 1
+    out = []
+    for encoding, size in FRAME_SIZES:
+        n = max(200, 2000000 // (size + 64)) // scale
+        out.append(('write_frame/%s/%d' % (encoding, size), case_write_frame(size), n))
+        out.append(('read_frame/%s/%d' % (encoding, size), case_read_frame(size), n))
+        out.append(('read_frame_into/%s/%d' % (encoding, size), case_read_frame_into(size), n))
+    out.append(('read_frame/masked/1024', case_read_frame(1024, True), 2000 // scale))
+    out.append(('send_many/3x64', case_send_many(3, 64), 5000 // scale))
+    out.append(('recv_into/fragmented/3x64', case_recv_into(fragmented_frames(3, 64)),
+                5000 // scale))
+    # an oversized frame read through and dropped, then the 16 byte one behind it
+    out.append(('recv_into/oversized/4096', case_recv_into(server_frames(web.OP_BYTES, bytes(4096)) +
+                                                          server_frames(web.OP_BYTES, bytes(16))),
+                2000 // scale))
+
+    robot = new_robot(Sink())
+    packets = (
+        ('begin', robot._begin_packet()),
+        ('mission', {'op': 'mission', 'teamName': 'Bench', 'type': 0, 'message': 7}),
+        ('print', {'op': 'print', 'teamName': 'Bench', 'message': 'x = 1.23, y = 0.45\n'}),
+    )
+    for op, packet in packets:
+        out.append(('dumps/' + op, case_dumps(packet), 5000 // scale))
+        out.append(('send_packet/' + op, case_send_packet(packet), 5000 // scale))
+
+    out.append(('mission/int', case_mission(1), 5000 // scale))
+    out.append(('mission/name', case_mission('not_magnetic'), 5000 // scale))
+    out.append(('mission/binary', case_mission(1, True), 5000 // scale))
+    out.append(('print/json', case_print(), 5000 // scale))
+    out.append(('print/binary', case_print(True), 5000 // scale))
+    out.append(('geofence/update/16', case_geofence(16), 5000 // scale))
+    # the receive path before scanning in place, to compare the next ones against. without viper
+    # (the host, or a port without it) scan_aruco is json.loads itself, so the gain only shows
+    # on the board
+    out.append(('handle_frame/baseline_json', case_decode_json(ARUCO), 5000 // scale))
+    out.append(('handle_frame/aruco', case_handle_frame(ARUCO), 5000 // scale))
+    out.append(('handle_frame/aruco_json', case_handle_frame(ARUCO_JSON), 5000 // scale))
+    out.append(('handle_frame/aruco_binary', case_handle_frame(ARUCO_BINARY), 5000 // scale))
+    out.append(('handle_frame/markers_binary/16', case_handle_frame(MARKERS_BINARY, MARKER_IDS),
+                5000 // scale))
+    out.append(('markers/within/16', case_markers_within(16), 5000 // scale))
+    out.append(('loop/tick', case_loop_tick(), 5000 // scale))
+    out.append(('receive/aruco', case_receive(ARUCO), 5000 // scale))
+
+    try:
+        server = HandshakeServer()
+    except OSError:
+        print('port %d is busy, skipping connect/handshake' % HANDSHAKE_PORT)
+    else:
+        out.append(('connect/handshake', case_connect(server), 200 // scale))
+    return out
+
+
+def alloc_bytes(fn):
+    """Heap bytes one operation of fn takes, see the module docstring."""
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            fn(1)
+            return gc.mem_alloc() - before
+        finally:
+            gc.enable()
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn(1)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(quick=False, repeat=5, name_filter=None):
+    results = {}
+    for name, fn, n in cases(quick):
+        if name_filter and name_filter not in name:
+            continue
+        best = None
+        for _ in range(repeat):
+            gc.collect()
+            start = time.ticks_us()
+            fn(n)
+            dt = time.ticks_diff(time.ticks_us(), start)
+            if best is None or dt < best:
+                best = dt
+        used = alloc_bytes(fn)
+        results[name] = {'n': n, 'us_per_op': best / n, 'bytes_per_op': used}
+        print('%-32s %12.2f us %8d B' % (name, best / n, used))
+    impl = sys.implementation
+    return {
+        'implementation': '%s %s' % (impl.name, '.'.join(str(v) for v in impl.version[:3])),
+        'platform': sys.platform,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old_path, new_path, threshold=10.0):
+    """Print old vs new per case. Returns the number of regressions."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('%-32s %12s %12s %8s' % ('case', old['implementation'], new['implementation'], 'change'))
+    regressions = 0
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            print('%-32s %12s %12.2f' % (name, '-', result['us_per_op']))
+            continue
+        change = (result['us_per_op'] / before['us_per_op'] - 1) * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-32s %12.2f %12.2f %+7.1f%% %8s B -> %s B%s' % (
+            name, before['us_per_op'], result['us_per_op'], change,
+            before.get('bytes_per_op', '-'), result.get('bytes_per_op', '-'), flag))
+    return regressions
+
+
+def main(argv):
+    options = {'--repeat': '5', '--out': None, '--filter': None, '--threshold': '10'}
+    flags = []
+    paths = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in options:
+            i += 1
+            options[arg] = argv[i]
+        elif arg in ('--quick', '--compare'):
+            flags.append(arg)
+        elif arg.startswith('-'):
+            print(__doc__)
+            sys.exit(2)
+        else:
+            paths.append(arg)
+        i += 1
+
+    if '--compare' in flags:
+        if len(paths) != 2:
+            print(__doc__)
+            sys.exit(2)
+        regressions = compare(paths[0], paths[1], float(options['--threshold']))
+        sys.exit(1 if regressions else 0)
+
+    report = run('--quick' in flags, int(options['--repeat']), options['--filter'])
+    if options['--out']:
+        with open(options['--out'], 'w') as f:
+            json.dump(report, f)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+"""
+What importing enes100 costs: time, heap and which modules it pulls in
+
+Imports each module of the package in dependency order, so every line is
+that module's own cost on top of the ones before it, then the ones Enes100
+only imports when a feature first needs them:
+
+    micropython bench/importcost.py
+    python bench/importcost.py
+
+On MicroPython heap use is the drop in gc.mem_free(). CPython has no
+gc.mem_free(), so there it is the memory tracemalloc sees allocated, which
+is only good for comparing two runs with each other.
+
+Modules are only imported once per process, so run it afresh for every
+measurement. On the board, copy this file over and run it from the REPL
+with `import importcost` (after a soft reset) to measure the installed
+package, .py or .mpy.
+"""
+
+import sys
+import gc
+import time
+
+_here = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+if sys.implementation.name != 'micropython':
+    sys.path.insert(0, _here + '/../hostcompat')
+    import mphost
+    mphost.install()
+    sys.path.insert(0, _here + '/..')
+    import tracemalloc
+
+    def heap_used():
+        return tracemalloc.get_traced_memory()[0]
+else:
+    sys.path.insert(0, _here + '/..')
+    sys.path.insert(0, _here + '/../enes100')
+
+    def heap_used():
+        return -gc.mem_free()
+
+# Package modules in the order Enes100 imports them
+MODULES = ('uwebsockets', 'vsprotocol', 'outbox', 'posehistory', 'linkstats', 'wifijoin', 'enes100')
+
+# Package modules Enes100 imports on first use: regions, markers, record()/replay(), run_loop()
+ON_DEMAND = ('geofence', 'markers', 'recorder', 'looptimer')
+
+# Modules enes100 only needs for some features
+OPTIONAL = ('ssl', 'ure', 'ucollections', 'ubinascii', 'uasyncio')
+
+
+def measure(name):
+    gc.collect()
+    before = heap_used()
+    start = time.ticks_us()
+    __import__(name)
+    us = time.ticks_diff(time.ticks_us(), start)
+    gc.collect()
+    return us, heap_used() - before
+
+
+def main():
+    if sys.implementation.name != 'micropython':
+        tracemalloc.start()
+    print('%-12s %10s %10s' % ('module', 'us', 'bytes'))
+    total_us = total_bytes = 0
+    for name in MODULES:
+        us, used = measure(name)
+        total_us += us
+        total_bytes += used
+        print('%-12s %10d %10d' % (name, us, used))
+    print('%-12s %10d %10d' % ('total', total_us, total_bytes))
+    loaded = [name for name in OPTIONAL + ON_DEMAND if name in sys.modules]
+    print('optional modules loaded:', ', '.join(loaded) or 'none')
+    print('on first use:')
+    for name in ON_DEMAND:
+        print('%-12s %10d %10d' % ((name,) + measure(name)))
+
+
+main()
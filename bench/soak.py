@@ -0,0 +1,243 @@
+"""
+Soak test: many robots against one busy, badly connected Vision System
+
+Starts the VS stand-in (hostcompat/vsstandin.py) with the network as bad as
+asked for, connects --robots Enes100 clients to it in this process, and
+has each of them print and send missions for --seconds while the stand-in
+streams, delays, drops, bunches up and cuts off their aruco frames:
+
+    python bench/soak.py --robots 50 --rate 30 --seconds 60
+    python bench/soak.py --robots 20 --async --latency 20 --jitter 30 --loss 0.01 \\
+        --burst-every 5 --burst 300 --disconnect-every 15 --disconnect silent
+
+At the end the impairments stop, connections left silent are cut off, and
+every robot gets --settle seconds to be connected again with a fresh pose
+and to stay that way for its link timeout. It then prints what the VS sent and
+what the robots received and sent back, and exits with status 1 if any
+robot didn't recover or any frame couldn't be decoded.
+
+CPython only; the stand-in needs threading. A classroom is about ten
+robots at 10 Hz, so --robots 100 --rate 100 is a hundred times that.
+"""
+
+import argparse
+import socket
+import sys
+import time
+
+_here = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, _here + '/../enes100')
+sys.path.insert(0, _here + '/../hostcompat')
+import mphost
+mphost.install()
+
+import asyncio
+import vsstandin
+import Enes100
+
+
+def new_robot():
+    robot = Enes100.Enes100()
+    robot.wifi_cache = None
+    return robot
+
+
+def send(robot, i, n):
+    """One round of traffic from robot i: a print, and a mission every fifth round."""
+    robot.print('robot %d round %d' % (i, n))
+    if n % 5 == 0:
+        robot.mission('CYCLE', n % 10)
+        return 1
+    return 0
+
+
+def recovered(robot, max_age_ms):
+    x, y, theta, visible, seq, ticks = robot.get_pose()
+    return robot.is_connected() and seq and time.ticks_diff(time.ticks_ms(), ticks) < max_age_ms
+
+
+def run_threads(args, vs):
+    robots = []
+    for i in range(args.robots):
+        robot = new_robot()
+        robot.begin('Soak%d' % i, 'DATA', i, 1)
+        robots.append(robot)
+    rounds, missions = drive(robots, args, time.sleep)
+    down = settle(robots, args, vs, time.sleep)
+    return robots, rounds, missions, down
+
+
+def run_async(args, vs):
+    async def main():
+        robots = []
+        for i in range(args.robots):
+            robot = new_robot()
+            await robot.begin_async('Soak%d' % i, 'DATA', i, 1)
+            robots.append(robot)
+        rounds, missions = await drive_async(robots, args)
+        down = await settle_async(robots, args, vs)
+        for robot in robots:
+            await robot.end_async()
+        return robots, rounds, missions, down
+    return asyncio.run(main())
+
+
+def drive(robots, args, sleep):
+    missions = [0] * len(robots)
+    end = time.monotonic() + args.seconds
+    n = 0
+    while time.monotonic() < end:
+        for i, robot in enumerate(robots):
+            missions[i] += send(robot, i, n)
+        n += 1
+        sleep(args.send_ms / 1000)
+    return n, missions
+
+
+async def drive_async(robots, args):
+    missions = [0] * len(robots)
+    end = time.monotonic() + args.seconds
+    n = 0
+    while time.monotonic() < end:
+        for i, robot in enumerate(robots):
+            missions[i] += send(robot, i, n)
+        n += 1
+        await asyncio.sleep(args.send_ms / 1000)
+    return n, missions
+
+
+def calm(vs):
+    """Stop the impairments, and cut off silenced connections so their robots reconnect now."""
+    vs.disconnect_every_s = 0
+    vs.loss = 0
+    vs.burst_every_s = 0
+    for client in list(vs.clients):
+        if client.silent:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def not_recovered(robots):
+    """Indexes of the robots that aren't connected with a fresh pose."""
+    return [i for i, robot in enumerate(robots) if not recovered(robot, 1000)]
+
+
+def hold_s(robots):
+    """
+    How long every robot must stay recovered: a link that went quiet just
+    before calm() only shows once the keepalive gives up on it. It is also
+    time for the outboxes to drain.
+    """
+    return max([robot.link_timeout_ms for robot in robots] + [500]) / 1000
+
+
+def steady_since(robots, since, now):
+    """Since when every robot has been recovered, None if one isn't now."""
+    if not_recovered(robots):
+        return None
+    return now if since is None else since
+
+
+def settle(robots, args, vs, sleep):
+    calm(vs)
+    hold = hold_s(robots)
+    now = time.monotonic()
+    end = now + args.settle
+    since = None
+    while now < end:
+        since = steady_since(robots, since, now)
+        if since is not None and now - since >= hold:
+            break
+        sleep(0.1)
+        now = time.monotonic()
+    return not_recovered(robots)
+
+
+async def settle_async(robots, args, vs):
+    calm(vs)
+    hold = hold_s(robots)
+    now = time.monotonic()
+    end = now + args.settle
+    since = None
+    while now < end:
+        since = steady_since(robots, since, now)
+        if since is not None and now - since >= hold:
+            break
+        await asyncio.sleep(0.1)
+        now = time.monotonic()
+    return not_recovered(robots)
+
+
+def report(args, vs, robots, rounds, missions, down):
+    teams = vs.summary()
+    stats = [robot.stats() for robot in robots]
+    updates = sum(t['updates'] for t in teams.values())
+    lost = sum(t['lost'] for t in teams.values())
+    frames = sum(s['frames'] for s in stats)
+    received_missions = sum(t['received'].get('mission', 0) for t in teams.values())
+    printed = sum(packet.get('message', '').count('\n')
+                  for client in list(vs.clients) for packet in list(client.messages)
+                  if packet.get('op') == 'print')
+    dropped = sum(s['dropped'] + s['oversized'] for s in stats)
+
+    print('%d robots (%s) for %d s, VS at %g Hz' % (
+        len(robots), 'async' if args.use_async else 'threads', args.seconds, args.rate))
+    print('VS      updates %d, lost %d, bursts %d, forced disconnects %d (%s), pings answered %d' % (
+        updates, lost, sum(t['bursts'] for t in teams.values()), vs.disconnects, vs.disconnect,
+        sum(t['pings'] for t in teams.values())))
+    print('robots  frames %d (%.1f%% of those not lost), gap p95 worst %d ms, rtt worst %d ms' % (
+        frames, 100 * frames / (updates - lost) if updates > lost else 0,
+        max(s['gap_p95_ms'] for s in stats), max(s['rtt_max_ms'] for s in stats)))
+    print('        reconnects %d, link timeouts %d, dropped or oversized %d, send lock waits %d' % (
+        sum(s['reconnects'] for s in stats), sum(s['link_timeouts'] for s in stats), dropped,
+        sum(s['send_lock_waits'] for s in stats)))
+    print('sent    missions %d, received %d; print lines %d, received %d' % (
+        sum(missions), received_missions, rounds * len(robots), printed))
+    print('ended   %d/%d connected with a fresh pose' % (len(robots) - len(down), len(robots)))
+    if down:
+        print('        not recovered: ' + ', '.join('Soak%d' % i for i in down))
+    return 1 if down or dropped else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--robots', type=int, default=10)
+    parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--rate', type=float, default=10, help='aruco frames per second')
+    parser.add_argument('--rate-spread', type=float, default=0,
+                        help='give each robot a rate up to this fraction either side of --rate')
+    parser.add_argument('--json', action='store_true', help="don't agree to the binary format")
+    parser.add_argument('--markers', type=int, default=0, help='extra markers the VS offers')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='run the robots with begin_async() on one event loop')
+    parser.add_argument('--send-ms', type=int, default=200, help='ms between rounds of traffic')
+    parser.add_argument('--settle', type=float, default=15,
+                        help='seconds robots get to recover once the impairments stop')
+    vsstandin.add_network_args(parser)
+    args = parser.parse_args()
+
+    rate = args.rate
+    if args.rate_spread:
+        def rate(begin, base=args.rate, spread=args.rate_spread):
+            # the same rate for a team on every connection
+            aruco = begin.get('aruco', 0) if begin else 0
+            return base * (1 + spread * ((aruco * 0.618 % 1) * 2 - 1))
+
+    vs = vsstandin.VisionSystem('127.0.0.1', 0, rate, binary=not args.json, markers=args.markers,
+                                **vsstandin.network_kwargs(args)).start()
+    Enes100.WS_URL = vs.url
+    try:
+        if args.use_async:
+            robots, rounds, missions, down = run_async(args, vs)
+        else:
+            robots, rounds, missions, down = run_threads(args, vs)
+        status = report(args, vs, robots, rounds, missions, down)
+    finally:
+        vs.stop()
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,86 +1,126 @@
 import network
 import time
 import machine
+import micropython
 import _thread
-import uasyncio as asyncio
+import urandom as random
+import ustruct as struct
 import sys
 sys.path.append('/lib/enes100')
 import uwebsockets as web
+import vsprotocol as vs
+import outbox
+import posehistory
+import linkstats
+import wifijoin
 import ujson as json
 
+# uasyncio is only needed by the async API, begin_async() imports it
+asyncio = None
+
+# only needed by some features, imported by whatever first uses them so a robot that doesn't
+# pays nothing for them: regions (_geofence), markers (_set_team), recording and replay, run_loop
+geofence = None
+markers = None
+recorder = None
+looptimer = None
+
 # Websocket URL
 WS_URL = "ws://192.168.1.2:7755"
 
-#  make a dict 
-mission_stuff = {
-    # Mission Types
-    'CRASH_SITE' : 0,
-    'DATA' : 1,
-    'MATERIAL' : 2,
-    'FIRE' : 3,
-    'WATER' : 4,
-    'SEED' : 5,
-    'HYDROGEN' : 6,
+# How often the sender checks for queued packets
+SEND_POLL_MS = const(10)
 
-    # Crash Mission
-    'DIRECTION' : 0,
-    'LENGTH' : 1,
-    'HEIGHT': 2,
-    'NORMAL_X' : 0,
-    'NORMAL_Y' : 1,
+# Reconnect backoff, doubled after every failed attempt, and how long to wait for the WiFi to rejoin
+RECONNECT_MIN_MS = const(100)
+RECONNECT_MAX_MS = const(5000)
+WLAN_TIMEOUT_MS = const(10000)
 
-    # Data Mission
-    'CYCLE' : 0,
-    'MAGNETISM' : 1,
-    'MAGNETIC' : 0,
-    'NOT_MAGNETIC' : 1,
+# Default limit on begin(), from starting the WiFi join to the begin statement going out
+BEGIN_TIMEOUT_MS = const(30000)
 
-    # Materials Mission
-    'WEIGHT' : 0,
-    'MATERIAL_TYPE' : 1,
-    'FOAM' : 0,
-    'PLASTIC' : 1,
-    'HEAVY' : 0,
-    'MEDIUM' : 1,
-    'LIGHT' : 2,
+# Events for on_pose(), on_visibility_change(), on_disconnect(), on_enter(), on_exit() and
+# on_arrived(), and how many callbacks each can have. the last three follow geofence's event order
+EV_POSE = const(0)
+EV_VISIBILITY = const(1)
+EV_DISCONNECT = const(2)
+EV_ENTER = const(3)
+EV_EXIT = const(4)
+EV_ARRIVED = const(5)
+EV_COUNT = const(6)
+CALLBACK_SLOTS = const(4)
 
+# Names accepted by begin() and mission(), and what each one sends (see _mission_value)
+# Two flat tuples of constants instead of a dict: frozen into firmware they live in flash,
+# and as .py or .mpy they take less heap than a dict
+MISSION_NAMES = (
+    # Mission Types
+    'CRASH_SITE', 'DATA', 'MATERIAL', 'FIRE', 'WATER', 'SEED', 'HYDROGEN',
+    # Crash Mission
+    'DIRECTION', 'LENGTH', 'HEIGHT', 'NORMAL_X', 'NORMAL_Y',
+    # Data Mission
+    'CYCLE', 'MAGNETISM', 'MAGNETIC', 'NOT_MAGNETIC',
+    # Materials Mission
+    'WEIGHT', 'MATERIAL_TYPE', 'FOAM', 'PLASTIC', 'HEAVY', 'MEDIUM', 'LIGHT',
     # Fire Mission
-    'NUM_CANDLES' : 0,
-    'TOPOGRAPHY' : 1,
-    'TOP_A' : 0,
-    'TOP_B' : 1,
-    'TOP_C' : 2,
-
+    'NUM_CANDLES', 'TOPOGRAPHY', 'TOP_A', 'TOP_B', 'TOP_C',
     # Water Mission
-    'DEPTH' : 0,
-    'WATER_TYPE' : 1,
-    'FRESH_UNPOLLUTED' : 0,
-    'FRESH_POLLUTED' : 1,
-    'SALT_UNPOLLUTED' : 2,
-    'SALT_POLLUTED' : 3,
-
+    'DEPTH', 'WATER_TYPE', 'FRESH_UNPOLLUTED', 'FRESH_POLLUTED', 'SALT_UNPOLLUTED', 'SALT_POLLUTED',
     # Seed Mission
-    'LOCATION' : 0,
-    'A' : 'A',
-    'B' : 'B',
-    'C' : 'C',
-    'D' : 'D',
-    
+    'LOCATION', 'A', 'B', 'C', 'D',
     # Hydrogen Mission
-    'VOLTAGE_OUTPUT' : 0,
-    'LED_COLOR' : 1,
-    'VOLTAGE_1' : 0,
-    'VOLTAGE_2' : 1,
-    'VOLTAGE_3' : 2,
-    'VOLTAGE_4' : 3,
-    'VOLTAGE_5' : 4,
-    'WHITE' : 0,
-    'RED' : 1,
-    'YELLOW' : 2,
-    'GREEN' : 3,
-    'BLUE' : 4,
-}
-    
+    'VOLTAGE_OUTPUT', 'LED_COLOR', 'VOLTAGE_1', 'VOLTAGE_2', 'VOLTAGE_3', 'VOLTAGE_4', 'VOLTAGE_5',
+    'WHITE', 'RED', 'YELLOW', 'GREEN', 'BLUE',
+)
+MISSION_VALUES = (
+    # Mission Types
+    0, 1, 2, 3, 4, 5, 6,
+    # Crash Mission
+    0, 1, 2, 0, 1,
+    # Data Mission
+    0, 1, 0, 1,
+    # Materials Mission
+    0, 1, 0, 1, 0, 1, 2,
+    # Fire Mission
+    0, 1, 0, 1, 2,
+    # Water Mission
+    0, 1, 0, 1, 2, 3,
+    # Seed Mission
+    0, 'A', 'B', 'C', 'D',
+    # Hydrogen Mission
+    0, 1, 0, 1, 2, 3, 4,
+    0, 1, 2, 3, 4,
+)
+
+
+# The calls each mission type can make, indexed by the mission type's value, each with the
+# names its message can be given as (none for calls that only take a number)
+MISSION_CALLS = (
+    # CRASH_SITE
+    (('DIRECTION', ('NORMAL_X', 'NORMAL_Y')), ('LENGTH', ()), ('HEIGHT', ())),
+    # DATA
+    (('CYCLE', ()), ('MAGNETISM', ('MAGNETIC', 'NOT_MAGNETIC'))),
+    # MATERIAL
+    (('WEIGHT', ('HEAVY', 'MEDIUM', 'LIGHT')), ('MATERIAL_TYPE', ('FOAM', 'PLASTIC'))),
+    # FIRE
+    (('NUM_CANDLES', ()), ('TOPOGRAPHY', ('TOP_A', 'TOP_B', 'TOP_C'))),
+    # WATER
+    (('DEPTH', ()),
+     ('WATER_TYPE', ('FRESH_UNPOLLUTED', 'FRESH_POLLUTED', 'SALT_UNPOLLUTED', 'SALT_POLLUTED'))),
+    # SEED
+    (('LOCATION', ('A', 'B', 'C', 'D')),),
+    # HYDROGEN
+    (('VOLTAGE_OUTPUT', ('VOLTAGE_1', 'VOLTAGE_2', 'VOLTAGE_3', 'VOLTAGE_4', 'VOLTAGE_5')),
+     ('LED_COLOR', ('WHITE', 'RED', 'YELLOW', 'GREEN', 'BLUE'))),
+)
+
+
+# the value of a name from MISSION_NAMES, given in any case
+def _mission_value(name):
+    try:
+        return MISSION_VALUES[MISSION_NAMES.index(name.upper())]
+    except ValueError:
+        raise KeyError(name)
 
 
 class Enes100:
@@ -96,89 +136,1163 @@ class Enes100:
         self.y = -1.0
         self.theta = -1.0
         self.is_visible = False
+        
+        # pose_seq counts aruco frames, pose_ticks is time.ticks_ms() of the latest one
+        self.pose_seq = 0
+        self.pose_ticks = 0
+        self._pose_us = 0  # time.ticks_us() of the latest, for run_loop()
+        self._pose_lock = _thread.allocate_lock()
+        # recent visible poses for pose_at(), velocity() and angular_rate(), allocated by begin
+        self.history = None
+        # regions and waypoints checked against every visible pose, allocated by the first add_*()
+        self._fence = None
+        # poses of the other markers subscribed to in begin(), None without any
+        self._markers = None
+        self._rx_size = web.RX_BUF_SIZE
+        
+        self._task = None
+        self._pose_event = None
+        # the sender thread never stops, so a later begin() or replay() reuses it
+        self._sender_running = False
+        
+        # event callbacks, CALLBACK_SLOTS per event in one preallocated table (see _fire)
+        # _events has a bit set for each event with a callback, _scheduled for each with a run pending
+        self._callbacks = [None] * (EV_COUNT * CALLBACK_SLOTS)
+        self._events = 0
+        self._scheduled = 0
+        # bound once, so scheduling a run doesn't allocate a new bound method every time
+        self._run_scheduled = self._run_callbacks_scheduled
+        self._run_fenced = self._run_fenced_scheduled
+        # (x, y, theta, is_visible) for the pose callbacks, set by _set_pose under _pose_lock. the
+        # callbacks read it without the lock, which the main thread may be holding when they run
+        self._snapshot = (-1.0, -1.0, -1.0, False)
+        
+        # receive buffer and aruco scan output, allocated by begin
+        self._rx = None
+        self._scan = None
+        
+        # with latest_wins set, an aruco frame is only decoded if no more data is already waiting
+        # behind it, so after a stall the robot jumps to the newest pose instead of working through
+        # the backlog. the newest pose seen so far is held in _held_buf (_held bytes)
+        self.latest_wins = False
+        
+        # with binary_wire set, begin asks VS for the compact binary format (see vsprotocol)
+        # _binary is true once this connection's VS has agreed, until then everything is JSON
+        # _records is whether the begin statement asked, without it no frame is read as a record
+        self.binary_wire = False
+        self._binary = False
+        self._records = False
+        self._held = 0
+        self._held_buf = None
+        
+        # print() text is merged and sent at most every print_interval_ms,
+        # or sooner once print_flush_bytes are waiting
+        self.print_interval_ms = 100
+        self.print_flush_bytes = 256
+        self._prints = None
+        self._print_buf = None
+        self._last_flush = 0
+        # (template, message) of missions waiting for the sender, sent before any prints
+        self._missions = []
+        # mission call name -> (type, JSON packet up to the message, message names, their values)
+        # and the JSON print packet up to the message, compiled for the team by _set_team
+        self._mission_templates = None
+        self._print_head = None
+        self._sender_task = None
+        
+        # reconnects counts links re-established after dropping, recover_ms is how long the
+        # last one took from detecting the drop to the begin packet going out again
+        self.reconnects = 0
+        self.recover_ms = 0
+        self.max_recover_ms = 0
+        
+        # link telemetry, see stats(). a ping goes out every ping_interval_ms to measure RTT,
+        # and if stats_interval_ms is set a summary line is printed to the VS console that often
+        self.ping_interval_ms = 1000
+        self.stats_interval_ms = 0
+        self._stats = linkstats.LinkStats()
+        # frames/bytes in/out, oversized, and writer lock waits, wait time and control frame handoffs
+        # of replaced websockets, see _use_ws
+        self._wire = [0, 0, 0, 0, 0, 0, 0, 0]
+        self._lock_wait_max_us = 0
+        self._ping = bytearray(4)
+        self._last_ping = 0
+        self._last_stats = 0
+        
+        # keepalive: the link counts as dead once nothing (pose frame or pong) has come from VS
+        # for link_timeout_ms, and the pose turns invisible once no pose frame has come for
+        # pose_timeout_ms. is_connected() goes false and the link is rebuilt. 0 turns either off
+        self.link_timeout_ms = 3000
+        self.pose_timeout_ms = 1000
+        self.link_timeouts = 0
+        self.pongs_missed = 0
+        self._last_heard = 0
+        self._pong_pending = False
+        self._link_dead = False
+        
+        # WiFi join: the access point and DHCP lease of the last join are cached in the wifi_cache
+        # file, so the next one can skip the scan (None turns the cache off). static_ip is an
+        # ifconfig() tuple (ip, mask, gateway, dns) to use instead of DHCP, and with reuse_lease the
+        # cached lease is used that way. begin_timing has how long each step of begin took in ms
+        self.wifi_cache = wifijoin.WIFI_CACHE
+        self.static_ip = None
+        self.reuse_lease = False
+        self.begin_timing = {}
+        self._begin_ticks = None  # when the begin statement went out, until VS answers
+        
+        # frames to and from VS are logged to flash while this is set, see record() and replay()
+        self._recorder = None
+        
+        # timing of the running or last run_loop(), see loop_stats()
+        self._loop = None
+    
+    # sends an encoded packet to VS through websocket
+    # any thread can send, the websocket writes one whole frame at a time (see uwebsockets)
+    def _send_raw(self, data):
+        if self.ws:
+            start = time.ticks_us()
+            self.ws.send(data)
+            self._stats.sent(time.ticks_diff(time.ticks_us(), start))
+            if self._recorder:
+                self._record_sent(data)
+    
+    # logs a packet sent to VS, a sticky one is repeated at the start of every log file
+    def _record_sent(self, data, sticky=False):
+        opcode, payload = web.Websocket._message(data)
+        self._recorder.record(opcode, payload, len(payload), True, sticky)
+    
+    # sends the begin statement on a newly connected ws
+    def _send_begin(self, ws):
+        self._records = self.binary_wire
+        data = json.dumps(self._begin_packet())
+        ws.send(data)
+        if self._recorder:
+            self._record_sent(data, True)
     
     # sends packets of info to VS through websocket
     def _send_packet(self, packet):
-        if self.ws:
-            self.ws.send(json.dumps(packet))
+        self._send_raw(json.dumps(packet))
+    
+    # encodes a queued mission, in whichever format the current link uses
+    # JSON is the template with the message's JSON spliced in, sent as already encoded text
+    # a message a mission record can't carry goes as JSON on a binary link too
+    def _mission_packet(self, template, message, text):
+        if self._binary and vs.fits_mission(message):
+            return vs.pack_mission(template[0], message)
+        return web.OP_TEXT, template[1] + text + b'}'
+    
+    # sends several packets as back to back frames in a single write
+    def _send_batch(self, batch):
+        start = time.ticks_us()
+        self.ws.send_many(batch)
+        self._stats.sent(time.ticks_diff(time.ticks_us(), start))
+        if self._recorder:
+            for data in batch:
+                self._record_sent(data)
+    
+    # sends queued missions first, then the merged print text once it's due (or now if force)
+    # everything due goes out in one write; missions stay queued until it succeeds,
+    # so ones that miss a dropped link get replayed
+    def _flush_outbox(self, force=False):
+        if self._recorder:
+            # the log is written from here so the receive thread never waits on flash
+            self._recorder.write()
+        if not self.is_connected():
+            return
+        missions = len(self._missions)
+        batch = None
+        if missions:
+            batch = [self._mission_packet(*queued) for queued in self._missions[:missions]]
+        
+        prints = self._prints
+        if prints.count or prints.dropped:
+            now = time.ticks_ms()
+            if (force or prints.count >= self.print_flush_bytes
+                    or time.ticks_diff(now, self._last_flush) >= self.print_interval_ms):
+                n, dropped = prints.take(self._print_buf)
+                self._stats.prints_dropped += dropped
+                note = f'[{dropped} print messages dropped]\n' if dropped else ''
+                if self._binary:
+                    packet = vs.pack_print(self._print_buf, n)
+                    if note:
+                        packet += note.encode()
+                else:
+                    text = json.dumps(str(self._print_buf[:n], 'utf-8') + note)
+                    packet = web.OP_TEXT, self._print_head + text.encode() + b'}'
+                if batch:
+                    batch.append(packet)
+                else:
+                    batch = [packet]
+                self._last_flush = now
+        
+        if batch:
+            self._send_batch(batch)
+            del self._missions[:missions]
+        
+        self._send_periodic()
+    
+    # sends the RTT ping and the stats line to the VS console when they're due
+    def _send_periodic(self):
+        now = time.ticks_ms()
+        self._check_link(now)
+        if self._link_dead:
+            return
+        if self.ping_interval_ms and time.ticks_diff(now, self._last_ping) >= self.ping_interval_ms:
+            if self._pong_pending:
+                self.pongs_missed += 1
+            # the pong echoes the send time back, see _on_pong
+            struct.pack_into('<i', self._ping, 0, now)
+            self.ws.ping(self._ping)
+            self._pong_pending = True
+            self._last_ping = now
+        if self.stats_interval_ms and time.ticks_diff(now, self._last_stats) >= self.stats_interval_ms:
+            self.print(self._stats_line())
+            self._last_stats = now
+    
+    # gives up on a link VS has gone quiet on, and hides a pose that has stopped updating
+    def _check_link(self, now):
+        if self._silent(now):
+            self._link_lost()
+        elif (self.pose_timeout_ms and self.is_visible
+                and time.ticks_diff(now, self.pose_ticks) > self.pose_timeout_ms):
+            self._hide_pose()
+    
+    # true once nothing has come from VS for link_timeout_ms
+    def _silent(self, now):
+        return bool(self.link_timeout_ms) and time.ticks_diff(now, self._last_heard) >= self.link_timeout_ms
+    
+    # marks the link dead so is_connected() is false right away, then gets it rebuilt
+    # a thread's blocking read gives up by itself through the socket timeout,
+    # the async receive task is restarted straight into a reconnect
+    def _link_lost(self):
+        if not self._link_dead:
+            self._fire(EV_DISCONNECT)
+        self._link_dead = True
+        self._hide_pose()
+        self._hide_markers()
+        if self._task:
+            self._task.cancel()
+            self._task = asyncio.create_task(self._websocket_client_async(True))
+    
+    # publishes an invisible pose so the control loop sees the marker is gone
+    def _hide_pose(self):
+        if self.is_visible:
+            self._set_pose(False, -1.0, -1.0, -1.0)
+    
+    # marks every subscribed marker invisible, their last poses are kept
+    def _hide_markers(self):
+        if self._markers:
+            with self._pose_lock:
+                self._markers.hide_all()
+    
+    # measures RTT from the pong to one of our pings
+    def _on_pong(self, data):
+        self._last_heard = time.ticks_ms()
+        self._pong_pending = False
+        if len(data) == 4:
+            sent = struct.unpack_from('<i', data)[0]
+            self._stats.rtt(time.ticks_diff(time.ticks_ms(), sent))
+    
+    # switches to a newly connected websocket, keeping the old one's counters for stats()
+    def _use_ws(self, ws):
+        old = self.ws
+        if old:
+            wire = self._wire
+            wire[0] += old.frames_in
+            wire[1] += old.frames_out
+            wire[2] += old.bytes_in
+            wire[3] += old.bytes_out
+            wire[4] += old.oversized
+            wire[5] += old.lock_waits
+            wire[6] += old.lock_wait_us
+            wire[7] += old.control_handoffs
+            self._lock_wait_max_us = max(self._lock_wait_max_us, old.lock_wait_max_us)
+        ws.on_pong = self._on_pong
+        self._binary = False
+        self._last_heard = time.ticks_ms()
+        self._pong_pending = False
+        self._link_dead = False
+        self.ws = ws
+    
+    # starts the sender thread, unless an earlier begin() or replay() already did. two of them
+    # would flush the same missions at once and send some twice
+    def _start_sender(self):
+        if not self._sender_running:
+            self._sender_running = True
+            _thread.start_new_thread(self._sender, ())
+    
+    # drains the outbox in the background so mission() and print() never wait on the socket
+    def _sender(self):
+        while True:
+            time.sleep_ms(SEND_POLL_MS)
+            try:
+                self._flush_outbox()
+            except (OSError, AssertionError, web.ConnectionClosed):
+                # link died mid-send (or was closed under it), the receive thread will reconnect
+                pass
+    
+    # async version of _sender
+    async def _sender_async(self):
+        while True:
+            await asyncio.sleep_ms(SEND_POLL_MS)
+            try:
+                self._flush_outbox()
+            except (OSError, AssertionError, web.ConnectionClosed):
+                pass
+    
+    # sets up the outbox used by mission() and print()
+    def _init_outbox(self):
+        self._prints = outbox.PrintQueue()
+        self._print_buf = memoryview(bytearray(outbox.PRINT_QUEUE_SIZE))
+        self._missions = []
+    
+    # saves a pose from VS, all at once so get_pose() can't see a half-written update
+    def _set_pose(self, is_visible, x, y, theta):
+        with self._pose_lock:
+            changed = is_visible != self.is_visible
+            self.is_visible = is_visible
+            self.x = x
+            self.y = y
+            self.theta = theta
+            self.pose_seq += 1
+            self.pose_ticks = time.ticks_ms()
+            self._pose_us = time.ticks_us()
+            if is_visible and self.history:
+                self.history.append(self.pose_ticks, x, y, theta)
+            if self._events:
+                self._snapshot = (x, y, theta, is_visible)
+            fenced = None
+            fence = self._fence
+            if is_visible and fence and fence.update(x, y, theta, self._events >> EV_ENTER):
+                # the regions each event is for, handed to its callbacks the same way
+                fenced = (fence.take(0), fence.take(1), fence.take(2))
+        if self._pose_event:
+            self._pose_event.set()
+        if self._events:
+            self._fire(EV_POSE)
+            if changed:
+                self._fire(EV_VISIBILITY)
+            if fenced:
+                for event in range(EV_ENTER, EV_COUNT):
+                    if fenced[event - EV_ENTER]:
+                        self._fire(event, fenced[event - EV_ENTER])
+    
+    # runs the callbacks for event soon: through micropython.schedule() in thread mode, so they
+    # run in the main thread between its bytecodes, or straight away on the event loop in async
+    # mode. a run already pending covers any more of the same event, and sees the latest state.
+    # a geofence event comes with the bits of its regions and is scheduled on its own, edges are
+    # rare enough. scheduled code never takes _pose_lock, the main thread may already hold it
+    def _fire(self, event, bits=0):
+        bit = 1 << event
+        if not self._events & bit:
+            return
+        if self._task:
+            try:
+                self._run_callbacks(event, bits)
+            except Exception as e:
+                # keep the receive task alive
+                print('enes100 callback failed:', repr(e))
+        elif bits:
+            try:
+                micropython.schedule(self._run_fenced, (event, bits))
+            except RuntimeError:
+                # schedule queue full, they come with the next edge instead
+                with self._pose_lock:
+                    self._fence.give_back(event - EV_ENTER, bits)
+        elif not self._scheduled & bit:
+            self._scheduled |= bit
+            try:
+                micropython.schedule(self._run_scheduled, event)
+            except RuntimeError:
+                # schedule queue full, skip this one
+                self._scheduled &= ~bit
+    
+    def _run_callbacks_scheduled(self, event):
+        self._scheduled &= ~(1 << event)
+        self._run_callbacks(event)
+    
+    def _run_fenced_scheduled(self, fenced):
+        self._run_callbacks(fenced[0], fenced[1])
+    
+    # calls the callbacks for event with the latest pose, or once per region in bits for a geofence event
+    def _run_callbacks(self, event, bits=0):
+        if event >= EV_ENTER:
+            fence = self._fence
+            slot = 0
+            while bits:
+                name = fence.names[slot]
+                if bits & 1 and name is not None:
+                    for i in range(event * CALLBACK_SLOTS, (event + 1) * CALLBACK_SLOTS):
+                        cb = self._callbacks[i]
+                        if cb:
+                            cb(name)
+                bits >>= 1
+                slot += 1
+            return
+        if event == EV_DISCONNECT:
+            for i in range(EV_DISCONNECT * CALLBACK_SLOTS, (EV_DISCONNECT + 1) * CALLBACK_SLOTS):
+                cb = self._callbacks[i]
+                if cb:
+                    cb()
+            return
+        x, y, theta, is_visible = self._snapshot
+        for i in range(event * CALLBACK_SLOTS, (event + 1) * CALLBACK_SLOTS):
+            cb = self._callbacks[i]
+            if cb:
+                if event == EV_POSE:
+                    cb(x, y, theta, is_visible)
+                else:
+                    cb(is_visible)
+    
+    # puts cb in a free slot of event's part of the callback table
+    def _add_callback(self, event, cb):
+        table = self._callbacks
+        start = event * CALLBACK_SLOTS
+        if cb in table[start:start + CALLBACK_SLOTS]:
+            return
+        for i in range(start, start + CALLBACK_SLOTS):
+            if table[i] is None:
+                table[i] = cb
+                self._events |= 1 << event
+                return
+        raise ValueError(f'at most {CALLBACK_SLOTS} callbacks per event')
+    
+    # decodes a message from VS and saves it to appropriate vars
+    def _handle_message(self, msg):
+        data = json.loads(msg)
+#         print("Received:", data)
+        if data.get("op") == "aruco":
+            aruco = data.get("aruco", {})
+            self._set_pose(aruco.get("visible", False),
+                           aruco.get("x", -1.0),
+                           aruco.get("y", -1.0),
+                           aruco.get("theta", -1.0))
+        elif data.get("op") == "markers" and self._markers:
+            now = time.ticks_ms()
+            with self._pose_lock:
+                for m in data.get("markers", ()):
+                    self._markers.update(m.get("id", -1), m.get("visible", False),
+                                         m.get("x", -1.0), m.get("y", -1.0), m.get("theta", -1.0), now)
+    
+    # handles the data frame in buf[:n]
+    def _handle_frame(self, buf, n):
+        now = time.ticks_ms()
+        self._last_heard = now
+        if self._begin_ticks is not None:
+            self.begin_timing['ack_ms'] = time.ticks_diff(now, self._begin_ticks)
+            self._begin_ticks = None
+        self._stats.received(now)
+        if self._recorder:
+            self._recorder.record(web.OP_BYTES if self._is_record(buf, n) else web.OP_TEXT, buf, n)
+        if self.latest_wins:
+            self._take_latest(buf, n)
+        else:
+            self._apply_frame(buf, n)
+    
+    # latest_wins version of _apply_frame, also called with n = 0 after a control frame
+    # an aruco frame with more data waiting behind it is held instead of decoded, and replaced
+    # (counted as skipped) if another aruco frame turns up. once nothing more is waiting the
+    # held pose is the newest there is and gets decoded
+    def _take_latest(self, buf, n):
+        more = self.ws.pending()
+        if n and vs.is_aruco(buf, n):
+            if self._held:
+                self._stats.skipped += 1
+                self._held = 0
+            if more:
+                if buf is self._rx:
+                    # thread mode: keep this buffer and receive into the spare one
+                    self._rx, self._held_buf = self._held_buf, buf
+                else:
+                    self._held_buf[:n] = buf
+                self._held = n
+                return
+        elif self._held and not more:
+            held = self._held
+            self._held = 0
+            self._apply_frame(self._held_buf, held)
+        if n:
+            self._apply_frame(buf, n)
+    
+    # decodes the frame in buf[:n], aruco frames are scanned in place without json
+    def _apply_frame(self, buf, n):
+        try:
+            self._decode_frame(buf, n)
+        except (ValueError, AttributeError, TypeError):
+            # not json, or not the shape we expect
+            self._stats.dropped += 1
+    
+    # whether buf[:n] is a binary record: never unless begin asked for them, and only the ACK
+    # until VS has agreed. anything else is JSON, which may well start with whitespace
+    def _is_record(self, buf, n):
+        return self._records and vs.is_record(buf, n) and (self._binary or buf[0] == vs.REC_ACK)
+    
+    def _decode_frame(self, buf, n):
+        if self._is_record(buf, n):
+            self._decode_record(buf, n)
+            return
+        scan = self._scan
+        if vs.scan_aruco(buf, n, scan):
+            bits = scan[vs.SCAN_BITS]
+            self._set_pose(scan[vs.SCAN_VISIBLE] == 1,
+                           scan[vs.SCAN_X] / vs.POW10[scan[vs.SCAN_X + 1]] if bits & vs.BIT_X else -1.0,
+                           scan[vs.SCAN_Y] / vs.POW10[scan[vs.SCAN_Y + 1]] if bits & vs.BIT_Y else -1.0,
+                           scan[vs.SCAN_THETA] / vs.POW10[scan[vs.SCAN_THETA + 1]] if bits & vs.BIT_THETA else -1.0)
+        else:
+            self._handle_message(str(buf[:n], 'utf-8'))
+    
+    # decodes a binary record from VS
+    def _decode_record(self, buf, n):
+        kind = buf[0]
+        if kind == vs.REC_POSE and n >= vs.POSE_SIZE:
+            is_visible, marker, x, y, theta = vs.unpack_pose(buf)
+            self._set_pose(is_visible, x, y, theta)
+            if n >= 2 * vs.POSE_SIZE and self._markers:
+                self._decode_markers(buf, n)
+        elif kind == vs.REC_ACK:
+            # VS speaks binary, missions and prints can use it from now on
+            self._binary = True
+        else:
+            raise ValueError('unknown record')
+    
+    # saves the other markers' pose records that follow the team's own in buf[:n]
+    def _decode_markers(self, buf, n):
+        now = time.ticks_ms()
+        table = self._markers
+        with self._pose_lock:
+            for offset in range(vs.POSE_SIZE, n - vs.POSE_SIZE + 1, vs.POSE_SIZE):
+                if buf[offset] == vs.REC_POSE:
+                    is_visible, marker, x, y, theta = vs.unpack_pose(buf, offset)
+                    table.update(marker, is_visible, x, y, theta, now)
     
     # runs the websocket, receives the data from VS and saves it to appropriate vars
+    # reconnects whenever the link drops
     def _websocket_client(self):
-        # TODO -> reconnect functionality
         while True:
-            msg = self.ws.recv()
-            if msg:
-                data = json.loads(msg)
-#                 print("Received:", data)
-                if data.get("op") == "aruco":
-                    aruco = data.get("aruco", {})
-                    self.is_visible = aruco.get("visible", False)
-                    self.x = aruco.get("x", -1.0)
-                    self.y = aruco.get("y", -1.0)
-                    self.theta = aruco.get("theta", -1.0)
+            try:
+                opcode, n = self.ws.recv_into(self._rx, self.latest_wins)
+                if n:
+                    self._handle_frame(self._rx, n)
+                elif opcode is None or not self.ws.open:
+                    # end of stream or close frame
+                    raise web.ConnectionClosed()
+                elif self._held:
+                    # a control frame, the held pose may be the newest now
+                    self._take_latest(self._rx, 0)
+                if self._link_dead:
+                    # the keepalive gave up on this link just as something arrived
+                    raise web.ConnectionClosed()
+            except (OSError, web.ConnectionClosed):
+                # includes the socket timeout when VS goes quiet for link_timeout_ms
+                self._reconnect()
     
-    # begin statement used to gather basic info from teams, connect to wifi, init websocket and get it running
-    def begin(self, team_name, mission_type, aruco_id, room_num):
+    # async version of _websocket_client, runs as a task on the event loop
+    # starts with a reconnect when the keepalive restarts it on a dead link
+    async def _websocket_client_async(self, reconnect=False):
+        if reconnect:
+            await self._reconnect_async()
+        while True:
+            try:
+                opcode, data = await self.ws.recv_view(self.latest_wins)
+                if data:
+                    self._handle_frame(data, len(data))
+                elif not self.ws.open:
+                    raise web.ConnectionClosed()
+                elif self._held:
+                    self._take_latest(None, 0)
+            except (OSError, web.ConnectionClosed):
+                await self._reconnect_async()
+    
+    # how long to wait before the next reconnect attempt, exponential with random jitter
+    def _backoff_ms(self, attempt):
+        delay = min(RECONNECT_MIN_MS << min(attempt, 16), RECONNECT_MAX_MS)
+        # sleep somewhere between half and all of delay so robots don't retry in lockstep
+        return delay // 2 + random.getrandbits(16) % (delay // 2 + 1)
+    
+    # closes a dead websocket without caring whether the close frame makes it out
+    def _drop_ws(self):
+        self._held = 0
+        # whichever noticed the silence first, the keepalive or the socket timeout
+        if self._link_dead or self._silent(time.ticks_ms()):
+            self.link_timeouts += 1
+        if not self._link_dead:
+            # _link_lost already told the callbacks otherwise
+            self._fire(EV_DISCONNECT)
+        self._hide_pose()
+        self._hide_markers()
+        self._close_quietly(self.ws)
+    
+    # closes a ws that is being given up on, if there is one, ignoring a link that is already gone
+    def _close_quietly(self, ws):
+        if ws:
+            try:
+                ws.close(web.CLOSE_GOING_AWAY)
+            except OSError:
+                pass
+    
+    # makes blocking reads on ws give up after link_timeout_ms of silence from VS
+    def _set_timeout(self, ws):
+        ws.settimeout(self.link_timeout_ms / 1000 if self.link_timeout_ms else None)
+    
+    # records how long a reconnect took
+    def _recovered(self, start):
+        self.reconnects += 1
+        self.recover_ms = time.ticks_diff(time.ticks_ms(), start)
+        self.max_recover_ms = max(self.max_recover_ms, self.recover_ms)
+    
+    # rejoins the WiFi and VS after the link drops, then resends the begin statement
+    # queued missions are replayed by the sender once is_connected() is true again
+    def _reconnect(self):
+        start = time.ticks_ms()
+        self._drop_ws()
+        attempt = 0
+        while True:
+            ws = None
+            try:
+                join = self._wlan_join(WLAN_TIMEOUT_MS, False)
+                while not join.poll():
+                    time.sleep_ms(10)
+                ws = web.connect(WS_URL, WLAN_TIMEOUT_MS)
+                self._set_timeout(ws)
+                self._send_begin(ws)
+                break
+            except (OSError, AssertionError, web.ConnectionClosed):
+                self._close_quietly(ws)
+                time.sleep_ms(self._backoff_ms(attempt))
+                attempt += 1
+        self._use_ws(ws)
+        self._recovered(start)
+    
+    # async version of _reconnect
+    async def _reconnect_async(self):
+        start = time.ticks_ms()
+        self._drop_ws()
+        attempt = 0
+        while True:
+            ws = None
+            try:
+                join = self._wlan_join(WLAN_TIMEOUT_MS, False)
+                while not join.poll():
+                    await asyncio.sleep_ms(10)
+                ws = await asyncio.wait_for_ms(web.connect_async(WS_URL, None, self._rx_size),
+                                               WLAN_TIMEOUT_MS)
+                self._send_begin(ws)
+                break
+            except (OSError, AssertionError, web.ConnectionClosed, asyncio.TimeoutError):
+                self._close_quietly(ws)
+                await asyncio.sleep_ms(self._backoff_ms(attempt))
+                attempt += 1
+        self._use_ws(ws)
+        self._recovered(start)
+    
+    # saves the team info used by the begin statement and compiles its packet templates
+    # with marker_ids, sets up the table for them and makes room for them in the receive buffer
+    def _set_team(self, team_name, mission_type, aruco_id, room_num, marker_ids=()):
+        global markers
         self.team_name = team_name
-        self.mission_type = mission_stuff[mission_type.upper()]
+        self.mission_type = _mission_value(mission_type)
         self.aruco_id = aruco_id
         self.room_num = room_num
-        
-        # Connect to WiFi
+        self._compile_templates()
+        self._markers = None
+        self._rx_size = web.RX_BUF_SIZE
+        if marker_ids:
+            import markers
+            self._markers = markers.MarkerTable(marker_ids)
+            self._rx_size += len(marker_ids) * markers.MARKER_JSON_SIZE
+    
+    # encodes everything but the message of the team's mission and print packets, once
+    # only the calls of the team's mission type get a template, so that's all mission() accepts
+    def _compile_templates(self):
+        team = json.dumps(self.team_name)
+        templates = {}
+        for call, names in MISSION_CALLS[self.mission_type]:
+            mission_call = _mission_value(call)
+            head = f'{{"op": "mission", "teamName": {team}, "type": {mission_call}, "message": '
+            values = tuple(_mission_value(name) for name in names)
+            templates[call] = (mission_call, head.encode(), names, values)
+        self._mission_templates = templates
+        self._print_head = f'{{"op": "print", "teamName": {team}, "message": '.encode()
+    
+    # starts joining the room's WiFi, poll() the returned WifiJoin until it's connected
+    # scan lets a join with nothing cached look for the access point first, so it can be cached
+    def _wlan_join(self, timeout_ms, scan=True):
         ssid = f'VisionSystem{self.room_num}-2.4'
         key = '@R6u!n01'
         print(f'Connecting to {ssid}...')
         
-        sta_if = network.WLAN(network.WLAN.IF_STA)
-        if not sta_if.isconnected():
-            sta_if.active(True)
-            sta_if.connect(ssid, key)
-            while not sta_if.isconnected():
-                time.sleep(0.01)
-        #print('Connected to WiFi')
-        
-        # Connect to VS
-        self.ws = web.connect(WS_URL)
-        #print("Connected to WebSocket Server")
-        
-        # Send begin statement to VS
+        join = wifijoin.WifiJoin(network.WLAN(network.WLAN.IF_STA), ssid, key, timeout_ms,
+                                 self.wifi_cache, self.static_ip, self.reuse_lease, scan)
+        join.start()
+        return join
+    
+    # ms left of a begin() that started at start, raises once there's none
+    def _time_left(self, start, timeout_ms):
+        left = timeout_ms - time.ticks_diff(time.ticks_ms(), start)
+        if left <= 0:
+            raise OSError(f'begin timed out after {timeout_ms} ms')
+        return left
+    
+    # starts begin_timing with the WiFi phases of join
+    def _join_timing(self, join):
+        self.begin_timing = {
+            'associate_ms': join.associate_ms,
+            'dhcp_ms': join.dhcp_ms,
+            'fast_join': join.fast,
+        }
+        return self.begin_timing
+    
+    # finishes begin_timing once the begin statement is out, ack_ms follows with VS's first frame
+    def _begin_sent(self, start):
+        self._begin_ticks = time.ticks_ms()
+        self.begin_timing['total_ms'] = time.ticks_diff(self._begin_ticks, start)
+    
+    # builds the begin statement, sent on connect and again after every reconnect
+    def _begin_packet(self):
         packet = {
             "op": "begin",
             "teamName": self.team_name,
             "aruco": self.aruco_id,
             "teamType": self.mission_type
         }
-        self._send_packet(packet)
+        if self.binary_wire:
+            # asks VS for the binary format, see vsprotocol
+            packet["binary"] = vs.BINARY_VERSION
+        if self._markers:
+            # asks VS for the poses of these markers too
+            packet["markers"] = list(self._markers.ids)
+        return packet
+    
+    # begin statement used to gather basic info from teams, connect to wifi, init websocket and get it running
+    # raises OSError saying which step failed if it can't get the begin statement out within timeout_ms
+    # marker_ids are other ArUco markers (obstacles, payloads, ...) to track as well, see marker()
+    def begin(self, team_name, mission_type, aruco_id, room_num, timeout_ms=BEGIN_TIMEOUT_MS, marker_ids=()):
+        start = time.ticks_ms()
+        self._set_team(team_name, mission_type, aruco_id, room_num, marker_ids)
+        self._rx = bytearray(self._rx_size)
+        self._scan = vs.scan_buffer()
+        self._held_buf = bytearray(self._rx_size)
+        self.history = posehistory.PoseHistory()
+        
+        # Connect to WiFi
+        join = self._wlan_join(timeout_ms)
+        while not join.poll():
+            time.sleep_ms(10)
+        #print('Connected to WiFi')
+        timing = self._join_timing(join)
+        
+        # Connect to VS
+        left = self._time_left(start, timeout_ms)
+        try:
+            ws = web.connect(WS_URL, left, timing)
+        except (OSError, AssertionError) as e:
+            raise OSError(f"couldn't connect to VS at {WS_URL}: {e}")
+        self._set_timeout(ws)
+        self._use_ws(ws)
+        #print("Connected to WebSocket Server")
+        
+        # Send begin statement to VS
+        self._send_begin(ws)
+        self._begin_sent(start)
         
+        self._init_outbox()
         _thread.start_new_thread(self._websocket_client, ())
+        self._start_sender()
+    
+    # async version of begin, the VS link runs as a uasyncio task instead of a thread
+    # use as: await enes100.begin_async(...)
+    async def begin_async(self, team_name, mission_type, aruco_id, room_num, timeout_ms=BEGIN_TIMEOUT_MS,
+                          marker_ids=()):
+        global asyncio
+        import uasyncio as asyncio
+        start = time.ticks_ms()
+        self._set_team(team_name, mission_type, aruco_id, room_num, marker_ids)
+        self._scan = vs.scan_buffer()
+        self._held_buf = bytearray(self._rx_size)
+        self.history = posehistory.PoseHistory()
+        
+        # Connect to WiFi without blocking the event loop
+        join = self._wlan_join(timeout_ms)
+        while not join.poll():
+            await asyncio.sleep_ms(10)
+        timing = self._join_timing(join)
+        
+        # Connect to VS
+        left = self._time_left(start, timeout_ms)
+        try:
+            ws = await asyncio.wait_for_ms(web.connect_async(WS_URL, timing, self._rx_size), left)
+        except asyncio.TimeoutError:
+            raise OSError(f"couldn't connect to VS at {WS_URL}: timed out")
+        except (OSError, AssertionError) as e:
+            raise OSError(f"couldn't connect to VS at {WS_URL}: {e}")
+        self._use_ws(ws)
+        
+        # Send begin statement to VS
+        self._pose_event = asyncio.Event()
+        self._send_begin(ws)
+        self._begin_sent(start)
+        
+        self._init_outbox()
+        self._task = asyncio.create_task(self._websocket_client_async())
+        self._sender_task = asyncio.create_task(self._sender_async())
+    
+    # waits for the next aruco update from VS and returns it like get_pose(), async mode only
+    async def next_pose(self):
+        self._pose_event.clear()
+        await self._pose_event.wait()
+        return self.get_pose()
+    
+    # run_loop() for async mode: sleeps on the event loop between calls, fn is a plain function
+    # use as: await enes100.run_loop_async(fn, hz)
+    async def run_loop_async(self, fn, hz=20, sync_pose=False):
+        global looptimer
+        import looptimer
+        timer = self._loop = looptimer.LoopTimer(hz, sync_pose)
+        seq = self.pose_seq
+        timer.start(time.ticks_us())
+        while True:
+            wait = timer.wait_us(time.ticks_us())
+            if wait > 0:
+                # rounded up, the event loop only sleeps in whole ms
+                await asyncio.sleep_ms((wait + 999) // 1000)
+            pose_us = None
+            if sync_pose:
+                while not (self.pose_seq != seq and timer.accepts(self._pose_us)):
+                    now = time.ticks_us()
+                    if timer.expired(now):
+                        timer.stale += 1
+                        break
+                    left = timer.wait_us(now) + timer.guard_us + timer.late_us
+                    # the poses this loop hasn't taken yet came too early, so clearing loses nothing
+                    self._pose_event.clear()
+                    try:
+                        await asyncio.wait_for_ms(self._pose_event.wait(), left // 1000 + 1)
+                    except asyncio.TimeoutError:
+                        pass
+                if self.pose_seq != seq:
+                    # even one that came too early, the schedule moves towards it
+                    pose_us = self._pose_us
+            timer.tick(time.ticks_us(), pose_us)
+            pose = self.get_pose()
+            seq = pose[4]
+            stop = fn(pose) is False
+            timer.done(time.ticks_us())
+            if stop:
+                return timer.summary()
+    
+    # stops the async VS tasks and closes the websocket
+    async def end_async(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._sender_task:
+            self._sender_task.cancel()
+            self._sender_task = None
+            self._flush_outbox(True)
+        if self.ws:
+            await self.ws.close_async()
+    
+    # starts logging every frame to and from VS to path in flash, for replay(). the last run's log is
+    # kept as path.1, and a log that grows past max_bytes moves there too. returns the Recorder,
+    # whose records and dropped count what it has logged and lost. call before begin() so the log
+    # starts with the begin statement. left out, path, max_bytes and files are recorder's defaults
+    def record(self, path=None, max_bytes=None, files=None):
+        global recorder
+        import recorder
+        self.stop_recording()
+        self._recorder = recorder.Recorder(path or recorder.RECORD_PATH, max_bytes or recorder.RECORD_MAX_BYTES,
+                                           files or recorder.RECORD_FILES)
+        return self._recorder
+    
+    # writes out what's left of the log and closes it
+    def stop_recording(self):
+        rec = self._recorder
+        self._recorder = None
+        if rec:
+            rec.close()
+    
+    # plays a log from record() back instead of connecting to VS, speed times as fast as it was
+    # recorded (0 for as fast as it decodes). everything then works as it did in the recorded run:
+    # the same frames go through the same decoding, on the receive thread. the team, mission and
+    # markers come from the begin statement in the log. is_connected() goes false at its end
+    def replay(self, path, speed=1.0):
+        global recorder
+        import recorder
+        player = recorder.Player(path, speed)
+        packet = player.begin_packet() or {}
+        self._set_team(packet.get("teamName", ''), MISSION_NAMES[packet.get("teamType", 0)],
+                       packet.get("aruco", 0), 0, packet.get("markers", ()))
+        self._rx = bytearray(self._rx_size)
+        self._scan = vs.scan_buffer()
+        self._held_buf = bytearray(self._rx_size)
+        self.history = posehistory.PoseHistory()
+        # a gap in the log is part of the run, not a link to give up on. put back when it ends
+        link_timeout_ms = self.link_timeout_ms
+        self.link_timeout_ms = 0
+        self._records = "binary" in packet
+        self._use_ws(player)
+        self._init_outbox()
+        _thread.start_new_thread(self._replay_client, (link_timeout_ms,))
+        self._start_sender()
+    
+    # _websocket_client for replay(), stops at the end of the log and restores link_timeout_ms
+    def _replay_client(self, link_timeout_ms):
+        try:
+            while True:
+                opcode, n = self.ws.recv_into(self._rx, self.latest_wins)
+                if n:
+                    self._handle_frame(self._rx, n)
+                elif opcode is None:
+                    if self._held:
+                        self._take_latest(self._rx, 0)
+                    break
+                elif self._held:
+                    self._take_latest(self._rx, 0)
+            self._hide_pose()
+        finally:
+            self.link_timeout_ms = link_timeout_ms
         
     # handles the creation and delivery of the mission packet
+    # raises KeyError for a call that isn't one of the team's mission type, or a message name
+    # that doesn't go with the call
     def mission(self, mission_call, message):
-        mission_call = mission_stuff[mission_call.upper()]
+        templates = self._mission_templates
+        if templates is None:
+            # before begin()
+            return
+        template = templates.get(mission_call) or templates.get(mission_call.upper())
+        if template is None:
+            raise KeyError(mission_call)
         if (type(message) == str):
-            message = mission_stuff[message.upper()]
+            names = template[2]
+            name = message if message in names else message.upper()
+            if name not in names:
+                raise KeyError(message)
+            message = template[3][names.index(name)]
+        # encoded now so a message that isn't JSON raises here rather than in the sender
+        text = json.dumps(message).encode()
             
-        packet = {
-            "op": "mission",
-            "teamName": self.team_name,
-            "type": mission_call,
-            "message": message
-        }
-        self._send_packet(packet)
+        # queued for the sender, which always sends missions before prints
+        if self._prints:
+            if len(self._missions) < outbox.MISSION_QUEUE_SIZE:
+                self._missions.append((template, message, text))
+            else:
+                self._stats.missions_dropped += 1
         
-    # handles the creation and delivery of the mission packet
+    # queues a message for the VS console, merged with other prints into one packet
     def print(self, message):
-        packet = {
-            "op": "print",
-            "teamName": self.team_name,
-            "message": str(message) + '\n'
-        }
-        self._send_packet(packet)
-        #print(json.dumps(packet))
+        if self._prints:
+            self._prints.put((str(message) + '\n').encode())
         
+    # returns (x, y, theta, is_visible, seq, ticks_ms) all from the same VS frame
+    def get_pose(self):
+        with self._pose_lock:
+            return self.x, self.y, self.theta, self.is_visible, self.pose_seq, self.pose_ticks
+    
+    # waits until a pose newer than seq arrives (newer than the current one if seq is None)
+    # returns the get_pose() snapshot, or None if timeout_ms runs out first
+    def wait_new_pose(self, timeout_ms=1000, seq=None):
+        if seq is None:
+            seq = self.pose_seq
+        start = time.ticks_ms()
+        while self.pose_seq == seq:
+            if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+                return None
+            # let the receive thread run instead of spinning
+            time.sleep_ms(1)
+        return self.get_pose()
+    
+    # calls fn(pose) hz times a second until it returns False, pose being a get_pose() snapshot
+    # with sync_pose each call comes just after a new pose from VS instead (keep hz at or below the
+    # VS rate), or half a period late with the old pose if none comes. between calls the loop sleeps,
+    # so the receive thread gets the CPU. returns loop_stats() once it stops
+    def run_loop(self, fn, hz=20, sync_pose=False):
+        global looptimer
+        import looptimer
+        timer = self._loop = looptimer.LoopTimer(hz, sync_pose)
+        seq = self.pose_seq
+        timer.start(time.ticks_us())
+        while True:
+            wait = timer.wait_us(time.ticks_us())
+            if wait > 1000:
+                # whole ms first, sleep_ms lets other threads run
+                time.sleep_ms(wait // 1000)
+                wait = timer.wait_us(time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+            pose_us = None
+            if sync_pose:
+                while not (self.pose_seq != seq and timer.accepts(self._pose_us)):
+                    if timer.expired(time.ticks_us()):
+                        timer.stale += 1
+                        break
+                    time.sleep_ms(1)
+                if self.pose_seq != seq:
+                    # even one that came too early, the schedule moves towards it
+                    pose_us = self._pose_us
+            timer.tick(time.ticks_us(), pose_us)
+            pose = self.get_pose()
+            seq = pose[4]
+            stop = fn(pose) is False
+            timer.done(time.ticks_us())
+            if stop:
+                return timer.summary()
+    
+    # how the running (or last) run_loop() is keeping to its rate, as a dict: achieved hz, ticks,
+    # overruns (calls that ran past the next one's time), skipped (calls dropped to catch up),
+    # stale (sync_pose calls without a new pose), jitter between calls and fn's run time. None before
+    # the first run_loop()
+    def loop_stats(self):
+        return self._loop.summary() if self._loop else None
+    
+    # (x, y, theta) at a time.ticks_ms() value, interpolated from recent poses or extrapolated past them
+    # None until the marker has been seen
+    def pose_at(self, ticks_ms):
+        with self._pose_lock:
+            return self.history.pose_at(ticks_ms) if self.history else None
+    
+    # the region and waypoint table, created on first use
+    def _geofence(self):
+        global geofence
+        if not self._fence:
+            import geofence
+            self._fence = geofence.Geofence()
+        return self._fence
+    
+    # adds a region called name, checked against every visible pose from VS, see on_enter()/inside()
+    # coordinates are meters on the arena, like x and y
+    def add_box(self, name, x_min, y_min, x_max, y_max):
+        with self._pose_lock:
+            self._geofence().add_box(name, x_min, y_min, x_max, y_max)
+    
+    def add_circle(self, name, x, y, radius):
+        with self._pose_lock:
+            self._geofence().add_circle(name, x, y, radius)
+    
+    # a region that the marker is in while theta is within tolerance of theta (radians)
+    def add_heading(self, name, theta, tolerance):
+        with self._pose_lock:
+            self._geofence().add_heading(name, theta, tolerance)
+    
+    # a point to drive to, arrived at within radius of it, and if theta is given, facing theta
+    # within tolerance. see on_arrived() and nearest_waypoint()
+    def add_waypoint(self, name, x, y, radius=0.1, theta=None, tolerance=0.2):
+        with self._pose_lock:
+            self._geofence().add_waypoint(name, x, y, radius, theta, tolerance)
+    
+    # removes a region or waypoint
+    def remove_region(self, name):
+        with self._pose_lock:
+            self._geofence().remove(name)
+    
+    # whether the marker is in the region name (or has arrived at the waypoint), as of the last visible pose
+    def inside(self, name):
+        with self._pose_lock:
+            return self._geofence().is_inside(name)
+    
+    # (name, distance in m) of the waypoint nearest the last visible pose, None if there aren't any
+    def nearest_waypoint(self):
+        with self._pose_lock:
+            return self._fence.nearest_waypoint() if self._fence else None
+    
+    # (x, y, theta, is_visible, ticks_ms) of a marker subscribed to in begin(), as of the last time
+    # VS saw it (ticks_ms is when that was), None until it has been seen. KeyError for other IDs
+    def marker(self, marker_id):
+        if not self._markers:
+            raise KeyError(marker_id)
+        with self._pose_lock:
+            return self._markers.get(marker_id)
+    
+    # puts the IDs of subscribed markers seen within r meters of (x, y) in the last max_age_ms into
+    # out, a preallocated array or list, and returns how many. markers are compared in integer mm,
+    # so only converting x, y and r allocates and it can run every pass of a control loop
+    def markers_within(self, x, y, r, out, max_age_ms=1000):
+        if not self._markers:
+            return 0
+        with self._pose_lock:
+            return self._markers.within(x, y, r, out, max_age_ms)
+    
+    # (vx, vy) in m/s over about the last window_ms, None until two poses have been seen
+    def velocity(self, window_ms=200):
+        with self._pose_lock:
+            return self.history.velocity(window_ms) if self.history else None
+    
+    # turn rate in rad/s over about the last window_ms, None until two poses have been seen
+    def angular_rate(self, window_ms=200):
+        with self._pose_lock:
+            return self.history.angular_rate(window_ms) if self.history else None
+    
+    # link telemetry as a dict: receive rate and inter-arrival gaps (over the last 64 frames),
+    # send time, ping RTT, bytes and frames on the wire, dropped and oversized frames, how often
+    # sends had to wait for each other, reconnects and keepalive timeouts
+    def stats(self):
+        s = self._stats.summary()
+        wire = self._wire
+        ws = self.ws
+        s['frames_in'] = wire[0] + (ws.frames_in if ws else 0)
+        s['frames_out'] = wire[1] + (ws.frames_out if ws else 0)
+        s['bytes_in'] = wire[2] + (ws.bytes_in if ws else 0)
+        s['bytes_out'] = wire[3] + (ws.bytes_out if ws else 0)
+        s['oversized'] = wire[4] + (ws.oversized if ws else 0)
+        waits = wire[5] + (ws.lock_waits if ws else 0)
+        s['send_lock_waits'] = waits
+        s['send_lock_wait_mean_us'] = (wire[6] + (ws.lock_wait_us if ws else 0)) // waits if waits else 0
+        s['send_lock_wait_max_us'] = max(self._lock_wait_max_us, ws.lock_wait_max_us if ws else 0)
+        s['control_handoffs'] = wire[7] + (ws.control_handoffs if ws else 0)
+        s['reconnects'] = self.reconnects
+        s['recover_ms'] = self.recover_ms
+        s['link_timeouts'] = self.link_timeouts
+        s['pongs_missed'] = self.pongs_missed
+        return s
+    
+    # one line summary of stats() for the VS console
+    def _stats_line(self):
+        s = self.stats()
+        return (f"link: {s['fps']:.1f} fps, gap {s['gap_min_ms']}/{s['gap_mean_ms']:.0f}/{s['gap_max_ms']}/{s['gap_p95_ms']} ms"
+                f" (min/mean/max/p95), rtt {s['rtt_ms']} ms, send {s['send_mean_us']} us,"
+                f" in {s['bytes_in']} B, out {s['bytes_out']} B, dropped {s['dropped']},"
+                f" oversized {s['oversized']}, reconnects {s['reconnects']}")
+    
+    # calls cb(x, y, theta, is_visible) soon after each update from VS, see _fire for where it runs
+    # updates that arrive while cb is still waiting to run are covered by that one run
+    def on_pose(self, cb):
+        self._add_callback(EV_POSE, cb)
+    
+    # calls cb(is_visible) when the marker appears or disappears, including when updates stop
+    def on_visibility_change(self, cb):
+        self._add_callback(EV_VISIBILITY, cb)
+    
+    # calls cb() when the link to VS drops, before the library starts reconnecting
+    def on_disconnect(self, cb):
+        self._add_callback(EV_DISCONNECT, cb)
+    
+    # calls cb(name) when the marker goes into / comes out of a region, see add_box() and similar
+    def on_enter(self, cb):
+        self._add_callback(EV_ENTER, cb)
+    
+    def on_exit(self, cb):
+        self._add_callback(EV_EXIT, cb)
+    
+    # calls cb(name) when the marker arrives at a waypoint, see add_waypoint()
+    def on_arrived(self, cb):
+        self._add_callback(EV_ARRIVED, cb)
+    
+    # unregisters cb from every event
+    def remove_callback(self, cb):
+        table = self._callbacks
+        for i in range(len(table)):
+            if table[i] == cb:
+                table[i] = None
+        events = 0
+        for i in range(len(table)):
+            if table[i] is not None:
+                events |= 1 << (i // CALLBACK_SLOTS)
+        self._events = events
+    
     # checks if device is still connected to VS through websocket
+    # false as soon as the keepalive gives up on a silent link, see link_timeout_ms
     def is_connected(self):
-        return self.ws.open
+        return bool(self.ws) and self.ws.open and not self._link_dead
     
 # create instance... what's used by the students. Is the self parameter
 enes100 = Enes100()
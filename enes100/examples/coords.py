@@ -11,10 +11,14 @@ def simple_test():
     # enes100.theta -> your theta. -pi to pi, in radians, -1 if aruco is not visible
     
     # will print OTV coordinates if aruco id in begin statement is visible on arena
-   
-   while True:
-       enes100.print(f'We are at {enes100.x=} {enes100.y=} {enes100.theta=}')
-       enes100.print(f'Aruco Visible? {enes100.is_visible=}')
-       enes100.pring(f'Connnected? {enes100.is_connected()}')
+    # run_loop calls show() twice a second, right after a new location arrives, instead of
+    # spinning in a while True loop
+    def show(pose):
+        x, y, theta, is_visible, seq, ticks = pose
+        enes100.print(f'We are at {x=} {y=} {theta=}')
+        enes100.print(f'Aruco Visible? {is_visible=}')
+        enes100.print(f'Connected? {enes100.is_connected()}')
+    
+    enes100.run_loop(show, hz=2, sync_pose=True)
 
-simple_test()
\ No newline at end of file
+simple_test()
@@ -0,0 +1,220 @@
+"""
+Regions and waypoints checked against each VS pose
+
+Teams keep asking the same questions of every pose: am I in the mission
+zone, am I past this line, am I facing the right way, am I there yet. A
+Geofence holds a small fixed table of regions (axis-aligned boxes, circles
+and heading windows) and waypoints, and update() answers all of them once
+per pose, straight from the receive path, instead of in every pass of the
+user's loop.
+
+The table is preallocated arrays. Circles and waypoints also keep their
+bounding box, so a pose well away from one is rejected with four
+comparisons before any distance is worked out. Each slot is one bit of an
+int: which regions the marker is in, and which have been entered, exited
+or arrived at since the events were last taken. An edge only counts once
+the marker is past it by margin (angle_margin for headings), so VS jitter
+right on a boundary doesn't produce a stream of enter/exit pairs.
+"""
+
+import math
+from array import array
+from posehistory import wrap_angle
+
+# Slots for regions and waypoints together, one bit each
+GEOFENCE_SIZE = const(16)
+
+KIND_BOX = const(1)
+KIND_CIRCLE = const(2)
+KIND_HEADING = const(3)
+KIND_WAYPOINT = const(4)
+
+# Indexes for take()
+EVENT_ENTER = const(0)
+EVENT_EXIT = const(1)
+EVENT_ARRIVED = const(2)
+
+
+class Geofence:
+    """
+    Named regions and waypoints, in meters and radians like the VS pose.
+
+    A waypoint is arrived at once the marker is within radius of it (and,
+    if it was given a theta, facing that way within tolerance). It can be
+    arrived at again after leaving.
+    """
+
+    def __init__(self, size=GEOFENCE_SIZE):
+        self.size = size
+        self.kind = bytearray(size)  # 0 for a free slot
+        self.names = [None] * size
+        # bounds: the box itself, or the bounding box of a circle or waypoint
+        self.x_min = array('f', [0] * size)
+        self.y_min = array('f', [0] * size)
+        self.x_max = array('f', [0] * size)
+        self.y_max = array('f', [0] * size)
+        # centre and radius of circles and waypoints
+        self.cx = array('f', [0] * size)
+        self.cy = array('f', [0] * size)
+        self.r = array('f', [0] * size)
+        # heading window, tolerance < 0 for a waypoint that doesn't care
+        self.theta = array('f', [0] * size)
+        self.tolerance = array('f', [0] * size)
+        self.used = 0  # slots below this may be in use
+
+        self.margin = 0.02
+        self.angle_margin = 0.03
+
+        self.waypoints = 0  # bit per slot holding a waypoint
+        self.inside = 0  # bit per slot the marker is in (arrived at, for waypoints)
+        self.events = [0, 0, 0]  # bits entered, exited and arrived at since take()
+        self.nearest = -1  # slot of the nearest waypoint at the last update
+        self.nearest_d2 = 0.0
+
+    def _slot(self, name, kind):
+        if name in self.names:
+            raise ValueError(f'{name} already exists')
+        if None not in self.names:
+            raise ValueError(f'at most {self.size} regions and waypoints')
+        i = self.names.index(None)
+        self.names[i] = name
+        self.kind[i] = kind
+        self.used = max(self.used, i + 1)
+        self._forget(i)
+        return i
+
+    def _forget(self, i):
+        bit = 1 << i
+        self.waypoints &= ~bit
+        self.inside &= ~bit
+        for event in range(3):
+            self.events[event] &= ~bit
+        if self.nearest == i:
+            self.nearest = -1
+
+    def _bounds(self, i, x, y, r):
+        self.cx[i] = x
+        self.cy[i] = y
+        self.r[i] = r
+        self.x_min[i] = x - r
+        self.y_min[i] = y - r
+        self.x_max[i] = x + r
+        self.y_max[i] = y + r
+
+    def add_box(self, name, x_min, y_min, x_max, y_max):
+        if x_min > x_max or y_min > y_max:
+            raise ValueError('box min is above max')
+        i = self._slot(name, KIND_BOX)
+        self.x_min[i] = x_min
+        self.y_min[i] = y_min
+        self.x_max[i] = x_max
+        self.y_max[i] = y_max
+
+    def add_circle(self, name, x, y, radius):
+        i = self._slot(name, KIND_CIRCLE)
+        self._bounds(i, x, y, radius)
+
+    def add_heading(self, name, theta, tolerance):
+        """Facing theta, within tolerance either way."""
+        i = self._slot(name, KIND_HEADING)
+        self.theta[i] = wrap_angle(theta)
+        self.tolerance[i] = tolerance
+
+    def add_waypoint(self, name, x, y, radius, theta=None, tolerance=0.0):
+        i = self._slot(name, KIND_WAYPOINT)
+        self.waypoints |= 1 << i
+        self._bounds(i, x, y, radius)
+        self.theta[i] = 0.0 if theta is None else wrap_angle(theta)
+        self.tolerance[i] = -1.0 if theta is None else tolerance
+
+    def remove(self, name):
+        i = self.names.index(name)
+        self.names[i] = None
+        self.kind[i] = 0
+        self._forget(i)
+
+    def is_inside(self, name):
+        return bool(self.inside >> self.names.index(name) & 1)
+
+    def update(self, x, y, theta, wanted=7):
+        """
+        Check a pose against every region. Returns a bit per kind of event
+        (1 << EVENT_ENTER, ...) that has new entries; those are only kept
+        for the kinds set in wanted.
+        """
+        inside = self.inside
+        now_inside = 0
+        nearest = -1
+        nearest_d2 = 0.0
+        kinds = self.kind
+        for i in range(self.used):
+            kind = kinds[i]
+            if not kind:
+                continue
+            bit = 1 << i
+            m = self.margin if inside & bit else 0.0
+            if kind == KIND_HEADING:
+                a = self.angle_margin if inside & bit else 0.0
+                if abs(wrap_angle(theta - self.theta[i])) <= self.tolerance[i] + a:
+                    now_inside |= bit
+                continue
+            if kind == KIND_WAYPOINT:
+                dx = x - self.cx[i]
+                dy = y - self.cy[i]
+                d2 = dx * dx + dy * dy
+                if nearest < 0 or d2 < nearest_d2:
+                    nearest = i
+                    nearest_d2 = d2
+            if not (self.x_min[i] - m <= x <= self.x_max[i] + m and
+                    self.y_min[i] - m <= y <= self.y_max[i] + m):
+                continue
+            if kind != KIND_BOX:
+                if kind == KIND_CIRCLE:
+                    dx = x - self.cx[i]
+                    dy = y - self.cy[i]
+                    d2 = dx * dx + dy * dy
+                r = self.r[i] + m
+                if d2 > r * r:
+                    continue
+                if kind == KIND_WAYPOINT and self.tolerance[i] >= 0:
+                    a = self.angle_margin if inside & bit else 0.0
+                    if abs(wrap_angle(theta - self.theta[i])) > self.tolerance[i] + a:
+                        continue
+            now_inside |= bit
+
+        self.inside = now_inside
+        self.nearest = nearest
+        self.nearest_d2 = nearest_d2
+        changed = inside ^ now_inside
+        if not changed:
+            return 0
+
+        waypoints = self.waypoints
+        entered = changed & now_inside
+        found = 0
+        if wanted & 1 and entered & ~waypoints:
+            self.events[EVENT_ENTER] |= entered & ~waypoints
+            found |= 1
+        if wanted & 2 and changed & inside & ~waypoints:
+            self.events[EVENT_EXIT] |= changed & inside & ~waypoints
+            found |= 2
+        if wanted & 4 and entered & waypoints:
+            self.events[EVENT_ARRIVED] |= entered & waypoints
+            found |= 4
+        return found
+
+    def take(self, event):
+        """The bits of event since the last take(), cleared."""
+        bits = self.events[event]
+        self.events[event] = 0
+        return bits
+
+    def give_back(self, event, bits):
+        """Return bits taken from event that couldn't be delivered, for the next take()."""
+        self.events[event] |= bits
+
+    def nearest_waypoint(self):
+        """(name, distance) of the nearest waypoint at the last update, or None."""
+        if self.nearest < 0:
+            return None
+        return self.names[self.nearest], math.sqrt(self.nearest_d2)
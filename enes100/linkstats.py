@@ -0,0 +1,92 @@
+"""
+Link telemetry for the VS connection
+
+Counters are plain ints and a preallocated window of inter-arrival gaps, so
+recording costs a few integer operations per frame and can stay on in
+production. Summaries (mean, p95, ...) are only computed when asked for.
+"""
+
+import time
+from array import array
+
+STATS_WINDOW = const(64)
+
+
+class LinkStats:
+    """
+    Receive timing, send latency and round-trip time for one link.
+
+    Byte and frame counts live on the websocket itself; see
+    Enes100.stats() for how the two are combined.
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        # Inter-arrival gaps in ms of the last `window` frames, as a ring
+        self.gaps = array('i', [0] * window)
+        self.gap_head = 0
+        self.gap_count = 0
+        self.last_rx = 0
+        self.frames = 0
+        self.dropped = 0  # frames that couldn't be decoded
+        self.skipped = 0  # poses superseded before they were decoded (latest_wins)
+        self.prints_dropped = 0  # print() messages lost to a full queue
+        self.missions_dropped = 0  # mission() calls lost to a full queue
+
+        self.sends = 0
+        self.send_total_us = 0
+        self.send_max_us = 0
+
+        self.rtt_ms = -1  # last measured, -1 until a pong arrives
+        self.rtt_min_ms = -1
+        self.rtt_max_ms = -1
+
+    def received(self, ticks):
+        """Record a frame arriving at time.ticks_ms() ticks."""
+        if self.frames:
+            i = self.gap_head
+            self.gaps[i] = time.ticks_diff(ticks, self.last_rx)
+            i += 1
+            self.gap_head = 0 if i == len(self.gaps) else i
+            if self.gap_count < len(self.gaps):
+                self.gap_count += 1
+        self.last_rx = ticks
+        self.frames += 1
+
+    def sent(self, us):
+        """Record a send that took us microseconds."""
+        self.sends += 1
+        self.send_total_us += us
+        if us > self.send_max_us:
+            self.send_max_us = us
+
+    def rtt(self, ms):
+        """Record a ping round trip of ms milliseconds."""
+        self.rtt_ms = ms
+        if self.rtt_min_ms < 0 or ms < self.rtt_min_ms:
+            self.rtt_min_ms = ms
+        if ms > self.rtt_max_ms:
+            self.rtt_max_ms = ms
+
+    def summary(self):
+        """Return the timing figures as a dict."""
+        n = self.gap_count
+        gaps = sorted(self.gaps[:n]) if n else None
+        total = sum(gaps) if n else 0
+        return {
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'skipped': self.skipped,
+            'prints_dropped': self.prints_dropped,
+            'missions_dropped': self.missions_dropped,
+            'fps': n * 1000 / total if total else 0.0,
+            'gap_min_ms': gaps[0] if n else -1,
+            'gap_mean_ms': total / n if n else -1,
+            'gap_max_ms': gaps[-1] if n else -1,
+            'gap_p95_ms': gaps[(n * 95 - 1) // 100] if n else -1,
+            'sends': self.sends,
+            'send_mean_us': self.send_total_us // self.sends if self.sends else -1,
+            'send_max_us': self.send_max_us if self.sends else -1,
+            'rtt_ms': self.rtt_ms,
+            'rtt_min_ms': self.rtt_min_ms,
+            'rtt_max_ms': self.rtt_max_ms,
+        }
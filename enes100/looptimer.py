@@ -0,0 +1,133 @@
+"""
+Fixed-rate scheduling for the user's control loop
+
+A bare `while True:` loop runs as fast as the interpreter can go: it keeps
+the receive thread waiting for the GIL, burns power, and its rate changes
+with whatever else the board is doing. A LoopTimer hands out deadlines a
+fixed period apart instead, so the caller can sleep until the next one, and
+keeps count of how well the loop kept up.
+
+Deadlines advance from the previous deadline, not from when the loop woke,
+so small delays don't add up into drift. A tick that runs past the next
+deadline is an overrun; the loop then starts again straight away, and any
+deadlines it missed completely are skipped rather than run back to back.
+
+With sync_pose the loop follows the VS instead of its own clock. Each tick
+wakes a quarter period before it is due and waits for a pose to arrive,
+running as soon as one does, or half a period after it was due with the old
+pose if none comes (see Enes100.run_loop()). Poses that arrived before it
+woke don't count, so with the VS sending faster than hz the loop keeps to
+every second or third pose rather than creeping forward onto the next one.
+Every new pose a tick sees, even one that came too early to run on, nudges
+the schedule a quarter of the way towards it, so the loop settles just
+behind the VS stream and rides out jitter in it.
+
+Everything is in time.ticks_us() and recording a tick only touches ints and
+a preallocated window of intervals. Summaries are computed when asked for.
+"""
+
+import time
+from array import array
+
+LOOP_WINDOW = const(64)
+
+
+class LoopTimer:
+    """
+    Deadlines hz times a second, and the timing of the ticks run on them.
+
+    ticks, overruns, skipped (deadlines missed entirely) and stale (sync_pose
+    ticks that gave up waiting for a new pose) count what has happened.
+    """
+
+    def __init__(self, hz, sync_pose=False, window=LOOP_WINDOW):
+        if hz <= 0:
+            raise ValueError('hz must be above 0')
+        self.period_us = int(1000000 / hz)
+        # how far ahead of and behind its time a sync_pose tick waits for a pose
+        self.guard_us = self.period_us >> 2 if sync_pose else 0
+        self.late_us = self.period_us >> 1 if sync_pose else 0
+        self.due = 0  # ticks_us to wake for the next tick, guard_us before its time
+        self.last = 0  # ticks_us the last tick started
+        # intervals in us between the last `window` tick starts, as a ring
+        self.intervals = array('i', [0] * window)
+        self.head = 0
+        self.count = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.stale = 0
+        self.run_total_us = 0
+        self.run_max_us = 0
+
+    def start(self, now):
+        """Make the first deadline now."""
+        self.due = now
+
+    def wait_us(self, now):
+        """How long until the next deadline, <= 0 if it has passed."""
+        return time.ticks_diff(self.due, now)
+
+    def accepts(self, pose_us):
+        """Whether a pose that arrived at ticks_us pose_us is one the next tick can run on."""
+        return time.ticks_diff(pose_us, self.due) >= 0
+
+    def expired(self, now):
+        """Whether a sync_pose tick has waited as long as it will for a pose."""
+        return time.ticks_diff(now, self.due) >= self.guard_us + self.late_us
+
+    def tick(self, now, pose_us=None):
+        """
+        Record a tick starting at now. pose_us is when the newest pose since
+        the last tick arrived (sync_pose only), which the schedule is then
+        moved towards.
+        """
+        if self.ticks:
+            i = self.head
+            self.intervals[i] = time.ticks_diff(now, self.last)
+            i += 1
+            self.head = 0 if i == len(self.intervals) else i
+            if self.count < len(self.intervals):
+                self.count += 1
+        self.last = now
+        self.ticks += 1
+        if pose_us is not None:
+            error = time.ticks_diff(pose_us, self.due) - self.guard_us
+            self.due = time.ticks_add(self.due, error // 4)
+
+    def done(self, now):
+        """Record the tick that started last finishing at now, and set the next deadline."""
+        run = time.ticks_diff(now, self.last)
+        self.run_total_us += run
+        if run > self.run_max_us:
+            self.run_max_us = run
+        period = self.period_us
+        due = time.ticks_add(self.due, period)
+        late = time.ticks_diff(now, due) - self.guard_us
+        if late > 0:
+            self.overruns += 1
+            missed = late // period
+            if missed:
+                self.skipped += missed
+                due = time.ticks_add(due, missed * period)
+        self.due = due
+
+    def summary(self):
+        """Return the loop timing as a dict. Jitter is how far intervals were from the period."""
+        n = self.count
+        period = self.period_us
+        jitter = sorted(abs(d - period) for d in self.intervals[:n]) if n else None
+        total = sum(self.intervals[:n]) if n else 0
+        return {
+            'hz': n * 1000000 / total if total else 0.0,
+            'period_us': period,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'stale': self.stale,
+            'jitter_mean_us': sum(jitter) // n if n else -1,
+            'jitter_max_us': jitter[-1] if n else -1,
+            'jitter_p95_us': jitter[(n * 95 - 1) // 100] if n else -1,
+            'run_mean_us': self.run_total_us // self.ticks if self.ticks else -1,
+            'run_max_us': self.run_max_us if self.ticks else -1,
+        }
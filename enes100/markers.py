@@ -0,0 +1,114 @@
+"""
+Poses of other ArUco markers seen by the VS
+
+By default the VS only reports the team's own marker. A team can subscribe
+to more (obstacles, payloads, other robots) by listing their IDs in
+begin(); the VS then sends their poses too, as a {"op": "markers", ...}
+frame or as extra POSE records after the team's own (see vsprotocol).
+
+The table is fixed at begin: one slot per subscribed ID in preallocated
+arrays, and a byte per ID up to the largest one mapping it to its slot, so
+an update is an index and a few stores. Poses are kept in integer
+millimetres and milliradians, the VS's own resolution. On the ESP32 every
+float result is a new heap object, so within() turns its query into
+millimetres once and then works in small ints. Asking for "every marker
+within r" costs the same few allocations however many markers there are,
+and it writes into an output buffer the caller made beforehand.
+"""
+
+import time
+from array import array
+
+MAX_MARKERS = const(32)
+NO_SLOT = const(0xff)
+
+# Receive buffer room a marker needs in a JSON markers frame
+MARKER_JSON_SIZE = const(80)
+
+
+class MarkerTable:
+    """
+    Last known pose, visibility and last-seen time of each subscribed marker.
+    A marker's pose is the last one it was visible at.
+    """
+
+    def __init__(self, ids):
+        if len(ids) > MAX_MARKERS:
+            raise ValueError(f'at most {MAX_MARKERS} markers')
+        n = len(ids)
+        self.ids = array('H', ids)
+        self.slot_of = bytearray(b'\xff' * (max(ids) + 1 if n else 0))
+        for slot in range(n):
+            self.slot_of[ids[slot]] = slot
+        # in mm and mrad
+        self.x = array('i', [0] * n)
+        self.y = array('i', [0] * n)
+        self.theta = array('h', [0] * n)
+        self.seen = array('i', [0] * n)  # time.ticks_ms() it was last visible
+        self.visible = bytearray(n)  # in the last report
+        self.known = bytearray(n)  # has been visible at least once
+
+    def slot(self, marker):
+        """The marker's slot, or -1 if it isn't subscribed."""
+        if 0 <= marker < len(self.slot_of):
+            slot = self.slot_of[marker]
+            if slot != NO_SLOT:
+                return slot
+        return -1
+
+    def update(self, marker, visible, x, y, theta, ticks):
+        """Record a report from VS, in meters and radians. Reports for other IDs are ignored."""
+        slot = self.slot(marker)
+        if slot < 0:
+            return
+        self.visible[slot] = visible
+        if visible:
+            self.x[slot] = round(x * 1000)
+            self.y[slot] = round(y * 1000)
+            self.theta[slot] = round(theta * 1000)
+            self.seen[slot] = ticks
+            self.known[slot] = 1
+
+    def hide_all(self):
+        for slot in range(len(self.visible)):
+            self.visible[slot] = 0
+
+    def get(self, marker):
+        """(x, y, theta, is_visible, ticks_ms last seen), None until it has been seen."""
+        slot = self.slot(marker)
+        if slot < 0:
+            raise KeyError(marker)
+        if not self.known[slot]:
+            return None
+        return (self.x[slot] / 1000, self.y[slot] / 1000, self.theta[slot] / 1000,
+                bool(self.visible[slot]), self.seen[slot])
+
+    def within(self, x, y, r, out, max_age_ms):
+        """
+        Put the IDs of markers last seen within r of (x, y), no more than
+        max_age_ms ago, into out (an array or list). Returns how many; any
+        past len(out) are left out. Distances are compared in whole mm.
+        """
+        now = time.ticks_ms()
+        x = round(x * 1000)
+        y = round(y * 1000)
+        r = round(r * 1000)
+        r2 = r * r
+        count = 0
+        limit = len(out)
+        known = self.known
+        xs = self.x
+        ys = self.y
+        for slot in range(len(self.ids)):
+            if not known[slot] or time.ticks_diff(now, self.seen[slot]) > max_age_ms:
+                continue
+            dx = xs[slot] - x
+            if dx > r or dx < -r:
+                continue
+            dy = ys[slot] - y
+            if dy > r or dy < -r:
+                continue
+            if dx * dx + dy * dy <= r2 and count < limit:
+                out[count] = self.ids[slot]
+                count += 1
+        return count
@@ -0,0 +1,56 @@
+"""
+Outbound queue for enes100.print() text
+
+print() only copies its text into a fixed-size buffer. A sender (a
+thread, or a task in async mode) later drains everything queued into a single
+print packet, so a tight loop of prints costs one frame per flush instead of
+one TCP write per call, and never waits on the socket.
+"""
+
+import _thread
+
+PRINT_QUEUE_SIZE = const(512)
+# Missions waiting for the sender, more are dropped and counted
+MISSION_QUEUE_SIZE = const(16)
+
+
+class PrintQueue:
+    """
+    Bounded buffer of pending print text.
+
+    The sender always drains it completely, so text is simply appended and
+    never has to wrap. Messages that don't fit are dropped and counted; the
+    count is reported in the next flush so the VS console shows that output
+    was lost.
+    """
+
+    def __init__(self, size=PRINT_QUEUE_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.count = 0  # number of queued bytes
+        self.dropped = 0  # messages dropped since the last take()
+        self.lock = _thread.allocate_lock()
+
+    def put(self, data):
+        """Queue data (bytes) if it fits. Returns False if it was dropped."""
+        n = len(data)
+        with self.lock:
+            if n > len(self.buf) - self.count:
+                self.dropped += 1
+                return False
+            self.mv[self.count:self.count + n] = data
+            self.count += n
+        return True
+
+    def take(self, out):
+        """
+        Move everything queued into out, which must be at least as big as
+        the queue. Returns (n, dropped) with the text in out[:n].
+        """
+        with self.lock:
+            n = self.count
+            out[:n] = self.mv[:n]
+            dropped = self.dropped
+            self.count = 0
+            self.dropped = 0
+        return n, dropped
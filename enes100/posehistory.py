@@ -0,0 +1,133 @@
+"""
+Pose history for the VS marker
+
+A fixed-size ring of timestamped poses, stored in preallocated arrays so
+recording a pose never allocates. Queries look back from the newest sample,
+so the usual "where am I now / how fast am I going" questions only touch the
+last couple of entries.
+"""
+
+import math
+import time
+from array import array
+
+POSE_HISTORY_SIZE = const(32)
+
+PI = math.pi
+TWO_PI = 2 * math.pi
+
+
+def wrap_angle(a):
+    """Wrap an angle in radians to [-pi, pi)."""
+    return (a + PI) % TWO_PI - PI
+
+
+class PoseHistory:
+    """
+    Ring buffer of (ticks_ms, x, y, theta) samples.
+
+    Angles are interpolated and differentiated the short way round, so a
+    marker turning through +-pi doesn't look like it spun a full circle.
+    """
+
+    def __init__(self, size=POSE_HISTORY_SIZE):
+        self.size = size
+        self.t = array('i', [0] * size)
+        self.x = array('f', [0] * size)
+        self.y = array('f', [0] * size)
+        self.theta = array('f', [0] * size)
+        self.head = 0  # slot the next sample goes in
+        self.count = 0
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def append(self, ticks, x, y, theta):
+        """Record a sample. ticks is the time.ticks_ms() it was taken at."""
+        i = self.head
+        self.t[i] = ticks
+        self.x[i] = x
+        self.y[i] = y
+        self.theta[i] = theta
+        i += 1
+        self.head = 0 if i == self.size else i
+        if self.count < self.size:
+            self.count += 1
+
+    def _index(self, age):
+        """Slot of the sample age steps back from the newest (0)."""
+        i = self.head - 1 - age
+        return i + self.size if i < 0 else i
+
+    def _window_start(self, window_ms):
+        """
+        Slot of the oldest sample at most window_ms older than the newest,
+        but always at least one step back. Needs two samples.
+        """
+        t = self.t
+        newest = t[self._index(0)]
+        age = 1
+        while (age < self.count - 1 and
+               time.ticks_diff(newest, t[self._index(age + 1)]) <= window_ms):
+            age += 1
+        return self._index(age)
+
+    def pose_at(self, ticks):
+        """
+        Return (x, y, theta) at ticks, interpolated between the samples on
+        either side, or extrapolated from the nearest two outside the
+        recorded range. None if the history is empty.
+        """
+        if not self.count:
+            return None
+        b = self._index(0)
+        if self.count == 1:
+            return self.x[b], self.y[b], self.theta[b]
+
+        # Walk back until ticks falls after the older sample of the pair
+        t = self.t
+        age = 0
+        a = self._index(1)
+        while age < self.count - 2 and time.ticks_diff(ticks, t[a]) < 0:
+            age += 1
+            b = a
+            a = self._index(age + 1)
+
+        span = time.ticks_diff(t[b], t[a])
+        if span <= 0:
+            return self.x[b], self.y[b], self.theta[b]
+        f = time.ticks_diff(ticks, t[a]) / span
+        return (self.x[a] + f * (self.x[b] - self.x[a]),
+                self.y[a] + f * (self.y[b] - self.y[a]),
+                wrap_angle(self.theta[a] +
+                           f * wrap_angle(self.theta[b] - self.theta[a])))
+
+    def velocity(self, window_ms=200):
+        """
+        Return (vx, vy) in m/s over roughly the last window_ms, or None
+        with fewer than two samples.
+        """
+        if self.count < 2:
+            return None
+        b = self._index(0)
+        a = self._window_start(window_ms)
+        dt = time.ticks_diff(self.t[b], self.t[a])
+        if dt <= 0:
+            return None
+        return ((self.x[b] - self.x[a]) * 1000 / dt,
+                (self.y[b] - self.y[a]) * 1000 / dt)
+
+    def angular_rate(self, window_ms=200):
+        """
+        Return the turn rate in rad/s over roughly the last window_ms, or
+        None with fewer than two samples.
+        """
+        if self.count < 2:
+            return None
+        b = self._index(0)
+        a = self._window_start(window_ms)
+        dt = time.ticks_diff(self.t[b], self.t[a])
+        if dt <= 0:
+            return None
+        return wrap_angle(self.theta[b] - self.theta[a]) * 1000 / dt
@@ -0,0 +1,270 @@
+"""
+Flight recorder for the VS link, and replay of what it recorded
+
+A Recorder appends every data frame the robot receives from and sends to
+the VS to a log in flash, so a run in the arena can be played back later
+through the same decoding, on the robot or on a PC, to reproduce a bug or
+profile control code against a real trace.
+
+The log is a 4 byte header (LOG_MAGIC) and then one record per frame:
+
+    I time.ticks_ms(), B flags (bit 7 sent by the robot, low 4 bits the
+    websocket opcode), H payload length, payload       (little endian)
+
+Records are copied into one of two preallocated blocks; the receive thread
+never touches the file. Once a block is full the sender writes it out in
+a single write() (see Recorder.write()) while the other block fills. If
+flash falls a whole block behind, records are dropped and counted rather
+than making anyone wait. A file that reaches max_bytes is rotated to
+path.1 (path.1 to path.2, ...) and a new one started, and starting a
+recorder rotates the last run's log out of the way too.
+
+A Player reads a log back and stands in for the websocket: recv_into()
+hands back the received frames at the pace they were recorded, or speed
+times faster, and whatever the robot sends goes nowhere.
+"""
+
+import os
+import time
+import _thread
+import ustruct as struct
+import ujson as json
+import uwebsockets as web
+
+RECORD_PATH = '/enes100_log.bin'
+RECORD_BLOCK = const(2048)
+RECORD_MAX_BYTES = const(262144)
+# The current log and this many rotated ones before it
+RECORD_FILES = const(2)
+
+LOG_MAGIC = b'ENR\x01'
+HEADER_FORMAT = '<IBH'
+HEADER_SIZE = const(7)
+SENT = const(0x80)
+OPCODE_MASK = const(0x0f)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class Recorder:
+    """
+    Logs frames to path, in blocks of block_size bytes, keeping files logs
+    of up to max_bytes each. Frames bigger than a block are dropped.
+
+    records, dropped and bytes_written count what it has done so far.
+    """
+
+    def __init__(self, path=RECORD_PATH, max_bytes=RECORD_MAX_BYTES, files=RECORD_FILES,
+                 block_size=RECORD_BLOCK):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.files = files
+        self.records = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self._lock = _thread.allocate_lock()  # around the blocks
+        self._write_lock = _thread.allocate_lock()  # around the file
+        self._blocks = (bytearray(block_size), bytearray(block_size))
+        self._fill = 0  # index of the block being filled
+        self._used = 0  # bytes in it
+        self._ready = 0  # bytes in the other block waiting for write(), 0 if none
+        self._sticky = None  # (flags, payload) written again at the start of every file
+        self._file = None
+        self._size = 0
+        self._next_file()
+
+    def _next_file(self):
+        if self._file:
+            self._file.close()
+        path = self.path
+        for i in range(self.files - 1, 0, -1):
+            older = path if i == 1 else f'{path}.{i - 1}'
+            _remove(f'{path}.{i}')
+            try:
+                os.rename(older, f'{path}.{i}')
+            except OSError:
+                pass
+        self._file = open(path, 'wb')
+        self._file.write(LOG_MAGIC)
+        self._size = len(LOG_MAGIC)
+        if self._sticky:
+            flags, payload = self._sticky
+            header = struct.pack(HEADER_FORMAT, time.ticks_ms(), flags, len(payload))
+            self._file.write(header)
+            self._file.write(payload)
+            self._size += HEADER_SIZE + len(payload)
+
+    def record(self, opcode, data, n, sent=False, sticky=False):
+        """
+        Add the frame data[:n]. A sticky one (the begin packet) is also
+        repeated at the start of every later file, so each file replays on
+        its own.
+        """
+        size = HEADER_SIZE + n
+        flags = opcode | SENT if sent else opcode
+        if sticky:
+            self._sticky = flags, bytes(data[:n])
+        with self._lock:
+            block = self._blocks[self._fill]
+            used = self._used
+            if used + size > len(block):
+                if self._ready or size > len(block):
+                    # flash is a block behind, or it would never fit
+                    self.dropped += 1
+                    return
+                self._ready = used
+                self._fill ^= 1
+                block = self._blocks[self._fill]
+                used = 0
+            struct.pack_into(HEADER_FORMAT, block, used, time.ticks_ms(), flags, n)
+            block[used + HEADER_SIZE:used + size] = memoryview(data)[:n]
+            self._used = used + size
+            self.records += 1
+
+    def write(self):
+        """Write out a full block if there is one. Called by the sender, never the receiver."""
+        with self._write_lock:
+            n = self._ready
+            if not n or not self._file:
+                return
+            if self._size + n > self.max_bytes:
+                self._next_file()
+            self._file.write(memoryview(self._blocks[self._fill ^ 1])[:n])
+            self._size += n
+            self.bytes_written += n
+            self._ready = 0
+
+    def close(self):
+        """Write out everything recorded so far and close the log."""
+        self.write()
+        with self._write_lock, self._lock:
+            if not self._file:
+                return
+            n = self._used
+            self._used = 0
+            self._file.write(memoryview(self._blocks[self._fill])[:n])
+            self.bytes_written += n
+            self._file.close()
+            self._file = None
+
+
+class Player:
+    """
+    Replays the frames received in the log at path, speed times as fast as
+    they were recorded (0 for no waiting at all). Looks enough like a
+    websocket for Enes100: frames sent to it are only counted, and pings
+    are answered straight away.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self._file = open(path, 'rb')
+        if self._file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            self._file.close()
+            raise ValueError(f'{path} is not an enes100 log')
+        self.speed = speed
+        self.open = True
+        self.on_pong = None
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.oversized = 0
+        self.lock_waits = 0
+        self.lock_wait_us = 0
+        self.lock_wait_max_us = 0
+        self.control_handoffs = 0
+        self._hdr = bytearray(HEADER_SIZE)
+        self._next = None  # (ticks, flags, length) of the next received frame, payload unread
+        self._first = None  # recorded ticks of the first frame played
+        self._start = 0  # time.ticks_ms() it was played at
+
+    def begin_packet(self):
+        """The first begin packet the robot sent in the log as a dict, or None."""
+        f = self._file
+        start = f.tell()
+        packet = None
+        while packet is None and f.readinto(self._hdr) == HEADER_SIZE:
+            _, flags, n = struct.unpack(HEADER_FORMAT, self._hdr)
+            payload = f.read(n)
+            if flags == SENT | web.OP_TEXT and b'"begin"' in payload:
+                try:
+                    packet = json.loads(payload)
+                except ValueError:
+                    pass
+                if packet is not None and packet.get('op') != 'begin':
+                    packet = None
+        f.seek(start)
+        return packet
+
+    def _peek(self):
+        while self._next is None:
+            if self._file.readinto(self._hdr) != HEADER_SIZE:
+                self.open = False
+                return None
+            ticks, flags, n = struct.unpack(HEADER_FORMAT, self._hdr)
+            if flags & SENT:
+                self._file.seek(n, 1)
+                continue
+            self._next = ticks, flags, n
+        return self._next
+
+    def _wait_ms(self, ticks):
+        if self._first is None:
+            self._first = ticks
+            self._start = time.ticks_ms()
+        if not self.speed:
+            return 0
+        due = int(time.ticks_diff(ticks, self._first) / self.speed)
+        return due - time.ticks_diff(time.ticks_ms(), self._start)
+
+    def pending(self):
+        """True if the next received frame is already due."""
+        frame = self._peek()
+        return frame is not None and self._wait_ms(frame[0]) <= 0
+
+    def recv_into(self, buf, control=False):
+        """
+        Wait until the next received frame is due and read it into buf, as
+        Websocket.recv_into(). (None, 0) at the end of the log.
+        """
+        frame = self._peek()
+        if frame is None:
+            return None, 0
+        ticks, flags, n = frame
+        wait = self._wait_ms(ticks)
+        if wait > 0:
+            time.sleep_ms(wait)
+        self._next = None
+        opcode = flags & OPCODE_MASK
+        if n > len(buf):
+            self._file.seek(n, 1)
+            self.oversized += 1
+            return opcode, 0
+        self._file.readinto(memoryview(buf)[:n])
+        self.frames_in += 1
+        self.bytes_in += n
+        return opcode, n
+
+    def send(self, buf):
+        self.frames_out += 1
+        self.bytes_out += len(web.Websocket._message(buf)[1])
+
+    def send_many(self, bufs):
+        for buf in bufs:
+            self.send(buf)
+
+    def ping(self, data=b''):
+        if self.on_pong:
+            self.on_pong(data)
+
+    def settimeout(self, timeout):
+        pass
+
+    def close(self, code=web.CLOSE_OK, reason=''):
+        self.open = False
+        self._file.close()
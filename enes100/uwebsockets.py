@@ -3,11 +3,12 @@ Websockets protocol
 """
 
 # import logging
-import ure as re
 import ustruct as struct
 import urandom as random
 import usocket as socket
-from ucollections import namedtuple
+import uselect as select
+import time
+import _thread
 
 # LOGGER = logging.getLogger(__name__)
 
@@ -30,8 +31,60 @@ CLOSE_TOO_BIG = const(1009)
 CLOSE_MISSING_EXTN = const(1010)
 CLOSE_BAD_CONDITION = const(1011)
 
-URL_RE = re.compile(r'(wss|ws)://([A-Za-z0-9-\.]+)(?:\:([0-9]+))?(/.+)?')
-URI = namedtuple('URI', ('protocol', 'hostname', 'port', 'path'))
+# Scratch buffer sizes for the zero-copy frame paths
+RX_BUF_SIZE = const(512)
+TX_BUF_SIZE = const(256)
+
+# Longest frame header: 2 bytes, an 8 byte length and a 4 byte mask key
+MAX_HEADER_SIZE = const(14)
+
+# Longest control frame payload allowed by RFC 6455. Control frames are read
+# into a buffer this size, which is also what oversized payloads are
+# discarded through
+CONTROL_MAX = const(125)
+
+# ure and namedtuple are only loaded (and URL_RE compiled) by the first urlparse(),
+# uasyncio by connect_async(), and ssl and ubinascii by connect()
+URL_RE = None
+URI = None
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _mask_into(buf, length: int, key):
+        """XOR buf[:length] in place with the 4-byte key, a word at a time."""
+        p = ptr8(buf)
+        k = ptr8(key)
+        i = 0
+        # Head: byte-wise until the pointer is word aligned
+        while i < length and ((int(p) + i) & 3):
+            p[i] ^= k[i & 3]
+            i += 1
+        # Body: one 32-bit XOR per word with the key rotated to this offset
+        w = (k[i & 3] | (k[(i + 1) & 3] << 8) |
+             (k[(i + 2) & 3] << 16) | (k[(i + 3) & 3] << 24))
+        pw = ptr32(int(p) + i)
+        words = (length - i) >> 2
+        j = 0
+        while j < words:
+            pw[j] ^= w
+            j += 1
+        i += words << 2
+        # Tail
+        while i < length:
+            p[i] ^= k[i & 3]
+            i += 1
+except (ImportError, AttributeError):
+    # no viper on this port (or the host micropython stand-in)
+    def _mask_into(buf, length, key):
+        """XOR buf[:length] in place with the 4-byte key."""
+        if length:
+            key = key * ((length >> 2) + 1)
+            buf[:length] = (int.from_bytes(buf[:length], 'big') ^
+                            int.from_bytes(key[:length], 'big')
+                            ).to_bytes(length, 'big')
+
 
 class NoDataException(Exception):
     pass
@@ -41,6 +94,12 @@ class ConnectionClosed(Exception):
 
 def urlparse(uri):
     """Parse ws:// URLs"""
+    global URL_RE, URI
+    if URL_RE is None:
+        import ure as re
+        from ucollections import namedtuple
+        URL_RE = re.compile(r'(wss|ws)://([A-Za-z0-9-\.]+)(?:\:([0-9]+))?(/.+)?')
+        URI = namedtuple('URI', ('protocol', 'hostname', 'port', 'path'))
     match = URL_RE.match(uri)
     if match:
         protocol = match.group(1)
@@ -66,12 +125,49 @@ class Websocket:
 
     This can probably be replaced with the C-based websocket module, but
     this one currently supports more options.
+
+    Any thread may send. Every frame is written whole under one lock, so
+    frames from different threads never interleave on the wire. A control
+    frame the receive side has to answer with (a pong) never waits for it:
+    if another thread is mid-write, it's handed to that one to write next,
+    ahead of any data frame still waiting for the lock.
     """
     is_client = False
 
     def __init__(self, sock):
         self.sock = sock
         self.open = True
+        # Called with the payload of every pong frame received
+        self.on_pong = None
+        # Wire counters, headers included
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.oversized = 0  # frames dropped for being too big
+        # Longest message recv() takes, and read_frame()'s default limit.
+        # Set it before the first recv(), which allocates a buffer this size
+        self.max_size = RX_BUF_SIZE
+        # Preallocated header, mask key and frame buffers. The read and
+        # write sides get their own so a receive loop never clobbers a send.
+        self._rx_hdr = bytearray(8)
+        self._rx_mask = bytearray(4)
+        self._tx_mask = bytearray(4)
+        self._rx = None  # allocated by the first recv_into() without a buffer
+        self._ctl = bytearray(CONTROL_MAX)
+        # Outgoing frames are assembled here whole, header and all
+        self._tx = bytearray(TX_BUF_SIZE)
+        self._tx_mv = memoryview(self._tx)
+        # Held while a frame is packed into _tx and written out
+        self._tx_lock = _thread.allocate_lock()
+        self._control = None  # (opcode, payload) handed over by _send_control()
+        # How often a send had to wait for another thread's, for how long
+        # in total and at most, and how many control frames were handed over
+        self.lock_waits = 0
+        self.lock_wait_us = 0
+        self.lock_wait_max_us = 0
+        self.control_handoffs = 0
+        self._poll = None  # set up by the first pending()
 
     def __enter__(self):
         return self
@@ -82,19 +178,62 @@ class Websocket:
     def settimeout(self, timeout):
         self.sock.settimeout(timeout)
 
-    def read_frame(self, max_size=None):
+    def pending(self):
+        """True if more data is already waiting to be read."""
+        if self._poll is None:
+            poll = select.poll()
+            poll.register(self.sock, select.POLLIN)
+            # ipoll doesn't build a result list; CPython only has poll
+            self._poll = getattr(poll, 'ipoll', poll.poll)
+        for _ in self._poll(0):
+            return True
+        return False
+
+    def _read_exact(self, buf, n):
+        """Fill buf[:n] from the socket, raising ValueError on a short read."""
+        if self.sock.readinto(buf, n) != n:
+            raise ValueError('short read')
+
+    def _read_payload(self, buf, pos, length, mask):
+        """Read a payload into buf[pos:pos + length] and unmask it."""
+        if length:
+            if pos:
+                buf = memoryview(buf)[pos:pos + length]
+            self._read_exact(buf, length)
+            if mask:
+                _mask_into(buf, length, self._rx_mask)
+
+    def _discard(self, length):
+        """Read a payload and throw it away, a control buffer at a time."""
+        chunk = self._ctl
+        while length > 0:
+            n = min(length, CONTROL_MAX)
+            self._read_exact(chunk, n)
+            length -= n
+
+    def _bad_control(self, fin, opcode, length):
         """
-        Read a frame from the socket.
-        See https://tools.ietf.org/html/rfc6455#section-5.2 for the details.
+        True (after closing the websocket) for a control frame that is
+        fragmented or too long, which RFC 6455 doesn't allow.
         """
+        if opcode & 0x8 and (length > CONTROL_MAX or not fin):
+            self.close(code=CLOSE_PROTOCOL_ERROR)
+            return True
+        return False
 
-        # Frame header
-        two_bytes = self.sock.read(2)
+    def _read_header(self):
+        """
+        Read a frame header into the preallocated buffers.
+        Returns (fin, opcode, length, mask); the mask key is left in
+        self._rx_mask.
+        """
+        hdr = self._rx_hdr
 
-        if not two_bytes:
+        if not self.sock.readinto(hdr, 2):
             raise NoDataException
 
-        byte1, byte2 = struct.unpack('!BB', two_bytes)
+        byte1 = hdr[0]
+        byte2 = hdr[1]
 
         # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
         fin = bool(byte1 & 0x80)
@@ -104,36 +243,82 @@ class Websocket:
         mask = bool(byte2 & (1 << 7))
         length = byte2 & 0x7f
 
+        n = 2
         if length == 126:  # Magic number, length header is 2 bytes
-            length, = struct.unpack('!H', self.sock.read(2))
+            self._read_exact(hdr, 2)
+            length = (hdr[0] << 8) | hdr[1]
+            n = 4
         elif length == 127:  # Magic number, length header is 8 bytes
-            length, = struct.unpack('!Q', self.sock.read(8))
+            self._read_exact(hdr, 8)
+            length, = struct.unpack('!Q', hdr)
+            n = 10
 
         if mask:  # Mask is 4 bytes
-            mask_bits = self.sock.read(4)
+            self._read_exact(self._rx_mask, 4)
+            n += 4
 
-        try:
-            data = self.sock.read(length)
-        except MemoryError:
-            # We can't receive this many bytes, close the socket
-            # if __debug__: LOGGER.debug("Frame of length %s too big. Closing" length)
-            self.close(code=CLOSE_TOO_BIG)
+        self.frames_in += 1
+        self.bytes_in += n + length
+
+        return fin, opcode, length, mask
+
+    def read_frame(self, max_size=None):
+        """
+        Read a frame from the socket.
+        See https://tools.ietf.org/html/rfc6455#section-5.2 for the details.
+
+        A payload longer than max_size (self.max_size by default) is
+        discarded without being allocated, and comes back as None.
+        """
+        fin, opcode, length, mask = self._read_header()
+
+        if self._bad_control(fin, opcode, length):
             return True, OP_CLOSE, None
+        if length > (self.max_size if max_size is None else max_size):
+            self._discard(length)
+            self.oversized += 1
+            return fin, opcode, None
+
+        data = self.sock.read(length)
+        if len(data) != length:
+            raise ValueError('short read')
 
         if mask:
-            data = bytes(b ^ mask_bits[i % 4]
-                         for i, b in enumerate(data))
+            data = bytearray(data)
+            _mask_into(data, length, self._rx_mask)
+            data = bytes(data)
 
         return fin, opcode, data
 
-    def write_frame(self, opcode, data=b''):
+    def read_frame_into(self, buf, pos=0):
         """
-        Write a frame to the socket.
-        See https://tools.ietf.org/html/rfc6455#section-5.2 for the details.
+        Read a frame without allocating: a data frame's payload into
+        buf[pos:], a control frame's into self._ctl.
+        Returns (fin, opcode, length). A data payload that doesn't fit in
+        buf is discarded and length is -1.
         """
-        fin = True
-        mask = self.is_client  # messages sent by client are masked
+        fin, opcode, length, mask = self._read_header()
+
+        if opcode & 0x8:
+            if self._bad_control(fin, opcode, length):
+                return True, OP_CLOSE, 0
+            self._read_payload(self._ctl, 0, length, mask)
+        elif pos + length > len(buf):
+            self._discard(length)
+            self.oversized += 1
+            return fin, opcode, -1
+        else:
+            self._read_payload(buf, pos, length, mask)
 
+        return fin, opcode, length
+
+    def _pack_frame(self, buf, pos, opcode, data, fin=True):
+        """
+        Pack a whole frame (header, mask key for client frames, masked
+        payload) into buf at pos. buf must have room for the payload plus
+        MAX_HEADER_SIZE. Returns the offset just past the frame.
+        """
+        mask = self.is_client  # messages sent by client are masked
         length = len(data)
 
         # Frame header
@@ -146,27 +331,128 @@ class Websocket:
 
         if length < 126:  # 126 is magic value to use 2-byte length header
             byte2 |= length
-            self.sock.write(struct.pack('!BB', byte1, byte2))
+            struct.pack_into('!BB', buf, pos, byte1, byte2)
+            n = 2
 
         elif length < (1 << 16):  # Length fits in 2-bytes
             byte2 |= 126  # Magic code
-            self.sock.write(struct.pack('!BBH', byte1, byte2, length))
+            struct.pack_into('!BBH', buf, pos, byte1, byte2, length)
+            n = 4
 
         elif length < (1 << 64):
             byte2 |= 127  # Magic code
-            self.sock.write(struct.pack('!BBQ', byte1, byte2, length))
+            struct.pack_into('!BBQ', buf, pos, byte1, byte2, length)
+            n = 10
 
         else:
             raise ValueError()
 
         if mask:  # Mask is 4 bytes
-            mask_bits = struct.pack('!I', random.getrandbits(32))
-            self.sock.write(mask_bits)
+            key = self._tx_mask
+            for i in range(4):
+                key[i] = random.getrandbits(8)
+                buf[pos + n + i] = key[i]
+            n += 4
+
+        self.frames_out += 1
+        self.bytes_out += n + length
+
+        pos += n
+        end = pos + length
+        buf[pos:end] = data
+        if mask:
+            _mask_into(buf[pos:end], length, self._tx_mask)
+        return end
+
+    def _tx_buffer(self, size):
+        """The reusable frame buffer, grown to at least size bytes."""
+        if size > len(self._tx):
+            self._tx = bytearray(size)
+            self._tx_mv = memoryview(self._tx)
+        return self._tx_mv
+
+    def _write_tx(self, n):
+        """Write the first n bytes of the frame buffer in one call."""
+        self.sock.write(self._tx_mv, n)
+
+    def _lock_tx(self):
+        """
+        Take the writer lock, timing the wait if another thread has it, and
+        write any control frame that was handed over first.
+        """
+        lock = self._tx_lock
+        if not lock.acquire(0):
+            start = time.ticks_us()
+            lock.acquire()
+            waited = time.ticks_diff(time.ticks_us(), start)
+            self.lock_waits += 1
+            self.lock_wait_us += waited
+            if waited > self.lock_wait_max_us:
+                self.lock_wait_max_us = waited
+        if self._control:
+            try:
+                self._write_control()
+            except Exception:
+                lock.release()
+                raise
+
+    def _unlock_tx(self):
+        """Release the writer lock, writing any control frame handed over meanwhile."""
+        lock = self._tx_lock
+        while True:
+            try:
+                if self._control:
+                    self._write_control()
+            finally:
+                lock.release()
+            # one handed over after the check above would otherwise wait
+            # for the next send
+            if not self._control or not lock.acquire(0):
+                return
+
+    def _write_control(self):
+        control = self._control
+        opcode, data = control
+        n = self._pack_frame(self._tx_buffer(len(data) + MAX_HEADER_SIZE), 0, opcode, data)
+        if self._control is control:
+            self._control = None
+        self._write_tx(n)
 
-            data = bytes(b ^ mask_bits[i % 4]
-                         for i, b in enumerate(data))
+    def _send_control(self, opcode, data):
+        """
+        Write a control frame without waiting for the writer lock. If
+        another thread is mid-write, hand the frame to it instead (a newer
+        one replaces one it hasn't sent yet).
+        """
+        if not self._tx_lock.acquire(0):
+            self._control = opcode, bytes(data)
+            if not self._tx_lock.acquire(0):
+                # still busy, it'll be sent before the lock is let go
+                self.control_handoffs += 1
+                return
+            data = None
+        try:
+            if data is not None:
+                buf = self._tx_buffer(len(data) + MAX_HEADER_SIZE)
+                self._write_tx(self._pack_frame(buf, 0, opcode, data))
+        finally:
+            self._unlock_tx()
 
-        self.sock.write(data)
+    def write_frame(self, opcode, data=b''):
+        """
+        Write a frame to the socket.
+        See https://tools.ietf.org/html/rfc6455#section-5.2 for the details.
+
+        The frame goes out in a single write, so a small message is a
+        single TCP segment rather than a header segment followed by a
+        payload one.
+        """
+        self._lock_tx()
+        try:
+            buf = self._tx_buffer(len(data) + MAX_HEADER_SIZE)
+            self._write_tx(self._pack_frame(buf, 0, opcode, data))
+        finally:
+            self._unlock_tx()
 
     def recv(self):
         """
@@ -176,59 +462,141 @@ class Websocket:
         fire off a routine to process frames and put the data in a queue.
         If you don't call recv() sufficiently often you won't process control
         frames.
+
+        Messages are received into a max_size buffer allocated on first use
+        (see recv_into()) and copied out; longer ones are dropped.
+        """
+        opcode, length = self.recv_into()
+        if opcode == OP_TEXT:
+            return str(memoryview(self._rx)[:length], 'utf-8')
+        elif opcode == OP_BYTES:
+            return bytes(self._rx[:length])
+        elif opcode is None:
+            return ''
+
+    def recv_into(self, buf=None, control=False):
+        """
+        Receive a message into buf (the websocket's own max_size receive
+        buffer by default) without allocating.
+
+        Returns (opcode, length) with the payload in buf[:length],
+        (None, 0) when there is no data and (OP_CLOSE, 0) once closed.
+        A fragmented message is put back together in buf; one that doesn't
+        fit is read through and dropped (counted in oversized), never
+        allocated. Control frames are handled the same way as in recv();
+        with control set, (opcode, 0) is returned after handling one
+        instead of waiting on for a data frame, unless it came in the
+        middle of a fragmented message.
         """
         assert self.open
 
+        if buf is None:
+            if self._rx is None:
+                self._rx = bytearray(self.max_size)
+            buf = self._rx
+
+        kind = 0  # opcode of the fragmented message being put together
+        pos = 0
+        dropped = False
         while self.open:
             try:
-                fin, opcode, data = self.read_frame()
+                fin, opcode, length = self.read_frame_into(buf, pos)
             except NoDataException:
-                return ''
+                return None, 0
             except ValueError:
-                # LOGGER.debug("Failed to read frame. Socket dead.")
                 self._close()
                 raise ConnectionClosed()
 
-            if not fin:
-                raise NotImplementedError()
-
-            if opcode == OP_TEXT:
-                return data.decode('utf-8')
-            elif opcode == OP_BYTES:
-                return data
+            if opcode == OP_TEXT or opcode == OP_BYTES or opcode == OP_CONT:
+                if (opcode == OP_CONT) != bool(kind):
+                    # a continuation of nothing, or a new message before the last one ended
+                    self.close(code=CLOSE_PROTOCOL_ERROR)
+                    raise ConnectionClosed()
+                if length < 0:
+                    dropped = True
+                    # anything more of this message is discarded without reading it in
+                    pos = len(buf)
+                elif not dropped:
+                    pos += length
+                if not fin:
+                    kind = kind or opcode
+                    continue
+                if not dropped:
+                    return kind or opcode, pos
+                kind = 0
+                pos = 0
+                dropped = False
+                continue
             elif opcode == OP_CLOSE:
                 self._close()
-                return
+                return OP_CLOSE, 0
             elif opcode == OP_PONG:
-                # Ignore this frame, keep waiting for a data frame
+                if self.on_pong:
+                    self.on_pong(memoryview(self._ctl)[:length])
+                if control and not kind:
+                    return opcode, 0
                 continue
             elif opcode == OP_PING:
-                # We need to send a pong frame
-                # if __debug__: LOGGER.debug("Sending PONG")
-                self.write_frame(OP_PONG, data)
-                # And then wait to receive
+                self._send_control(OP_PONG, memoryview(self._ctl)[:length])
+                if control and not kind:
+                    return opcode, 0
                 continue
-            elif opcode == OP_CONT:
-                # This is a continuation of a previous frame
-                raise NotImplementedError(opcode)
             else:
-                raise ValueError(opcode)
+                # a reserved opcode, nothing more on this connection can be trusted
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                raise ConnectionClosed()
+
+        return OP_CLOSE, 0
+
+    @staticmethod
+    def _message(buf):
+        """
+        (opcode, payload) for a str (text) or bytes-like (binary) message.
+        An (opcode, payload) pair passes through, e.g. to send text that is
+        already utf-8 encoded.
+        """
+        if isinstance(buf, str):
+            return OP_TEXT, buf.encode('utf-8')
+        elif isinstance(buf, (bytes, bytearray, memoryview)):
+            return OP_BYTES, buf
+        elif isinstance(buf, tuple):
+            return buf
+        raise TypeError()
 
     def send(self, buf):
         """Send data to the websocket."""
 
         assert self.open
 
-        if isinstance(buf, str):
-            opcode = OP_TEXT
-            buf = buf.encode('utf-8')
-        elif isinstance(buf, bytes):
-            opcode = OP_BYTES
-        else:
-            raise TypeError()
-
+        opcode, buf = self._message(buf)
         self.write_frame(opcode, buf)
 
+    def send_many(self, bufs):
+        """
+        Send several messages, one frame each, packed into a single write.
+        Each message is a str, bytes-like or (opcode, payload), as for send().
+        """
+        assert self.open
+
+        messages = [self._message(buf) for buf in bufs]
+        size = 0
+        for opcode, data in messages:
+            size += len(data) + MAX_HEADER_SIZE
+        self._lock_tx()
+        try:
+            buf = self._tx_buffer(size)
+            n = 0
+            for opcode, data in messages:
+                n = self._pack_frame(buf, n, opcode, data)
+            self._write_tx(n)
+        finally:
+            self._unlock_tx()
+
+    def ping(self, data=b''):
+        """Send a ping; the peer answers with a pong carrying the same data."""
+        assert self.open
+        self.write_frame(OP_PING, data)
+
     def close(self, code=CLOSE_OK, reason=''):
         """Close the websocket."""
         if not self.open:
@@ -236,14 +604,118 @@ class Websocket:
 
         buf = struct.pack('!H', code) + reason.encode('utf-8')
 
-        self.write_frame(OP_CLOSE, buf)
-        self._close()
+        try:
+            self.write_frame(OP_CLOSE, buf)
+        finally:
+            # Release the socket even if the close frame can't be sent
+            self._close()
 
     def _close(self):
         # if __debug__: LOGGER.debug("Connection closed")
         self.open = False
         self.sock.close()
 
+class FrameParser:
+    """
+    Incremental frame decoder for non-blocking sockets.
+
+    Bytes are read straight into a preallocated buffer with space()/feed()
+    and complete frames are handed back by next_frame() as views into it,
+    so a partial frame never blocks the caller. A frame too big for the
+    buffer is dropped as its bytes arrive, a buffer at a time.
+    """
+
+    def __init__(self, size=RX_BUF_SIZE):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.skip = 0  # bytes of a dropped payload still to come
+        # mask key of the frame being unmasked, copied out so _mask_into gets a bytearray
+        self.key = bytearray(4)
+
+    def space(self):
+        """Return a view of the free tail of the buffer, compacting first."""
+        if self.start:
+            n = self.end - self.start
+            if n:
+                self.mv[:n] = self.mv[self.start:self.end]
+            self.start = 0
+            self.end = n
+        return self.mv[self.end:]
+
+    def feed(self, n):
+        """Account for n bytes written into the last space() view."""
+        self.end += n
+
+    def pending(self):
+        """True if any bytes of a further frame are buffered."""
+        return self.end > self.start
+
+    def _skip(self):
+        n = min(self.skip, self.end - self.start)
+        self.start += n
+        self.skip -= n
+
+    def next_frame(self):
+        """
+        Decode the next buffered frame.
+        Returns (fin, opcode, payload) or None if the frame is incomplete.
+        The payload view is only valid until the next call to space().
+        A frame that can never fit in the buffer is returned as soon as its
+        header is in, with payload None; the payload is skipped over as it
+        arrives.
+        """
+        if self.skip:
+            self._skip()
+            if self.skip:
+                return None
+
+        buf = self.buf
+        i = self.start
+        avail = self.end - i
+        if avail < 2:
+            return None
+
+        byte1 = buf[i]
+        byte2 = buf[i + 1]
+        length = byte2 & 0x7f
+        n = 2
+
+        if length == 126:  # Magic number, length header is 2 bytes
+            n = 4
+            if avail < n:
+                return None
+            length = (buf[i + 2] << 8) | buf[i + 3]
+        elif length == 127:  # Magic number, length header is 8 bytes
+            n = 10
+            if avail < n:
+                return None
+            length, = struct.unpack_from('!Q', buf, i + 2)
+
+        mask = byte2 & 0x80
+        if mask:  # Mask is 4 bytes
+            n += 4
+
+        if avail < n:
+            return None
+        if n + length > len(buf):
+            self.start = i + n
+            self.skip = length
+            self._skip()
+            return bool(byte1 & 0x80), byte1 & 0x0f, None
+        if avail < n + length:
+            return None
+
+        payload = self.mv[i + n:i + n + length]
+        if mask:
+            key = self.key
+            key[:] = self.mv[i + n - 4:i + n]
+            _mask_into(payload, length, key)
+        self.start = i + n + length
+
+        return bool(byte1 & 0x80), byte1 & 0x0f, payload
+
 """
 Websockets client for micropython
 
@@ -252,10 +724,11 @@ https://github.com/aaugustin/websockets/blob/master/websockets/client.py
 """
 
 # import logging
+import time
 import usocket as socket
-import ubinascii as binascii
 import urandom as random
-import ssl
+
+asyncio = None  # imported by connect_async()
 
 # LOGGER = logging.getLogger(__name__)
 
@@ -263,52 +736,328 @@ import ssl
 class WebsocketClient(Websocket):
     is_client = True
 
-def connect(uri):
+
+class AsyncWebsocket(WebsocketClient):
     """
-    Connect a websocket.
+    Client websocket driven by uasyncio streams.
+
+    Incoming bytes go through a FrameParser, so a task awaiting recv() only
+    ever waits on the socket and never blocks the event loop. send() writes
+    the whole frame to the stream and drains it in the background; use
+    send_async() to wait for the write to finish.
     """
 
-    uri = urlparse(uri)
-    assert uri
+    def __init__(self, reader, writer, rx_size=RX_BUF_SIZE):
+        super().__init__(writer)
+        self.reader = reader
+        self.parser = FrameParser(rx_size)
+        self.max_size = rx_size
+        # fragmented messages are put together here, allocated by the first one
+        self._msg = None
+        self._draining = False
+        self._wlock = asyncio.Lock()
+
+    def _write_tx(self, n):
+        # The stream may hold on to the frame until drained, so it gets
+        # a copy rather than the reusable buffer
+        self.sock.write(bytes(self._tx_mv[:n]))
+        if not self._draining:
+            self._draining = True
+            asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        try:
+            await self.drain()
+        except OSError:
+            # Nobody is waiting on this task; the reader will see the
+            # broken connection and handle it
+            pass
+        finally:
+            self._draining = False
+
+    async def drain(self):
+        """Wait until everything written so far has gone to the socket."""
+        # Only one task may wait on the stream for writing at a time
+        async with self._wlock:
+            await self.sock.drain()
+
+    async def send_async(self, buf):
+        """Send data to the websocket and wait for it to be written."""
+        self.send(buf)
+        await self.drain()
+
+    async def close_async(self, code=CLOSE_OK, reason=''):
+        """Close the websocket and wait for the socket to be released."""
+        self.close(code, reason)
+        try:
+            await self.drain()
+            await self.sock.wait_closed()
+        except OSError:
+            # The peer is already gone, nothing left to flush
+            pass
 
-    # if __debug__: LOGGER.debug("open connection %s:%s", uri.hostname, uri.port)
+    async def recv_frame(self):
+        """
+        Wait for the next complete frame.
+        Returns (fin, opcode, payload); see FrameParser.next_frame. The
+        payload of a frame too big for the parser buffer is None.
+        """
+        parser = self.parser
+        while True:
+            frame = parser.next_frame()
+            if frame:
+                self.frames_in += 1
+                if frame[2] is None:
+                    self.oversized += 1
+                return frame
+
+            n = await self.reader.readinto(parser.space())
+            if n is None:
+                continue
+            if not n:
+                self._close()
+                raise ConnectionClosed()
+            parser.feed(n)
+            self.bytes_in += n
 
-    sock = socket.socket()
-    addr = socket.getaddrinfo(uri.hostname, uri.port)
-    sock.connect(addr[0][4])
-    if uri.protocol == 'wss':
-        sock = ssl.wrap_socket(sock, server_hostname=uri.hostname)
+    def pending(self):
+        """True if more data is already buffered."""
+        return self.parser.pending()
 
-    def send_header(header, *args):
-        # if __debug__: LOGGER.debug(str(header), *args)
-        sock.write(header % args + '\r\n')
+    async def recv_view(self, control=False):
+        """
+        Receive the next message without copying it.
+
+        Returns (opcode, payload) where payload is a view into the parser
+        buffer, valid until the next receive, or (OP_CLOSE, None) once the
+        websocket is closed. A fragmented message is copied together into a
+        second buffer the size of the parser's, allocated the first time
+        one arrives, and the view is into that. Messages too big for either
+        are dropped (counted in oversized). Control frames are handled as
+        in Websocket.recv(); with control set, (opcode, None) is returned
+        after handling one instead of waiting on for a data frame, unless it
+        came in the middle of a fragmented message.
+        """
+        assert self.open
 
+        kind = 0  # opcode of the fragmented message being put together
+        pos = 0
+        dropped = False
+        while self.open:
+            fin, opcode, data = await self.recv_frame()
+
+            if opcode & 0x8 and (data is None or len(data) > CONTROL_MAX or not fin):
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                break
+
+            if opcode == OP_TEXT or opcode == OP_BYTES or opcode == OP_CONT:
+                if (opcode == OP_CONT) != bool(kind):
+                    # a continuation of nothing, or a new message before the last one ended
+                    self.close(code=CLOSE_PROTOCOL_ERROR)
+                    raise ConnectionClosed()
+                if fin and not kind:
+                    if data is None:
+                        continue
+                    return opcode, data
+                kind = kind or opcode
+                if data is None or pos + len(data) > self.max_size:
+                    if not dropped and data is not None:
+                        self.oversized += 1
+                    dropped = True
+                elif not dropped:
+                    if self._msg is None:
+                        self._msg = memoryview(bytearray(self.max_size))
+                    self._msg[pos:pos + len(data)] = data
+                    pos += len(data)
+                if not fin:
+                    continue
+                if not dropped:
+                    return kind, self._msg[:pos]
+                kind = 0
+                pos = 0
+                dropped = False
+                continue
+            elif opcode == OP_CLOSE:
+                self._close()
+                break
+            elif opcode == OP_PONG:
+                if self.on_pong:
+                    self.on_pong(data)
+                if control and not kind:
+                    return opcode, None
+                continue
+            elif opcode == OP_PING:
+                self._send_control(OP_PONG, data)
+                if control and not kind:
+                    return opcode, None
+                continue
+            else:
+                # a reserved opcode, nothing more on this connection can be trusted
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                raise ConnectionClosed()
+
+        return OP_CLOSE, None
+
+    async def recv(self):
+        """
+        Receive data from the websocket.
+
+        Returns None once the websocket is closed.
+        """
+        opcode, data = await self.recv_view()
+        if opcode == OP_TEXT:
+            return str(data, 'utf-8')
+        elif opcode == OP_BYTES:
+            return bytes(data)
+
+
+def _handshake_request(uri):
+    """Build the HTTP upgrade request for a parsed ws:// URI."""
+    import ubinascii as binascii
     # Sec-WebSocket-Key is 16 bytes of random base64 encoded
     key = binascii.b2a_base64(bytes(random.getrandbits(8)
                                     for _ in range(16)))[:-1]
 
-    send_header(b'GET %s HTTP/1.1', uri.path or '/')
-    send_header(b'Host: %s:%s', uri.hostname, uri.port)
-    send_header(b'Connection: Upgrade')
-    send_header(b'Upgrade: websocket')
-    send_header(b'Sec-WebSocket-Key: %s', key)
-    send_header(b'Sec-WebSocket-Version: 13')
-    send_header(b'Origin: http://{hostname}:{port}'.format(
+    return ('GET {path} HTTP/1.1\r\n'
+            'Host: {hostname}:{port}\r\n'
+            'Connection: Upgrade\r\n'
+            'Upgrade: websocket\r\n'
+            'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            'Origin: http://{hostname}:{port}\r\n'
+            '\r\n').format(
+        path=uri.path or '/',
         hostname=uri.hostname,
-        port=uri.port)
-    )
-    send_header(b'')
+        port=uri.port,
+        key=key.decode()).encode()
 
-    header = sock.readline()[:-2]
-    assert header.startswith(b'HTTP/1.1 101 '), header
 
-    # We don't (currently) need these headers
-    # FIXME: should we check the return key?
-    while header:
-        # if __debug__: LOGGER.debug(str(header))
-        header = sock.readline()[:-2]
+def _set_nodelay(sock):
+    """
+    Turn off Nagle's algorithm. Frames are already written whole, so
+    holding a small one back to coalesce it only adds latency (and a
+    delayed-ACK stall) to every send.
+    """
+    nodelay = getattr(socket, 'TCP_NODELAY', None)
+    if nodelay is not None:
+        sock.setsockopt(getattr(socket, 'IPPROTO_TCP', 6), nodelay, 1)
+
+
+def _is_ip(host):
+    """True for a dotted-quad IPv4 literal, which needs no DNS lookup."""
+    parts = host.split('.')
+    if len(parts) != 4:
+        return False
+    for part in parts:
+        if not part.isdigit() or int(part) > 255:
+            return False
+    return True
+
+
+def _address(uri):
+    if _is_ip(uri.hostname):
+        return (uri.hostname, uri.port)
+    return socket.getaddrinfo(uri.hostname, uri.port)[0][4]
+
+
+def _time_left(sock, deadline):
+    """Give the next blocking operation on sock what is left until deadline (ticks_ms), if any."""
+    if deadline is None:
+        return
+    left = time.ticks_diff(deadline, time.ticks_ms())
+    if left <= 0:
+        raise OSError('connect timed out')
+    sock.settimeout(left / 1000)
 
+
+def connect(uri, timeout_ms=None, timing=None):
+    """
+    Connect a websocket.
+
+    With timeout_ms, the connect and upgrade together must finish within
+    it: each socket operation gets whatever is left. If timing is a dict,
+    tcp_ms and upgrade_ms are set to how long opening the connection and
+    the HTTP upgrade took.
+    """
+
+    uri = urlparse(uri)
+    assert uri
+
+    # if __debug__: LOGGER.debug("open connection %s:%s", uri.hostname, uri.port)
+
+    start = time.ticks_ms()
+    deadline = time.ticks_add(start, timeout_ms) if timeout_ms is not None else None
+    # timeouts go on the plain socket, which an ssl one reads and writes through
+    sock = raw = socket.socket()
+    try:
+        _time_left(raw, deadline)
+        sock.connect(_address(uri))
+        _set_nodelay(sock)
+        if uri.protocol == 'wss':
+            import ssl
+            sock = ssl.wrap_socket(sock, server_hostname=uri.hostname)
+        opened = time.ticks_ms()
+
+        _time_left(raw, deadline)
+        sock.write(_handshake_request(uri))
+
+        _time_left(raw, deadline)
+        header = sock.readline()[:-2]
+        assert header.startswith(b'HTTP/1.1 101 '), header
+
+        # We don't (currently) need these headers
+        # FIXME: should we check the return key?
+        while header:
+            # if __debug__: LOGGER.debug(str(header))
+            _time_left(raw, deadline)
+            header = sock.readline()[:-2]
+    except Exception:
+        sock.close()
+        raise
+
+    if timing is not None:
+        timing['tcp_ms'] = time.ticks_diff(opened, start)
+        timing['upgrade_ms'] = time.ticks_diff(time.ticks_ms(), opened)
     return WebsocketClient(sock)
 
 
+async def connect_async(uri, timing=None, rx_size=RX_BUF_SIZE):
+    """
+    Connect a websocket over uasyncio streams. Bound it with
+    asyncio.wait_for_ms(); timing is filled in as for connect(). rx_size
+    is the receive buffer, which limits the largest frame.
+    """
 
+    global asyncio
+    import uasyncio as asyncio
+
+    uri = urlparse(uri)
+    assert uri
+    if uri.protocol == 'wss':
+        raise ValueError('wss is not supported in async mode')
+
+    start = time.ticks_ms()
+    reader, writer = await asyncio.open_connection(uri.hostname, uri.port)
+    # uasyncio streams keep the socket in .s; CPython's asyncio already
+    # turns Nagle off for TCP
+    if hasattr(writer, 's'):
+        _set_nodelay(writer.s)
+    opened = time.ticks_ms()
+
+    try:
+        writer.write(_handshake_request(uri))
+        await writer.drain()
+
+        header = (await reader.readline())[:-2]
+        assert header.startswith(b'HTTP/1.1 101 '), header
+
+        while header:
+            header = (await reader.readline())[:-2]
+    except Exception:
+        writer.close()
+        raise
+
+    if timing is not None:
+        timing['tcp_ms'] = time.ticks_diff(opened, start)
+        timing['upgrade_ms'] = time.ticks_diff(time.ticks_ms(), opened)
+    return AsyncWebsocket(reader, writer, rx_size)
@@ -0,0 +1,337 @@
+"""
+Vision System protocol helpers
+
+Fast-path decoding of the VS "aruco" frames. Every pose update has the shape
+
+    {"op": "aruco", "aruco": {"visible": true, "x": 1.2, "y": 0.5, "theta": -1.5}}
+
+and arrives many times a second, so instead of building a str, two dicts and
+their keys with ujson for each one, scan_aruco() reads the fields straight
+out of the received bytes into a preallocated array. Anything it doesn't
+recognise (other ops, exponents, nulls, ...) is left to ujson.
+
+Also the reference codec for the binary wire format. A robot opts in by
+adding "binary": BINARY_VERSION to its begin packet; a VS that speaks it
+answers with an ACK record and from then on both sides may send binary
+frames (OP_BYTES), each one record (but see below for poses):
+
+    ACK      B type, B version
+    POSE     B type, B flags (bit 0 visible), H marker id,
+             h x mm, h y mm, h theta mrad          (little endian, 10 bytes)
+    MISSION  B type, B mission type, B value kind, value
+             (i int32, f float32, or utf-8 text)
+    PRINT    B type, utf-8 text
+
+A pose frame may carry more than one POSE record, back to back: the
+team's own marker first, then any other markers it subscribed to with
+"markers": [ids] in its begin packet. A JSON VS sends those as a separate
+{"op": "markers", "markers": [{"id", "visible", "x", "y", "theta"}, ...]}
+frame instead.
+
+The team name is implied by the connection. A VS that doesn't know the
+format ignores the key, never sends the ACK, and everything stays JSON.
+Record types are all below 0x20, so a frame is never mistaken for JSON
+text, which starts with "{".
+"""
+
+import ustruct as struct
+from array import array
+
+# Field bits in scan[SCAN_BITS]
+BIT_VISIBLE = const(1)
+BIT_X = const(2)
+BIT_Y = const(4)
+BIT_THETA = const(8)
+
+# Layout of the scan array: bits, visible, then (mantissa, decimals) pairs
+SCAN_BITS = const(0)
+SCAN_VISIBLE = const(1)
+SCAN_X = const(2)
+SCAN_Y = const(4)
+SCAN_THETA = const(6)
+SCAN_LEN = const(8)
+
+# Powers of ten for the decimals counts written by the scanner
+POW10 = (1.0, 10.0, 100.0, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+try:
+    import micropython
+
+    @micropython.viper
+    def scan_aruco(buf, n: int, out) -> int:
+        """
+        Scan the aruco frame in buf[:n] into out (see scan_buffer()).
+        Returns 1 on success, 0 if the frame needs the full json decoder.
+        """
+        p = ptr8(buf)
+        o = ptr32(out)
+        o[0] = 0
+        o[1] = 0
+        depth = 0
+        pose_depth = -1
+        is_aruco = 0
+        i = 0
+        while i < n:
+            c = p[i]
+            if c == 0x7b:  # {
+                depth += 1
+                i += 1
+            elif c == 0x7d:  # }
+                depth -= 1
+                i += 1
+            elif c == 0x22:  # " starts a key or a string value
+                ks = i + 1
+                i = ks
+                while i < n and p[i] != 0x22:
+                    if p[i] == 0x5c:  # skip escaped char
+                        i += 1
+                    i += 1
+                klen = i - ks
+                i += 1
+                while i < n and (p[i] == 0x20 or p[i] == 0x0a or
+                                 p[i] == 0x0d or p[i] == 0x09):
+                    i += 1
+                if i >= n or p[i] != 0x3a:  # no colon, it was a value
+                    continue
+                i += 1
+                while i < n and (p[i] == 0x20 or p[i] == 0x0a or
+                                 p[i] == 0x0d or p[i] == 0x09):
+                    i += 1
+                if i >= n:
+                    return 0
+
+                key = 0
+                if klen == 2 and p[ks] == 0x6f and p[ks + 1] == 0x70:
+                    key = 1  # op
+                elif (klen == 5 and p[ks] == 0x61 and p[ks + 1] == 0x72 and
+                      p[ks + 2] == 0x75 and p[ks + 3] == 0x63 and
+                      p[ks + 4] == 0x6f):
+                    key = 2  # aruco
+                elif (klen == 7 and p[ks] == 0x76 and p[ks + 1] == 0x69 and
+                      p[ks + 2] == 0x73 and p[ks + 3] == 0x69 and
+                      p[ks + 4] == 0x62 and p[ks + 5] == 0x6c and
+                      p[ks + 6] == 0x65):
+                    key = 3  # visible
+                elif klen == 1 and p[ks] == 0x78:
+                    key = 4  # x
+                elif klen == 1 and p[ks] == 0x79:
+                    key = 5  # y
+                elif (klen == 5 and p[ks] == 0x74 and p[ks + 1] == 0x68 and
+                      p[ks + 2] == 0x65 and p[ks + 3] == 0x74 and
+                      p[ks + 4] == 0x61):
+                    key = 6  # theta
+
+                if key == 1 and depth == 1:
+                    # The op has to be the string "aruco"
+                    if (i + 7 > n or p[i] != 0x22 or p[i + 1] != 0x61 or
+                            p[i + 2] != 0x72 or p[i + 3] != 0x75 or
+                            p[i + 4] != 0x63 or p[i + 5] != 0x6f or
+                            p[i + 6] != 0x22):
+                        return 0
+                    is_aruco = 1
+                    i += 7
+                elif key == 2 and depth == 1:
+                    if p[i] != 0x7b:
+                        return 0
+                    pose_depth = 2
+                elif key == 3 and depth == pose_depth:
+                    if p[i] == 0x74:  # true
+                        o[1] = 1
+                        i += 4
+                    elif p[i] == 0x66:  # false
+                        i += 5
+                    else:
+                        return 0
+                    o[0] |= 1
+                elif key >= 4 and depth == pose_depth:
+                    neg = 0
+                    if p[i] == 0x2d:  # -
+                        neg = 1
+                        i += 1
+                    start = i
+                    mant = 0
+                    decimals = 0
+                    digits = 0
+                    frac = 0
+                    while i < n:
+                        c = p[i]
+                        if c >= 0x30 and c <= 0x39:
+                            if digits < 9:
+                                mant = mant * 10 + (c - 0x30)
+                                digits += 1
+                                if frac:
+                                    decimals += 1
+                            elif not frac:
+                                return 0
+                            i += 1
+                        elif c == 0x2e and not frac:  # .
+                            frac = 1
+                            i += 1
+                        elif c == 0x65 or c == 0x45:  # exponent
+                            return 0
+                        else:
+                            break
+                    # Nulls and other surprises go to ujson
+                    if i == start:
+                        return 0
+                    if neg:
+                        mant = -mant
+                    k = key * 2 - 6
+                    o[k] = mant
+                    o[k + 1] = decimals
+                    o[0] |= 1 << (key - 3)
+            else:
+                i += 1
+        return is_aruco
+
+except (ImportError, AttributeError):
+    # no viper on this port (or the host micropython stand-in)
+    import json
+
+    def scan_aruco(buf, n, out):
+        """
+        Scan the aruco frame in buf[:n] into out (see scan_buffer()).
+        Returns 1 on success, 0 if the frame needs the full json decoder.
+
+        Reference version for ports without viper. Values are kept to six
+        decimals, which is far below what the VS can resolve.
+        """
+        data = json.loads(bytes(buf[:n]))
+        if data.get('op') != 'aruco':
+            return 0
+        aruco = data.get('aruco', {})
+        bits = 0
+        out[SCAN_VISIBLE] = 0
+        if 'visible' in aruco:
+            if not isinstance(aruco['visible'], bool):
+                return 0
+            out[SCAN_VISIBLE] = aruco['visible']
+            bits |= BIT_VISIBLE
+        for bit, slot, key in ((BIT_X, SCAN_X, 'x'), (BIT_Y, SCAN_Y, 'y'),
+                               (BIT_THETA, SCAN_THETA, 'theta')):
+            if key in aruco:
+                value = aruco[key]
+                if (isinstance(value, bool) or
+                        not isinstance(value, (int, float)) or
+                        not -2000 < value < 2000):
+                    return 0
+                out[slot] = round(value * 1000000)
+                out[slot + 1] = 6
+                bits |= bit
+        out[SCAN_BITS] = bits
+        return 1
+
+
+# Binary wire format, see the module docstring
+BINARY_VERSION = const(1)
+REC_ACK = const(0x01)
+REC_POSE = const(0x02)
+REC_MISSION = const(0x10)
+REC_PRINT = const(0x11)
+REC_MAX = const(0x1f)  # anything above is JSON text
+
+POSE_FORMAT = '<BBHhhh'
+POSE_SIZE = const(10)
+POSE_VISIBLE = const(1)
+
+MISSION_INT = const(0)
+MISSION_FLOAT = const(1)
+MISSION_STR = const(2)
+
+
+def is_record(buf, n):
+    """True if buf[:n] is a binary record rather than JSON text."""
+    return n > 0 and buf[0] <= REC_MAX
+
+
+def pack_ack():
+    return struct.pack('<BB', REC_ACK, BINARY_VERSION)
+
+
+def pack_pose(buf, visible, marker, x, y, theta):
+    """Pack a pose record into buf, which needs POSE_SIZE bytes."""
+    if visible:
+        struct.pack_into(POSE_FORMAT, buf, 0, REC_POSE, POSE_VISIBLE, marker,
+                         round(x * 1000), round(y * 1000), round(theta * 1000))
+    else:
+        struct.pack_into(POSE_FORMAT, buf, 0, REC_POSE, 0, marker, -1000, -1000, -1000)
+
+
+def unpack_pose(buf, offset=0):
+    """Return (visible, marker, x, y, theta) from the pose record at offset."""
+    _, flags, marker, x, y, theta = struct.unpack_from(POSE_FORMAT, buf, offset)
+    if not flags & POSE_VISIBLE:
+        return False, marker, -1.0, -1.0, -1.0
+    return True, marker, x / 1000, y / 1000, theta / 1000
+
+
+def fits_mission(message):
+    """Whether a mission record can carry message as it is (see pack_mission)."""
+    if type(message) is int:
+        return -0x80000000 <= message <= 0x7fffffff
+    return type(message) is float or type(message) is str
+
+
+def pack_mission(mission_type, message):
+    """Return a mission record for an int, float or str message."""
+    if isinstance(message, str):
+        return struct.pack('<BBB', REC_MISSION, mission_type, MISSION_STR) + message.encode()
+    if isinstance(message, float):
+        return struct.pack('<BBBf', REC_MISSION, mission_type, MISSION_FLOAT, message)
+    return struct.pack('<BBBi', REC_MISSION, mission_type, MISSION_INT, message)
+
+
+def unpack_mission(buf, n):
+    """Return (mission type, message) from the mission record in buf[:n]."""
+    _, mission_type, kind = struct.unpack_from('<BBB', buf)
+    if kind == MISSION_INT:
+        return mission_type, struct.unpack_from('<i', buf, 3)[0]
+    if kind == MISSION_FLOAT:
+        return mission_type, struct.unpack_from('<f', buf, 3)[0]
+    if kind == MISSION_STR:
+        return mission_type, str(bytes(buf[3:n]), 'utf-8')
+    raise ValueError('mission value kind')
+
+
+def pack_print(text, n):
+    """Return a print record for the utf-8 text in text[:n]."""
+    record = bytearray(n + 1)
+    record[0] = REC_PRINT
+    record[1:] = text[:n]
+    return record
+
+
+def unpack_print(buf, n):
+    """Return the text of the print record in buf[:n]."""
+    return str(bytes(buf[1:n]), 'utf-8')
+
+
+# What an aruco frame starts with, once whitespace is dropped
+_ARUCO_START = b'{"op":"aruco"'
+
+
+def is_aruco(buf, n):
+    """
+    True if buf[:n] is a pose record, or starts the way the VS writes aruco
+    frames, {"op": "aruco", ... Only the first few bytes are looked at, so
+    it is cheap enough to ask of every frame, but a frame that passes can
+    still fail to decode and one with the op further in won't pass.
+    """
+    if n and buf[0] == REC_POSE:
+        return True
+    want = _ARUCO_START
+    j = 0
+    i = 0
+    while i < n and j < len(want):
+        c = buf[i]
+        if c == want[j]:
+            j += 1
+        elif c != 0x20 and c != 0x0a and c != 0x0d and c != 0x09:
+            return False
+        i += 1
+    return j == len(want)
+
+
+def scan_buffer():
+    """Preallocated output storage for scan_aruco()."""
+    return array('i', [0] * SCAN_LEN)
@@ -0,0 +1,191 @@
+"""
+Bounded-time WiFi join for the VS access point
+
+A full join scans every channel for the SSID and then waits on DHCP, which
+is most of the time begin() spends before it can talk to the VS. After the
+first successful join, the access point's BSSID and channel and the DHCP
+lease are cached in a small file in flash. The next join goes straight to
+that access point, and can skip DHCP by reusing the lease or a static IP.
+
+If the cached access point doesn't answer quickly the cache is dropped and
+the join falls back to a normal one, all within the caller's deadline.
+"""
+
+import network
+import time
+import ujson as json
+
+WIFI_CACHE = '/enes100_wifi.json'
+
+# How long a join to the cached access point gets before falling back
+FAST_JOIN_MS = const(3000)
+
+
+class WifiJoin:
+    """
+    Joins ssid on sta_if within timeout_ms. Call start(), then poll() until
+    it returns True; poll() raises OSError with the reason if the join
+    fails or runs out of time.
+
+    static is an ifconfig() tuple (ip, mask, gateway, dns) to use instead of
+    DHCP. With reuse_lease, the lease cached from the last join is used the
+    same way. scan lets a join without a usable cache scan for the access
+    point itself, so its BSSID can be cached; that blocks for a couple of
+    seconds, so reconnects leave it off.
+
+    associate_ms and dhcp_ms are how long each phase took, -1 if skipped.
+    """
+
+    def __init__(self, sta_if, ssid, key, timeout_ms, cache=WIFI_CACHE,
+                 static=None, reuse_lease=False, scan=True):
+        self.sta_if = sta_if
+        self.ssid = ssid
+        self.key = key
+        self.timeout_ms = timeout_ms
+        self.cache = cache
+        self.static = static
+        self.reuse_lease = reuse_lease
+        self.scan = scan
+
+        self.start_ticks = 0
+        self.fast = False  # joining the cached access point
+        self.associate_ms = -1
+        self.dhcp_ms = -1
+        self._saved = None  # cache contents as loaded
+        self._bssid = None
+        self._channel = 0
+
+    def _load(self):
+        if not self.cache:
+            return None
+        try:
+            with open(self.cache) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return saved if saved.get('ssid') == self.ssid else None
+
+    def _connect(self):
+        sta_if = self.sta_if
+        if self._bssid:
+            sta_if.connect(self.ssid, self.key, bssid=self._bssid)
+        else:
+            sta_if.connect(self.ssid, self.key)
+
+    def _find_ap(self):
+        """Scan for the strongest access point with our ssid."""
+        best = None
+        ssid = self.ssid.encode()
+        for ap in self.sta_if.scan():
+            if ap[0] == ssid and (best is None or ap[3] > best[3]):
+                best = ap
+        if best:
+            self._bssid = best[1]
+            self._channel = best[2]
+
+    def start(self):
+        self.start_ticks = time.ticks_ms()
+        sta_if = self.sta_if
+        if sta_if.isconnected():
+            # still up from before a soft reset
+            self.associate_ms = 0
+            self.dhcp_ms = 0
+            return
+        sta_if.active(True)
+
+        saved = self._saved = self._load()
+        if self.static:
+            sta_if.ifconfig(self.static)
+        elif self.reuse_lease and saved and saved.get('ifconfig'):
+            sta_if.ifconfig(tuple(saved['ifconfig']))
+
+        if saved:
+            import ubinascii as binascii
+            self.fast = True
+            self._bssid = binascii.unhexlify(saved['bssid'])
+            self._channel = saved['channel']
+            try:
+                sta_if.config(channel=self._channel)
+            except (OSError, ValueError, TypeError):
+                pass
+        elif self.scan:
+            self._find_ap()
+        self._connect()
+
+    def _elapsed(self):
+        return time.ticks_diff(time.ticks_ms(), self.start_ticks)
+
+    def poll(self):
+        sta_if = self.sta_if
+        if sta_if.isconnected():
+            elapsed = self._elapsed()
+            if self.associate_ms < 0:
+                self.associate_ms = elapsed
+            if self.dhcp_ms < 0:
+                self.dhcp_ms = elapsed - self.associate_ms
+            self._save()
+            return True
+
+        elapsed = self._elapsed()
+        if self.associate_ms < 0:
+            try:
+                # only answers once associated with an access point
+                sta_if.status('rssi')
+                self.associate_ms = elapsed
+            except (OSError, ValueError):
+                pass
+
+        status = sta_if.status()
+        if status == network.STAT_WRONG_PASSWORD:
+            sta_if.disconnect()
+            raise OSError(f'WiFi password rejected by {self.ssid}')
+
+        if self.fast and self.associate_ms < 0 and (
+                elapsed > FAST_JOIN_MS or status == network.STAT_NO_AP_FOUND):
+            # the cached access point is gone or moved, join the slow way
+            self.fast = False
+            self._bssid = None
+            self._forget()
+            sta_if.disconnect()
+            if self.scan:
+                self._find_ap()
+            self._connect()
+
+        if elapsed > self.timeout_ms:
+            sta_if.disconnect()
+            if status == network.STAT_NO_AP_FOUND:
+                raise OSError(f'WiFi network {self.ssid} not found')
+            if self.associate_ms < 0:
+                raise OSError(f'timed out joining {self.ssid} after {elapsed} ms')
+            raise OSError(f'joined {self.ssid} but got no IP address after {elapsed} ms')
+        return False
+
+    def _save(self):
+        """Cache the access point and lease, writing flash only if they changed."""
+        if not self.cache or not self._bssid:
+            return
+        import ubinascii as binascii
+        saved = {
+            'ssid': self.ssid,
+            'bssid': binascii.hexlify(self._bssid).decode(),
+            'channel': self._channel,
+            'ifconfig': list(self.sta_if.ifconfig()),
+        }
+        if saved == self._saved:
+            return
+        try:
+            with open(self.cache, 'w') as f:
+                json.dump(saved, f)
+            self._saved = saved
+        except OSError:
+            pass
+
+    def _forget(self):
+        if not self.cache:
+            return
+        try:
+            import os
+            os.remove(self.cache)
+        except OSError:
+            pass
+        self._saved = None
@@ -0,0 +1,21 @@
+"""
+Host stand-in for the MicroPython machine module
+
+Only what the library touches; there is no hardware behind it.
+"""
+
+
+def unique_id():
+    return b'\x02\x00\x00\x00\x00\x00'
+
+
+def freq(hz=None):
+    return 240000000 if hz is None else None
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def idle():
+    pass
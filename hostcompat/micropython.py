@@ -0,0 +1,37 @@
+"""
+Host stand-in for the micropython module
+
+There is deliberately no native/viper here: code that tries
+`@micropython.viper` gets an AttributeError and falls back to its plain
+Python version, the same as on a port built without viper.
+"""
+
+from mphost import const
+
+
+def schedule(func, arg):
+    """
+    Call func(arg) "soon". On the board this runs between bytecodes of the
+    main thread; here it simply runs now, in the caller's thread.
+    """
+    func(arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def opt_level(level=None):
+    return 0 if level is None else None
+
+
+def mem_info(verbose=False):
+    print('mem_info: not available on the host')
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
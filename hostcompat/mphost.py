@@ -0,0 +1,77 @@
+"""
+MicroPython builtins for CPython
+
+install() adds the pieces of the MicroPython runtime that aren't separate
+modules: the const() builtin and the time.ticks_* family. It also puts the
+enes100 package directory on sys.path, which is where Enes100.py expects its
+flat imports (uwebsockets, vsprotocol, ...) to live, like /lib/enes100 on
+the board. sitecustomize.py calls it at startup, so putting hostcompat/ on
+PYTHONPATH is all that's needed.
+
+On the MicroPython unix port all of this is built in and install() does
+nothing.
+"""
+
+import sys
+import time
+
+# Same wrap-around as the ESP32 port, so ticks_diff() bugs show up on the host too
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+_installed = False
+
+
+def const(value):
+    return value
+
+
+def ticks_ms():
+    return time.monotonic_ns() // 1000000 & TICKS_MAX
+
+
+def ticks_us():
+    return time.monotonic_ns() // 1000 & TICKS_MAX
+
+
+def ticks_cpu():
+    return time.perf_counter_ns() & TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+def install():
+    """Patch builtins and time, and make the enes100 modules importable."""
+    global _installed
+    if _installed or sys.implementation.name == 'micropython':
+        return
+    _installed = True
+
+    import builtins
+    import os
+
+    builtins.const = const
+    for f in (ticks_ms, ticks_us, ticks_cpu, ticks_add, ticks_diff,
+              sleep_ms, sleep_us):
+        if not hasattr(time, f.__name__):
+            setattr(time, f.__name__, f)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for path in (root, os.path.join(root, 'enes100')):
+        if path not in sys.path:
+            sys.path.append(path)
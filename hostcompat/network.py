@@ -0,0 +1,101 @@
+"""
+Host stand-in for the MicroPython network module
+
+WLAN keeps the same per-interface state as the real driver, but connect()
+succeeds immediately with a loopback address, so enes100.begin() goes
+straight on to the websocket. Tests can call disconnect() to simulate
+losing the access point.
+
+scan() reports whatever is in ACCESS_POINTS, as (ssid, bssid, channel,
+RSSI, security, hidden) tuples. If it isn't empty, connecting to a BSSID
+that isn't listed fails with STAT_NO_AP_FOUND, like a cached access point
+that has gone away.
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+
+_LOOPBACK = ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+ACCESS_POINTS = []
+
+
+class WLAN:
+    IF_STA = STA_IF
+    IF_AP = AP_IF
+
+    # One instance per interface, like the real driver
+    _interfaces = {}
+
+    def __new__(cls, interface=STA_IF):
+        wlan = cls._interfaces.get(interface)
+        if wlan is None:
+            wlan = super().__new__(cls)
+            wlan._active = False
+            wlan._status = STAT_IDLE
+            wlan._ifconfig = _LOOPBACK
+            wlan._config = {
+                'mac': bytes((0x02, 0, 0, 0, 0, interface)),
+                'ssid': '',
+                'channel': 1,
+                'hostname': 'esp32',
+            }
+            cls._interfaces[interface] = wlan
+        return wlan
+
+    def __init__(self, interface=STA_IF):
+        pass
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._status = STAT_IDLE
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        if not self._active:
+            raise OSError('Wifi Not Started')
+        if ssid is not None:
+            self._config['ssid'] = ssid
+        if bssid is not None and ACCESS_POINTS and not any(
+                ap[1] == bytes(bssid) for ap in ACCESS_POINTS):
+            self._status = STAT_NO_AP_FOUND
+            return
+        self._status = STAT_GOT_IP
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+
+    def isconnected(self):
+        return self._status == STAT_GOT_IP
+
+    def status(self, param=None):
+        if param == 'rssi':
+            # like the driver, only once associated with an access point
+            if self._status != STAT_GOT_IP:
+                raise OSError('not connected')
+            return -40
+        if param is not None:
+            raise ValueError('unknown status param')
+        return self._status
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._ifconfig
+        self._ifconfig = tuple(config)
+
+    def config(self, *args, **kwargs):
+        if kwargs:
+            self._config.update(kwargs)
+            return None
+        return self._config[args[0]]
+
+    def scan(self):
+        return list(ACCESS_POINTS)
@@ -0,0 +1,4 @@
+# Picked up by CPython at startup when hostcompat/ is on PYTHONPATH
+import mphost
+
+mphost.install()
@@ -0,0 +1,28 @@
+"""
+Host stand-in for the MicroPython uasyncio module
+
+Everything comes from asyncio; this only adds the MicroPython extras the
+library uses: sleep_ms(), wait_for_ms() and readinto() on stream readers.
+"""
+
+import asyncio as _asyncio
+from asyncio import *
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout / 1000)
+
+
+async def _readinto(self, buf):
+    data = await self.read(len(buf))
+    n = len(data)
+    buf[:n] = data
+    return n
+
+
+if not hasattr(_asyncio.StreamReader, 'readinto'):
+    _asyncio.StreamReader.readinto = _readinto
@@ -0,0 +1,2 @@
+# Host stand-in for the MicroPython ubinascii module
+from binascii import *
@@ -0,0 +1,2 @@
+# Host stand-in for the MicroPython ucollections module
+from collections import *
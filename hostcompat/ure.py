@@ -0,0 +1,2 @@
+# Host stand-in for the MicroPython ure module
+from re import *
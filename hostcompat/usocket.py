@@ -0,0 +1,70 @@
+"""
+Host stand-in for the MicroPython usocket module
+
+MicroPython sockets are also streams (read, readinto, readline, write) and
+uwebsockets relies on that. socket() here wraps a CPython socket to add
+those methods, with the same blocking semantics: read(n) and readinto()
+return short only at end of stream.
+"""
+
+import socket as _socket
+from socket import (getaddrinfo, AF_INET, AF_INET6, SOCK_STREAM, SOCK_DGRAM,
+                    SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY)
+
+
+class socket:
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0, *, sock=None):
+        self._sock = sock if sock is not None else _socket.socket(af, type, proto)
+
+    def __getattr__(self, name):
+        # bind, listen, setsockopt, settimeout, setblocking, fileno, ...
+        return getattr(self._sock, name)
+
+    def accept(self):
+        sock, addr = self._sock.accept()
+        return socket(sock=sock), addr
+
+    def write(self, buf, n=None):
+        mv = memoryview(buf)
+        if n is not None:
+            mv = mv[:n]
+        self._sock.sendall(mv)
+        return len(mv)
+
+    def send(self, buf):
+        return self._sock.send(buf)
+
+    def read(self, n=-1):
+        if n < 0:
+            chunks = []
+            while True:
+                data = self._sock.recv(4096)
+                if not data:
+                    return b''.join(chunks)
+                chunks.append(data)
+        buf = bytearray(n)
+        return bytes(buf[:self.readinto(buf)])
+
+    def readinto(self, buf, n=None):
+        mv = memoryview(buf)
+        if n is None:
+            n = len(mv)
+        got = 0
+        while got < n:
+            k = self._sock.recv_into(mv[got:n])
+            if not k:
+                break
+            got += k
+        return got
+
+    def readline(self):
+        line = bytearray()
+        while not line.endswith(b'\n'):
+            data = self._sock.recv(1)
+            if not data:
+                break
+            line += data
+        return bytes(line)
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,523 @@
+"""
+Vision System stand-in for running enes100 on a PC
+
+A small websocket server that talks enough of the VS protocol for the
+library: it answers the handshake, records begin/mission/print packets,
+answers pings, and once a team has sent begin it streams aruco frames for
+a marker driving a slow circle.
+
+Run it next to a script that uses the hostcompat layer:
+
+    python hostcompat/vsstandin.py --port 7755 --rate 10
+
+or start it in-process, e.g. from a benchmark:
+
+    vs = VisionSystem(port=0).start()
+    Enes100.WS_URL = vs.url
+    enes100.begin('Team', 'DATA', 3, 1116)
+
+If the robot asks for the binary wire format in its begin packet, the
+stand-in agrees and switches that connection over; pass binary=False (or
+--json) to play a VS that only knows JSON.
+
+markers=N (--markers N) adds N more markers, IDs MARKER_BASE and up, each
+driving its own circle somewhere on the arena. A robot that subscribes to
+any of them in its begin packet gets their poses with every frame: as
+extra pose records in binary, or a markers frame after the aruco frame in
+JSON.
+
+For load and soak testing it can also make the arena busy and the network
+bad, per connection: rate_hz can be a function of the robot's begin packet,
+and latency_ms, jitter_ms, loss, burst_every_s/burst_ms and
+disconnect_every_s/disconnect delay, drop, bunch up and cut off the aruco
+stream (see VisionSystem). Everything the robots send is kept per
+connection, and with log=path also written out as JSON lines. summary()
+adds it up per team. bench/soak.py runs many robots against it.
+
+It is written against plain CPython sockets and does its own framing, so it
+doesn't share any bugs with uwebsockets. Binary records use the reference
+codec in vsprotocol.
+"""
+
+import argparse
+import base64
+import hashlib
+import collections
+import json
+import math
+import random
+import socket
+import struct
+import threading
+import time
+
+import mphost
+mphost.install()
+import vsprotocol as vsp
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BYTES = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xa
+
+CLOSE_GOING_AWAY = 1001
+
+# what a forced disconnect does: send a close frame, just shut the socket, or go quiet and
+# leave the connection open, as a VS that crashed or a robot out of range would look
+DISCONNECTS = ('close', 'drop', 'silent')
+
+
+def circle_pose(t):
+    """Default marker path: a 0.5 m circle around (2, 1) every 20 s."""
+    a = t * 2 * math.pi / 20
+    theta = (a + math.pi) % (2 * math.pi) - math.pi
+    return True, 2 + 0.5 * math.cos(a), 1 + 0.5 * math.sin(a), theta
+
+
+MARKER_BASE = 100
+
+
+def marker_pose(marker, t):
+    """
+    Path of extra marker number marker: a circle of 0.1 to 0.3 m at a spot
+    spread over the 4 x 2 m arena, some clockwise, hidden every so often.
+    """
+    cx = 0.25 + (marker * 0.618 % 1) * 3.5
+    cy = 0.25 + (marker * 0.382 % 1) * 1.5
+    r = 0.1 + marker % 3 * 0.1
+    a = (t * 2 * math.pi / (10 + marker % 7)) * (-1 if marker & 1 else 1) + marker
+    visible = int(t + marker) % 15 != 0
+    theta = (a + math.pi / 2 + math.pi) % (2 * math.pi) - math.pi
+    return visible, cx + r * math.cos(a), cy + r * math.sin(a), theta
+
+
+def markers_packet(poses):
+    """The markers frame for [(id, (visible, x, y, theta)), ...], as text."""
+    return json.dumps({
+        'op': 'markers',
+        'markers': [{
+            'id': marker,
+            'visible': visible,
+            'x': round(x, 3) if visible else -1,
+            'y': round(y, 3) if visible else -1,
+            'theta': round(theta, 3) if visible else -1,
+        } for marker, (visible, x, y, theta) in poses],
+    })
+
+
+def aruco_packet(visible, x, y, theta):
+    """The aruco frame the VS sends, as text."""
+    return json.dumps({
+        'op': 'aruco',
+        'aruco': {
+            'visible': visible,
+            'x': round(x, 3) if visible else -1,
+            'y': round(y, 3) if visible else -1,
+            'theta': round(theta, 3) if visible else -1,
+        },
+    })
+
+
+def encode_frame(opcode, payload):
+    """An unmasked (server to client) frame."""
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+def read_frame(f):
+    """Return (fin, opcode, payload) of the next client frame."""
+    b0, b1 = read_exact(f, 2)
+    n = b1 & 0x7f
+    if n == 126:
+        n = struct.unpack('!H', read_exact(f, 2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', read_exact(f, 8))[0]
+    payload = read_exact(f, 4 + n) if b1 & 0x80 else read_exact(f, n)
+    if b1 & 0x80:
+        key = payload[:4]
+        payload = bytes(b ^ key[i & 3] for i, b in enumerate(payload[4:]))
+    return bool(b0 & 0x80), b0 & 0x0f, payload
+
+
+class Client:
+    """
+    One connected robot. messages has every packet it sent; updates, lost,
+    bursts and pings count aruco frames sent and dropped, held-back bursts
+    and pings answered.
+    """
+
+    def __init__(self, vs, sock, addr, rng):
+        self.vs = vs
+        self.sock = sock
+        self.addr = addr
+        self.rng = rng
+        self.wlock = threading.Lock()
+        self.begin = None  # the begin packet, once received
+        self.binary = False  # agreed to the binary wire format
+        self.open = True
+        self.silent = False  # a 'silent' disconnect: nothing sent or answered any more
+        self.messages = []
+        self.updates = 0
+        self.lost = 0
+        self.bursts = 0
+        self.pings = 0
+
+    def send(self, opcode, payload):
+        with self.wlock:
+            self.sock.sendall(encode_frame(opcode, payload))
+
+    def handshake(self, f):
+        key = None
+        while True:
+            line = f.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'sec-websocket-key':
+                key = value.strip()
+        accept = base64.b64encode(hashlib.sha1(key + GUID).digest()) if key else b''
+        self.sock.sendall(b'HTTP/1.1 101 Switching Protocols\r\n'
+                          b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+                          b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+    def receive(self):
+        f = self.sock.makefile('rb')
+        try:
+            self.handshake(f)
+            message = b''
+            kind = OP_TEXT
+            while self.vs.running:
+                fin, opcode, payload = read_frame(f)
+                if self.silent:
+                    continue
+                if opcode == OP_PING:
+                    self.pings += 1
+                    self.send(OP_PONG, payload)
+                elif opcode == OP_CLOSE:
+                    self.send(OP_CLOSE, payload[:2])
+                    break
+                elif opcode in (OP_TEXT, OP_BYTES, OP_CONT):
+                    if opcode != OP_CONT:
+                        kind = opcode
+                    message += payload
+                    if fin:
+                        if kind == OP_BYTES:
+                            self.vs.received_record(self, message)
+                        else:
+                            self.vs.received(self, message)
+                        message = b''
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            self.open = False
+            f.close()
+            self.sock.close()
+
+    def subscribed(self):
+        """The extra marker IDs this robot asked for that the VS has."""
+        wanted = self.begin.get('markers') or ()
+        return [m for m in wanted if MARKER_BASE <= m < MARKER_BASE + self.vs.markers]
+
+    def frames(self, t, record):
+        """The encoded frames of one update at time t."""
+        pose = self.vs.pose(t)
+        others = [(m, marker_pose(m, t)) for m in self.subscribed()]
+        if self.binary:
+            vsp.pack_pose(record, pose[0], self.begin.get('aruco', 0), *pose[1:])
+            payload = bytes(record)
+            for marker, (visible, x, y, theta) in others:
+                vsp.pack_pose(record, visible, marker, x, y, theta)
+                payload += record
+            return encode_frame(OP_BYTES, payload)
+        frames = encode_frame(OP_TEXT, aruco_packet(*pose).encode())
+        if others:
+            frames += encode_frame(OP_TEXT, markers_packet(others).encode())
+        return frames
+
+    def disconnect(self):
+        """Cut the robot off the way vs.disconnect says."""
+        how = self.vs.disconnect
+        if how == 'silent':
+            self.silent = True
+            return
+        try:
+            if how == 'close':
+                self.send(OP_CLOSE, struct.pack('!H', CLOSE_GOING_AWAY))
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def stream(self):
+        """
+        Send aruco frames at the VS rate, each latency_ms (+ up to jitter_ms)
+        after it was made, in order. Lost ones are never sent, and during a
+        burst everything is held back and then written out in one go.
+        """
+        vs = self.vs
+        record = bytearray(vsp.POSE_SIZE)
+        queue = collections.deque()  # (due, frames) made but not sent yet
+        now = time.monotonic()
+        next_at = now
+        hold_until = 0.0
+        next_burst = now + vs.burst_every_s if vs.burst_every_s else math.inf
+        cut_at = now + self.rng.expovariate(1 / vs.disconnect_every_s) if vs.disconnect_every_s else math.inf
+        while self.open and vs.running and not self.silent:
+            now = time.monotonic()
+            if now >= cut_at:
+                if vs.disconnect_every_s:
+                    vs.disconnects += 1
+                    self.disconnect()
+                    break
+                # turned off since
+                cut_at = math.inf
+            if now >= next_at:
+                if self.begin is not None:
+                    self.updates += 1
+                    if vs.loss and self.rng.random() < vs.loss:
+                        self.lost += 1
+                    else:
+                        due = now + (vs.latency_ms + self.rng.random() * vs.jitter_ms) / 1000
+                        if queue:
+                            due = max(due, queue[-1][0])
+                        queue.append((due, self.frames(now - vs.started, record)))
+                rate = vs.rate_hz(self.begin) if callable(vs.rate_hz) else vs.rate_hz
+                next_at += 1 / rate
+                if next_at < now:
+                    # fell behind (a slow machine), don't try to catch up
+                    next_at = now
+            if now >= next_burst:
+                if vs.burst_every_s:
+                    self.bursts += 1
+                    hold_until = now + vs.burst_ms / 1000
+                    next_burst += vs.burst_every_s
+                else:
+                    next_burst = math.inf
+            if now >= hold_until and queue and queue[0][0] <= now:
+                out = []
+                while queue and queue[0][0] <= now:
+                    out.append(queue.popleft()[1])
+                try:
+                    with self.wlock:
+                        self.sock.sendall(b''.join(out))
+                except OSError:
+                    break
+            wake = min(next_at, next_burst, cut_at)
+            if queue:
+                wake = min(wake, max(queue[0][0], hold_until))
+            time.sleep(max(0, wake - time.monotonic()))
+
+
+class VisionSystem:
+    """
+    The server. port=0 picks a free port; see url once started.
+
+    Every packet received is appended to messages as (client, dict), so a
+    test can check what the robot sent. markers is how many extra markers
+    there are to subscribe to, see marker_pose().
+
+    rate_hz is aruco frames per second, or a function giving it from a
+    robot's begin packet (None until it has one). For each connection:
+    frames go out latency_ms plus up to jitter_ms late, the fraction loss
+    of them not at all, and every burst_every_s seconds they are held back
+    for burst_ms and then sent together. Every disconnect_every_s seconds
+    on average (at random) the connection is cut off, as disconnect says
+    (one of DISCONNECTS); disconnects counts them. seed makes all of that
+    repeat from run to run. log is a file to write every packet received
+    to, as JSON lines.
+    """
+
+    def __init__(self, host='127.0.0.1', port=7755, rate_hz=10, pose=circle_pose,
+                 verbose=False, binary=True, markers=0, latency_ms=0, jitter_ms=0, loss=0.0,
+                 burst_every_s=0, burst_ms=0, disconnect_every_s=0, disconnect='close',
+                 seed=None, log=None):
+        if disconnect not in DISCONNECTS:
+            raise ValueError('disconnect must be one of %s' % ', '.join(DISCONNECTS))
+        self.host = host
+        self.port = port
+        self.rate_hz = rate_hz
+        self.pose = pose
+        self.binary = binary
+        self.markers = markers
+        self.verbose = verbose
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.burst_every_s = burst_every_s
+        self.burst_ms = burst_ms
+        self.disconnect_every_s = disconnect_every_s
+        self.disconnect = disconnect
+        self.disconnects = 0
+        self.messages = []
+        self.clients = []
+        self.running = False
+        self.started = 0.0
+        self._rng = random.Random(seed)
+        self._log = open(log, 'w') if log else None
+        self._log_lock = threading.Lock()
+        self._listener = None
+
+    @property
+    def url(self):
+        return 'ws://%s:%d' % (self.host, self.port)
+
+    def start(self):
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self._listener.listen(8)
+        self.port = self._listener.getsockname()[1]
+        self.running = True
+        self.started = time.monotonic()
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._listener:
+            self._listener.close()
+        for client in self.clients:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._log:
+            with self._log_lock:
+                self._log.close()
+                self._log = None
+
+    def _accept(self):
+        while self.running:
+            try:
+                sock, addr = self._listener.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = Client(self, sock, addr, random.Random(self._rng.getrandbits(32)))
+            self.clients.append(client)
+            threading.Thread(target=client.receive, daemon=True).start()
+            threading.Thread(target=client.stream, daemon=True).start()
+
+    def received(self, client, message):
+        try:
+            packet = json.loads(message)
+        except ValueError:
+            return
+        if packet.get('op') == 'begin':
+            if self.binary and packet.get('binary') == vsp.BINARY_VERSION:
+                client.send(OP_BYTES, vsp.pack_ack())
+                client.binary = True
+            client.begin = packet
+        self.record(client, packet)
+
+    def received_record(self, client, record):
+        """Decode a binary record into the same dict the JSON packet would be."""
+        team = client.begin.get('teamName') if client.begin else None
+        if record[:1] == bytes([vsp.REC_MISSION]):
+            mission_type, message = vsp.unpack_mission(record, len(record))
+            packet = {'op': 'mission', 'teamName': team, 'type': mission_type, 'message': message}
+        elif record[:1] == bytes([vsp.REC_PRINT]):
+            packet = {'op': 'print', 'teamName': team, 'message': vsp.unpack_print(record, len(record))}
+        else:
+            return
+        self.record(client, packet)
+
+    def record(self, client, packet):
+        self.messages.append((client, packet))
+        client.messages.append(packet)
+        if self._log:
+            line = json.dumps({'t': round(time.monotonic() - self.started, 3),
+                               'client': '%s:%d' % client.addr, 'packet': packet})
+            with self._log_lock:
+                if self._log:
+                    self._log.write(line + '\n')
+        if self.verbose:
+            if packet['op'] == 'print':
+                print(packet.get('message', ''), end='')
+            else:
+                print('%s:%d %s' % (client.addr[0], client.addr[1], json.dumps(packet)))
+
+
+    def summary(self):
+        """
+        Totals per team name, over all of its connections: connections,
+        updates, lost, bursts, pings, and received, a count of each op it
+        sent.
+        """
+        teams = {}
+        for client in list(self.clients):
+            if client.begin is None:
+                continue
+            team = teams.setdefault(client.begin.get('teamName'), {
+                'connections': 0, 'updates': 0, 'lost': 0, 'bursts': 0, 'pings': 0, 'received': {}})
+            team['connections'] += 1
+            for key in ('updates', 'lost', 'bursts', 'pings'):
+                team[key] += getattr(client, key)
+            for packet in list(client.messages):
+                op = packet.get('op')
+                team['received'][op] = team['received'].get(op, 0) + 1
+        return teams
+
+
+def add_network_args(parser):
+    """The options for how bad the network is, shared with bench/soak.py."""
+    parser.add_argument('--latency', type=float, default=0, help='ms each frame is delayed')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many ms more')
+    parser.add_argument('--loss', type=float, default=0, help='fraction of frames never sent')
+    parser.add_argument('--burst-every', type=float, default=0,
+                        help='seconds between bursts (frames held back, then sent together)')
+    parser.add_argument('--burst', type=float, default=0, help='ms frames are held back for')
+    parser.add_argument('--disconnect-every', type=float, default=0,
+                        help='mean seconds between forced disconnects of each connection')
+    parser.add_argument('--disconnect', choices=DISCONNECTS, default='close')
+    parser.add_argument('--seed', type=int, help='repeat the same losses and disconnects')
+    parser.add_argument('--log', help='write every packet received here, as JSON lines')
+
+
+def network_kwargs(args):
+    return {
+        'latency_ms': args.latency, 'jitter_ms': args.jitter, 'loss': args.loss,
+        'burst_every_s': args.burst_every, 'burst_ms': args.burst,
+        'disconnect_every_s': args.disconnect_every, 'disconnect': args.disconnect,
+        'seed': args.seed, 'log': args.log,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7755)
+    parser.add_argument('--rate', type=float, default=10, help='aruco frames per second')
+    parser.add_argument('--json', action='store_true', help="don't agree to the binary format")
+    parser.add_argument('--markers', type=int, default=0,
+                        help='extra markers to offer, IDs %d and up' % MARKER_BASE)
+    add_network_args(parser)
+    args = parser.parse_args()
+    vs = VisionSystem(args.host, args.port, args.rate, verbose=True, binary=not args.json,
+                      markers=args.markers, **network_kwargs(args)).start()
+    print('Vision System stand-in on', vs.url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        vs.stop()
+
+
+if __name__ == '__main__':
+    main()
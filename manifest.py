@@ -0,0 +1,15 @@
+# Freezes the enes100 package into MicroPython firmware. Frozen bytecode and
+# its constant tables (strings, the mission name tuples, ...) stay in flash
+# instead of being loaded into the heap at import.
+#
+#   cd micropython/ports/esp32
+#   make BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/enes100-micropython/manifest.py
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+package("enes100", files=("__init__.py", "Enes100.py"))
+
+# Enes100 imports these as top-level modules, as they are in /lib/enes100
+for name in ("uwebsockets", "vsprotocol", "outbox", "posehistory", "geofence",
+             "linkstats", "looptimer", "wifijoin", "markers", "recorder"):
+    module(name + ".py", base_path="enes100")
@@ -0,0 +1,118 @@
+"""
+Shared fixtures for the host tests
+
+The library runs on CPython through hostcompat/ (see mphost.py), over real
+loopback sockets: either one end of a socket pair driven by hand, or the
+Vision System stand-in in hostcompat/vsstandin.py.
+
+    python -m pytest tests
+"""
+
+import os
+import socket
+import struct
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'hostcompat'))
+import mphost
+mphost.install()
+
+import pytest
+import usocket
+import uwebsockets as web
+import vsstandin
+import Enes100
+
+# How long a test waits on a socket or for something to happen before failing
+TIMEOUT_S = 5
+
+
+def wire_frame(opcode, payload=b'', fin=True, mask=None):
+    """A frame as it goes on the wire; mask is a 4-byte key, as a client sends."""
+    head = bytearray([(0x80 if fin else 0) | opcode])
+    bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        head.append(bit | n)
+    elif n < 1 << 16:
+        head.append(bit | 126)
+        head += struct.pack('!H', n)
+    else:
+        head.append(bit | 127)
+        head += struct.pack('!Q', n)
+    if mask:
+        head += mask
+        payload = bytes(c ^ mask[i & 3] for i, c in enumerate(payload))
+    return bytes(head) + payload
+
+
+def wait_until(check, timeout_s=TIMEOUT_S):
+    """Poll check() until it is true, failing the test after timeout_s."""
+    end = time.monotonic() + timeout_s
+    while not check():
+        if time.monotonic() > end:
+            pytest.fail('timed out waiting for %s' % getattr(check, '__name__', 'a condition'))
+        time.sleep(0.01)
+
+
+class Pair:
+    """A client websocket on one end of a socket pair; peer is the raw other end."""
+
+    def __init__(self):
+        ours, self.peer = socket.socketpair()
+        ours.settimeout(TIMEOUT_S)
+        self.peer.settimeout(TIMEOUT_S)
+        self.ws = web.WebsocketClient(usocket.socket(sock=ours))
+        self.reader = self.peer.makefile('rb')
+
+    def send(self, data):
+        self.peer.sendall(data)
+
+    def read(self):
+        """(fin, opcode, payload) of the next frame the websocket sent, unmasked."""
+        return vsstandin.read_frame(self.reader)
+
+    def close(self):
+        self.reader.close()
+        self.peer.close()
+        self.ws.sock.close()
+
+
+@pytest.fixture
+def pair():
+    p = Pair()
+    yield p
+    p.close()
+
+
+@pytest.fixture
+def vs():
+    """A VS stand-in on a free port, with Enes100 pointed at it."""
+    server = vsstandin.VisionSystem('127.0.0.1', 0, 50).start()
+    url = Enes100.WS_URL
+    Enes100.WS_URL = server.url
+    yield server
+    server.stop()
+    Enes100.WS_URL = url
+
+
+def new_robot():
+    robot = Enes100.Enes100()
+    # nothing to cache the WiFi channel for on the host
+    robot.wifi_cache = None
+    return robot
+
+
+def clients_of(server, team):
+    """The VS connections of this team. Robots from earlier tests are still
+    running in the background and may have reconnected here too."""
+    return [client for client in list(server.clients)
+            if client.begin and client.begin.get('teamName') == team]
+
+
+def sent(server, op, team):
+    """Every packet with this op the team has sent the VS, in order."""
+    return [packet for client in clients_of(server, team) for packet in list(client.messages)
+            if packet.get('op') == op]
@@ -0,0 +1,190 @@
+"""
+The Enes100 client: mission and print encoding and frame decoding on a robot
+that isn't connected, then begin() against the VS stand-in.
+
+Robots started with begin() keep their receive and sender threads running
+(there is no end() in thread mode), so those tests stay few.
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+import Enes100
+import posehistory
+import vsprotocol as vs
+import vsstandin
+from conftest import clients_of, new_robot, sent, wait_until, TIMEOUT_S
+
+
+def offline_robot(team='Team One', mission_type='DATA'):
+    """A robot set up as begin() would leave it, without a link."""
+    robot = new_robot()
+    robot._set_team(team, mission_type, 3, 1116)
+    robot._rx = bytearray(robot._rx_size)
+    robot._scan = vs.scan_buffer()
+    robot._held_buf = bytearray(robot._rx_size)
+    robot.history = posehistory.PoseHistory()
+    robot._init_outbox()
+    return robot
+
+
+def decode(robot, data):
+    robot._rx[:len(data)] = data
+    robot._apply_frame(robot._rx, len(data))
+
+
+@pytest.mark.parametrize('mission_type', ['CRASH_SITE', 'DATA', 'MATERIAL', 'FIRE', 'WATER',
+                                          'SEED', 'HYDROGEN'])
+def test_mission_templates_match_the_json_packet(mission_type):
+    robot = offline_robot('Quote "and" ünïcode', mission_type)
+    for call, names in Enes100.MISSION_CALLS[Enes100._mission_value(mission_type)]:
+        for message in names or (0, -12, 3.75):
+            robot.mission(call.lower(), message)
+            template, value, text = robot._missions.pop()
+            opcode, payload = robot._mission_packet(template, value, text)
+            assert json.loads(payload) == {
+                'op': 'mission', 'teamName': robot.team_name,
+                'type': Enes100._mission_value(call),
+                'message': Enes100._mission_value(message) if names else message}
+
+
+def test_print_head_matches_the_json_packet():
+    robot = offline_robot('Team "One"')
+    packet = json.loads(robot._print_head + json.dumps('hi\n').encode() + b'}')
+    assert packet == {'op': 'print', 'teamName': 'Team "One"', 'message': 'hi\n'}
+
+
+def test_mission_rejects_what_the_team_cant_send():
+    robot = offline_robot()
+    with pytest.raises(KeyError):
+        robot.mission('WEIGHT', 1)
+    with pytest.raises(KeyError):
+        robot.mission('MAGNETISM', 'HEAVY')
+    with pytest.raises(TypeError):
+        robot.mission('CYCLE', b'bytes')
+    assert robot._missions == []
+
+
+def test_binary_link_sends_mission_records():
+    robot = offline_robot()
+    robot._binary = True
+    robot.mission('CYCLE', 7)
+    record = robot._mission_packet(*robot._missions.pop())
+    assert record[0] == vs.REC_MISSION
+    assert vs.unpack_mission(record, len(record)) == (0, 7)
+    # a record can't hold a bool, so that one still goes as JSON
+    robot.mission('CYCLE', True)
+    opcode, payload = robot._mission_packet(*robot._missions.pop())
+    assert json.loads(payload)['message'] is True
+
+
+def test_mission_queue_is_bounded():
+    robot = offline_robot()
+    for i in range(20):
+        robot.mission('CYCLE', i)
+    assert [m[1] for m in robot._missions] == list(range(16))
+    assert robot.stats()['missions_dropped'] == 4
+
+
+def test_json_pose_is_decoded():
+    robot = offline_robot()
+    decode(robot, vsstandin.aruco_packet(True, 1.25, 0.5, -0.75).encode())
+    assert robot.get_pose()[:5] == (1.25, 0.5, -0.75, True, 1)
+
+
+def test_json_starting_with_whitespace_is_not_a_record():
+    robot = offline_robot()
+    robot._records = True
+    decode(robot, b'\n' + vsstandin.aruco_packet(True, 2.0, 1.0, 0.0).encode())
+    assert robot.get_pose()[:4] == (2.0, 1.0, 0.0, True)
+
+
+def test_records_are_only_read_after_the_ack():
+    robot = offline_robot()
+    robot._records = True
+    record = bytearray(vs.POSE_SIZE)
+    vs.pack_pose(record, True, 3, 3.0, 1.5, 0.25)
+    decode(robot, record)
+    assert robot.pose_seq == 0
+    decode(robot, vs.pack_ack())
+    assert robot._binary
+    decode(robot, record)
+    assert robot.get_pose()[:4] == (3.0, 1.5, 0.25, True)
+
+
+def test_begin_gets_poses_and_delivers_missions_and_prints(vs):
+    robot = new_robot()
+    robot.begin('Team One', 'DATA', 3, 1116, 5000)
+    wait_until(lambda: robot.pose_seq > 2)
+    x, y, theta, visible = robot.get_pose()[:4]
+    assert visible and 1.4 < x < 2.6 and 0.4 < y < 1.6
+    robot.mission('CYCLE', 4)
+    robot.mission('MAGNETISM', 'NOT_MAGNETIC')
+    robot.print('hello')
+    wait_until(lambda: len(sent(vs, 'mission', 'Team One')) == 2 and sent(vs, 'print', 'Team One'))
+    assert [(p['type'], p['message']) for p in sent(vs, 'mission', 'Team One')] == [(0, 4), (1, 1)]
+    assert sent(vs, 'print', 'Team One')[0]['message'] == 'hello\n'
+    assert sent(vs, 'begin', 'Team One') == [
+        {'op': 'begin', 'teamName': 'Team One', 'aruco': 3, 'teamType': 1}]
+
+
+def test_binary_wire_is_negotiated(vs):
+    robot = new_robot()
+    robot.binary_wire = True
+    robot.begin('Team Two', 'SEED', 5, 1116, 5000)
+    wait_until(lambda: robot._binary and robot.pose_seq > 2)
+    assert clients_of(vs, 'Team Two')[0].binary
+    robot.mission('LOCATION', 'C')
+    wait_until(lambda: sent(vs, 'mission', 'Team Two'))
+    assert sent(vs, 'mission', 'Team Two') == [
+        {'op': 'mission', 'teamName': 'Team Two', 'type': 0, 'message': 'C'}]
+
+
+def test_reserved_opcode_from_the_vs_reconnects(vs):
+    robot = new_robot()
+    robot.begin('Team Three', 'DATA', 3, 1116, 5000)
+    wait_until(lambda: robot.pose_seq > 0)
+    clients_of(vs, 'Team Three')[0].send(0x3, b'junk')
+    wait_until(lambda: robot.reconnects == 1 and len(clients_of(vs, 'Team Three')) == 2)
+    assert robot.is_connected()
+
+
+def test_reserved_opcode_reconnects_in_async_mode(vs):
+    robot = new_robot()
+
+    async def run():
+        await robot.begin_async('Team Four', 'DATA', 3, 1116, 5000)
+        await robot.next_pose()
+        clients_of(vs, 'Team Four')[0].send(0x3, b'junk')
+        end = time.monotonic() + TIMEOUT_S
+        while not (robot.reconnects == 1 and len(clients_of(vs, 'Team Four')) == 2):
+            assert time.monotonic() < end, 'no reconnect'
+            await asyncio.sleep(0.01)
+        assert robot.is_connected()
+        await robot.end_async()
+    asyncio.run(run())
+
+
+def test_replay_then_begin_sends_each_mission_once(vs, tmp_path):
+    """replay() and begin() share one sender thread, a second one would send missions twice."""
+    path = str(tmp_path / 'run.log')
+    robot = new_robot()
+    robot.record(path)
+    robot.begin('Recorded', 'DATA', 3, 1116, 5000)
+    wait_until(lambda: robot.pose_seq > 5)
+    robot.stop_recording()
+
+    robot = new_robot()
+    robot.replay(path, 0)
+    wait_until(lambda: robot.pose_seq > 5 and not robot.is_connected())
+    assert robot.team_name == 'Recorded'
+    robot.begin('Live', 'DATA', 3, 1116, 5000)
+    for i in range(400):
+        robot.mission('CYCLE', i)
+        if i % 8 == 7:
+            time.sleep(0.02)
+    wait_until(lambda: len(sent(vs, 'mission', 'Live')) >= 400)
+    time.sleep(0.2)
+    assert [p['message'] for p in sent(vs, 'mission', 'Live')] == list(range(400))
@@ -0,0 +1,245 @@
+"""
+uwebsockets framing, on a socket pair: the client side is the library,
+the other end writes and reads raw frames.
+"""
+
+import struct
+import threading
+import time
+
+import pytest
+import uwebsockets as web
+import vsstandin
+from conftest import wire_frame, TIMEOUT_S
+
+MASK = b'\x37\xfa\x21\x3d'
+
+
+@pytest.mark.parametrize('size', [0, 1, 125, 126, 1024, 65535, 65536])
+def test_sent_frames_are_masked_and_whole(pair, size):
+    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    pair.ws.send(payload)
+    fin, opcode, data = pair.read()
+    assert (fin, opcode, data) == (True, web.OP_BYTES, payload)
+
+
+def test_text_is_sent_as_utf8(pair):
+    pair.ws.send('café')
+    assert pair.read() == (True, web.OP_TEXT, 'café'.encode())
+
+
+@pytest.mark.parametrize('size', [5, 126, 300])
+def test_recv_into_unmasks_masked_frames(pair, size):
+    payload = bytes(i & 0xff for i in range(size))
+    pair.ws.max_size = 512
+    pair.send(wire_frame(web.OP_BYTES, payload, mask=MASK))
+    opcode, n = pair.ws.recv_into()
+    assert opcode == web.OP_BYTES
+    assert bytes(pair.ws._rx[:n]) == payload
+
+
+def test_fragmented_message_is_put_back_together(pair):
+    pair.send(wire_frame(web.OP_TEXT, b'hel', fin=False) +
+              wire_frame(web.OP_CONT, b'lo ', fin=False, mask=MASK) +
+              wire_frame(web.OP_CONT, b'world'))
+    assert pair.ws.recv() == 'hello world'
+
+
+def test_ping_between_fragments_is_answered(pair):
+    pair.send(wire_frame(web.OP_TEXT, b'a', fin=False) +
+              wire_frame(web.OP_PING, b'hi') +
+              wire_frame(web.OP_CONT, b'b'))
+    assert pair.ws.recv() == 'ab'
+    assert pair.read() == (True, web.OP_PONG, b'hi')
+
+
+def test_control_frame_returned_with_control_set(pair):
+    pongs = []
+    pair.ws.on_pong = lambda data: pongs.append(bytes(data))
+    pair.send(wire_frame(web.OP_PONG, b'\x01\x02'))
+    assert pair.ws.recv_into(control=True) == (web.OP_PONG, 0)
+    assert pongs == [b'\x01\x02']
+
+
+def test_oversized_message_is_dropped_and_the_next_one_read(pair):
+    buf = bytearray(64)
+    pair.send(wire_frame(web.OP_BYTES, bytes(100)) +
+              wire_frame(web.OP_TEXT, b'x' * 40, fin=False) +
+              wire_frame(web.OP_CONT, b'y' * 40) +
+              wire_frame(web.OP_TEXT, b'fits'))
+    opcode, n = pair.ws.recv_into(buf)
+    assert (opcode, bytes(buf[:n])) == (web.OP_TEXT, b'fits')
+    assert pair.ws.oversized == 2
+
+
+def test_max_size_bounds_recv_and_read_frame(pair):
+    pair.ws.max_size = 16
+    pair.send(wire_frame(web.OP_BYTES, bytes(17)) + wire_frame(web.OP_BYTES, bytes(16)))
+    assert pair.ws.read_frame() == (True, web.OP_BYTES, None)
+    assert pair.ws.recv() == bytes(16)
+    assert pair.ws.oversized == 1
+
+
+def test_continuation_of_nothing_is_a_protocol_error(pair):
+    pair.send(wire_frame(web.OP_CONT, b'stray'))
+    with pytest.raises(web.ConnectionClosed):
+        pair.ws.recv_into()
+    fin, opcode, data = pair.read()
+    assert opcode == web.OP_CLOSE
+    assert struct.unpack('!H', data[:2])[0] == web.CLOSE_PROTOCOL_ERROR
+
+
+@pytest.mark.parametrize('opcode', [0x3, 0x7, 0xb, 0xf])
+def test_reserved_opcode_closes_with_protocol_error(pair, opcode):
+    pair.send(wire_frame(opcode, b'junk'))
+    with pytest.raises(web.ConnectionClosed):
+        pair.ws.recv_into()
+    assert not pair.ws.open
+    fin, op, data = pair.read()
+    assert op == web.OP_CLOSE
+    assert struct.unpack('!H', data[:2])[0] == web.CLOSE_PROTOCOL_ERROR
+
+
+def test_fragmented_control_frame_closes(pair):
+    pair.send(wire_frame(web.OP_PING, b'x', fin=False))
+    opcode, n = pair.ws.recv_into()
+    assert opcode == web.OP_CLOSE
+    assert not pair.ws.open
+
+
+def test_close_frame_from_peer(pair):
+    pair.send(wire_frame(web.OP_CLOSE, struct.pack('!H', web.CLOSE_GOING_AWAY)))
+    assert pair.ws.recv_into() == (web.OP_CLOSE, 0)
+    assert not pair.ws.open
+
+
+def test_send_many_packs_every_message(pair):
+    pair.ws.send_many(['one', b'\x02', (web.OP_TEXT, b'three')])
+    assert [pair.read() for _ in range(3)] == [
+        (True, web.OP_TEXT, b'one'), (True, web.OP_BYTES, b'\x02'), (True, web.OP_TEXT, b'three')]
+
+
+def test_threads_sending_at_once_never_interleave_frames(pair):
+    """The shared writer lock: every frame arrives whole, pongs included."""
+    count = 200
+    big = bytes(range(256)) * 8
+
+    def sender(tag):
+        for i in range(count):
+            pair.ws.send(tag + big)
+
+    def ponger():
+        for i in range(count):
+            pair.ws._send_control(web.OP_PONG, b'p%d' % (i % 10))
+
+    threads = [threading.Thread(target=sender, args=(b'A',)),
+               threading.Thread(target=sender, args=(b'B',)),
+               threading.Thread(target=ponger)]
+    for t in threads:
+        t.start()
+    frames = {web.OP_BYTES: 0, web.OP_PONG: 0}
+    for _ in range(2 * count + count):
+        fin, opcode, data = pair.read()
+        frames[opcode] += 1
+        if opcode == web.OP_BYTES:
+            assert data[1:] == big and data[:1] in (b'A', b'B')
+        else:
+            assert data[:1] == b'p'
+        # handed-over pongs replace ones not sent yet, so fewer may arrive
+        if frames[web.OP_BYTES] == 2 * count:
+            break
+    for t in threads:
+        t.join(TIMEOUT_S)
+    assert frames[web.OP_BYTES] == 2 * count
+    assert frames[web.OP_PONG] + pair.ws.control_handoffs >= 1
+
+
+def parse(parser, data):
+    """Feed data to a FrameParser and return every frame it gives back."""
+    space = parser.space()
+    space[:len(data)] = data
+    parser.feed(len(data))
+    frames = []
+    while True:
+        frame = parser.next_frame()
+        if not frame:
+            return frames
+        fin, opcode, payload = frame
+        frames.append((fin, opcode, None if payload is None else bytes(payload)))
+
+
+def test_frame_parser_unmasks_masked_frames():
+    payload = b'masked from the VS'
+    assert parse(web.FrameParser(64), wire_frame(web.OP_TEXT, payload, mask=MASK)) == [
+        (True, web.OP_TEXT, payload)]
+
+
+def test_frame_parser_waits_for_the_rest_of_a_frame():
+    parser = web.FrameParser(64)
+    data = wire_frame(web.OP_BYTES, b'0123456789', mask=MASK)
+    assert parse(parser, data[:7]) == []
+    assert parse(parser, data[7:]) == [(True, web.OP_BYTES, b'0123456789')]
+
+
+def test_frame_parser_skips_a_frame_too_big_for_its_buffer():
+    parser = web.FrameParser(32)
+    big = wire_frame(web.OP_BYTES, bytes(100))
+    frames = parse(parser, big[:20])
+    assert frames == [(True, web.OP_BYTES, None)]
+    rest = big[20:] + wire_frame(web.OP_TEXT, b'next')
+    frames = []
+    while rest:
+        chunk, rest = rest[:len(parser.space())], rest[len(parser.space()):]
+        frames += parse(parser, chunk)
+    assert frames == [(True, web.OP_TEXT, b'next')]
+
+
+class StallingServer:
+    """Answers the upgrade one header line every step_s, never finishing."""
+
+    def __init__(self, step_s):
+        import socket
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(2)
+        self.url = 'ws://127.0.0.1:%d/' % self.listener.getsockname()[1]
+        self.step_s = step_s
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        try:
+            sock, _ = self.listener.accept()
+        except OSError:
+            return
+        with sock:
+            sock.recv(1024)
+            try:
+                sock.sendall(b'HTTP/1.1 101 Switching Protocols\r\n')
+                for i in range(100):
+                    time.sleep(self.step_s)
+                    sock.sendall(b'X-Slow: %d\r\n' % i)
+            except OSError:
+                pass
+
+    def close(self):
+        self.listener.close()
+
+
+def test_connect_timeout_covers_the_whole_handshake():
+    server = StallingServer(0.1)
+    start = time.monotonic()
+    try:
+        with pytest.raises(OSError):
+            web.connect(server.url, 500)
+    finally:
+        server.close()
+    assert time.monotonic() - start < 1.5
+
+
+def test_connect_to_the_stand_in(vs):
+    timing = {}
+    ws = web.connect(vs.url, 2000, timing)
+    try:
+        assert ws.open and 'tcp_ms' in timing and 'upgrade_ms' in timing
+    finally:
+        ws.close()
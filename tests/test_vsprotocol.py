@@ -0,0 +1,136 @@
+"""
+vsprotocol: the aruco scanner, its JSON fallback and the binary records.
+
+The host has no viper, so vsprotocol itself uses the fallback scanner.
+viper_vsprotocol() loads the module a second time with viper turned into a
+plain decorator and ptr8/ptr32 into plain indexing, which runs the scanner
+the board uses as ordinary Python.
+"""
+
+import importlib.util
+import json
+import random
+import sys
+import types
+
+import pytest
+import vsprotocol as vs
+
+
+@pytest.fixture(scope='module')
+def viper_vsprotocol():
+    fake = types.ModuleType('micropython')
+    fake.viper = lambda f: f
+    saved = sys.modules.get('micropython')
+    sys.modules['micropython'] = fake
+    try:
+        spec = importlib.util.spec_from_file_location('vsprotocol_viper', vs.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.modules['micropython'] = saved
+    module.ptr8 = module.ptr32 = lambda buf: buf
+    assert module.scan_aruco is not vs.scan_aruco
+    return module
+
+
+def scanned(module, text):
+    """(visible, x, y, theta) the way Enes100._decode_frame reads a scan, or None."""
+    buf = bytearray(text.encode())
+    out = module.scan_buffer()
+    if not module.scan_aruco(buf, len(buf), out):
+        return None
+    bits = out[vs.SCAN_BITS]
+
+    def value(slot, bit):
+        return out[slot] / vs.POW10[out[slot + 1]] if bits & bit else -1.0
+    return (out[vs.SCAN_VISIBLE] == 1, value(vs.SCAN_X, vs.BIT_X),
+            value(vs.SCAN_Y, vs.BIT_Y), value(vs.SCAN_THETA, vs.BIT_THETA))
+
+
+def aruco(visible, x, y, theta):
+    return json.dumps({'op': 'aruco', 'aruco': {'visible': visible, 'x': x, 'y': y, 'theta': theta}})
+
+
+def test_scanners_agree_with_json(viper_vsprotocol):
+    rng = random.Random(7)
+    for _ in range(300):
+        pose = (rng.random() < 0.8, round(rng.uniform(0, 4), 3), round(rng.uniform(0, 2), 3),
+                round(rng.uniform(-3.1416, 3.1416), 3))
+        text = aruco(*pose)
+        for module in (vs, viper_vsprotocol):
+            got = scanned(module, text)
+            assert got is not None, text
+            assert got[0] == pose[0]
+            assert got[1:] == pytest.approx(pose[1:], abs=1e-9), text
+
+
+def test_viper_scanner_leaves_exponents_to_json(viper_vsprotocol):
+    text = '{"op": "aruco", "aruco": {"visible": true, "x": 1.5e0, "y": 0.5, "theta": 0}}'
+    assert scanned(viper_vsprotocol, text) is None
+    assert scanned(vs, text) == (True, 1.5, 0.5, 0.0)
+
+
+def test_scanners_leave_nulls_to_json(viper_vsprotocol):
+    text = '{"op": "aruco", "aruco": {"visible": true, "x": null, "y": 0.5, "theta": 0}}'
+    assert scanned(vs, text) is None
+    assert scanned(viper_vsprotocol, text) is None
+
+
+def test_scanners_ignore_other_ops(viper_vsprotocol):
+    text = '{"op": "markers", "markers": [{"id": 100, "visible": true, "x": 1.0}]}'
+    assert scanned(vs, text) is None
+    assert scanned(viper_vsprotocol, text) is None
+
+
+def test_scanners_read_an_invisible_pose(viper_vsprotocol):
+    text = aruco(False, -1, -1, -1)
+    for module in (vs, viper_vsprotocol):
+        assert scanned(module, text) == (False, -1.0, -1.0, -1.0)
+
+
+def test_is_aruco():
+    text = b' {\n"op" : "aruco", "aruco": {}}'
+    assert vs.is_aruco(text, len(text))
+    text = b'{"op": "print"}'
+    assert not vs.is_aruco(text, len(text))
+    record = bytearray(vs.POSE_SIZE)
+    vs.pack_pose(record, True, 3, 1.0, 1.0, 0.0)
+    assert vs.is_aruco(record, len(record))
+
+
+def test_pose_record_round_trip():
+    buf = bytearray(vs.POSE_SIZE)
+    vs.pack_pose(buf, True, 513, 3.25, 0.5, -1.571)
+    assert vs.unpack_pose(buf) == (True, 513, 3.25, 0.5, -1.571)
+    vs.pack_pose(buf, False, 7, 1.0, 1.0, 1.0)
+    assert vs.unpack_pose(buf) == (False, 7, -1.0, -1.0, -1.0)
+    assert vs.is_record(buf, len(buf))
+
+
+@pytest.mark.parametrize('message', [0, -5, 0x7fffffff, 'BLUE'])
+def test_mission_record_round_trip(message):
+    record = vs.pack_mission(4, message)
+    assert vs.fits_mission(message)
+    assert vs.unpack_mission(record, len(record)) == (4, message)
+
+
+def test_float_mission_record():
+    record = vs.pack_mission(1, 2.5)
+    assert vs.unpack_mission(record, len(record)) == (1, 2.5)
+
+
+@pytest.mark.parametrize('message', [True, 1 << 40, [1, 2], None])
+def test_messages_a_record_cant_hold(message):
+    assert not vs.fits_mission(message)
+
+
+def test_print_record_round_trip():
+    text = 'héllo\n'.encode()
+    record = vs.pack_print(text, len(text))
+    assert vs.unpack_print(record, len(record)) == 'héllo\n'
+
+
+def test_json_text_is_not_a_record():
+    assert not vs.is_record(b'{"op": "aruco"}', 15)
+    assert not vs.is_record(b'', 0)